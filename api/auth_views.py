@@ -8,7 +8,7 @@ from django.conf import settings
 
 from .models import OTPCode, CaregiverRelationship
 from .serializers import UserSerializer
-from .services import SMSPortalService
+from .sms_queue import sms_queue
 
 User = get_user_model()
 
@@ -56,10 +56,11 @@ def send_otp(request):
     print(f'⏰ Valid for: 10 minutes')
     print(f'{"="*60}\n')
 
-    # Always send OTP via SMS
-    sms_result = SMSPortalService.send_otp(f'+{clean_phone}', otp.code)
+    # Always send OTP via SMS.  The send happens in the background and its
+    # outcome is recorded on the OTP, so a slow gateway can't hold up this request.
+    sms_queued = sms_queue.enqueue_otp(otp)
 
-    if sms_result['success']:
+    if sms_queued:
         return Response({
             'message': 'OTP sent successfully',
             'phone_number': clean_phone,
@@ -70,7 +71,7 @@ def send_otp(request):
     else:
         # Even if SMS fails, allow development to continue
         if settings.DEBUG:
-            print(f'⚠️ SMS sending failed: {sms_result["error"]}')
+            print(f'⚠️ SMS queue is full')
             print(f'✅ Continuing in development mode - use OTP from console')
             return Response({
                 'message': 'OTP sent successfully (console only - SMS failed)',
@@ -81,8 +82,8 @@ def send_otp(request):
             })
         else:
             return Response(
-                {'error': sms_result['error']},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'SMS service is busy, please try again shortly'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
 
 
@@ -0,0 +1,95 @@
+"""
+Local stand-in for the SMS Portal HTTP API.
+
+Speaks the same ``EventID|Status|Credits`` protocol as the real gateway,
+with configurable latency and failure rates, and records every message it
+accepts.  Point ``SMS_PORTAL_ENDPOINT`` at it to exercise the SMS queue
+without sending real messages.
+"""
+import itertools
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class _GatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, like the real gateway
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.gateway.lock:
+            self.server.gateway.connections += 1
+
+    def do_GET(self):
+        gateway = self.server.gateway
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+
+        if gateway.latency:
+            time.sleep(gateway.latency)
+
+        roll = gateway.random.random()
+        if roll < gateway.failure_rate:
+            self._reply(503, 'Service Unavailable')
+            return
+        if roll < gateway.failure_rate + gateway.error_rate:
+            self._reply(200, '0|Error|Invalid destination number')
+            return
+
+        with gateway.lock:
+            event_id = next(gateway.event_ids)
+            gateway.messages.append((params.get('numto'), params.get('data1'), event_id))
+        self._reply(200, f'{event_id}|OK|100.0')
+
+    def _reply(self, status, body):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSMSGateway:
+    """Threaded HTTP server imitating SMS Portal's send endpoint"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, error_rate=0.0, seed=None):
+        """
+        Args:
+            port: 0 picks a free port
+            latency: Seconds to wait before answering each request
+            failure_rate: Fraction of requests answered with HTTP 503
+            error_rate: Fraction of requests answered with a gateway error
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.messages = []      # (number, text, event id) of every accepted message
+        self.connections = 0
+        self.event_ids = itertools.count(10000)
+        self.server = ThreadingHTTPServer((host, port), _GatewayHandler)
+        self.server.daemon_threads = True
+        self.server.gateway = self
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/api5/http5.aspx'
+
+    def start(self):
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,74 @@
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api.fake_sms_gateway import FakeSMSGateway
+from api.services import SMSPortalService
+from api.sms_queue import SMSQueue
+
+
+class Command(BaseCommand):
+    help = 'Send messages through the SMS queue to a local fake gateway and report throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--latency', type=float, default=0.05, help='Gateway response time in seconds')
+        parser.add_argument('--failure-rate', type=float, default=0.1, help='Fraction of HTTP 503 responses')
+        parser.add_argument('--baseline', type=int, default=50,
+                            help='Messages sent inline on fresh connections for comparison')
+
+    def handle(self, *args, **options):
+        gateway = FakeSMSGateway(
+            latency=options['latency'],
+            failure_rate=options['failure_rate'],
+            seed=42
+        ).start()
+        total = options['messages']
+
+        try:
+            with override_settings(SMS_PORTAL_ENDPOINT=gateway.endpoint):
+                self.stdout.write(
+                    f'📱 SMS queue benchmark ({total} messages, {options["workers"]} workers, '
+                    f'{options["latency"] * 1000:.0f}ms gateway latency, {options["failure_rate"]:.0%} 503s)'
+                )
+
+                # What send_otp used to do: one blocking send on a new connection per request
+                baseline = options['baseline']
+                if baseline:
+                    start = time.perf_counter()
+                    for i in range(baseline):
+                        SMSPortalService.send_sms(f'+2782000{i:04d}', 'baseline', session=requests.Session())
+                    inline = (time.perf_counter() - start) / baseline
+                    self.stdout.write(f'  inline send:   {inline * 1000:8.1f} ms per request')
+
+                gateway.messages.clear()
+                connections_before = gateway.connections
+                queue = SMSQueue(workers=options['workers'], max_pending=total, max_attempts=5, retry_backoff=0.05)
+
+                start = time.perf_counter()
+                for i in range(total):
+                    if not queue.enqueue(f'+2783000{i:04d}', f'Benchmark message {i}'):
+                        raise CommandError(f'Queue rejected message {i}')
+                enqueued = time.perf_counter() - start
+                if not queue.join(timeout=300):
+                    raise CommandError('Timed out waiting for the queue to drain')
+                elapsed = time.perf_counter() - start
+                queue.shutdown(timeout=10)
+        finally:
+            gateway.stop()
+
+        metrics = queue.metrics()
+        self.stdout.write(f'  enqueue:       {enqueued / total * 1e6:8.1f} µs per request')
+        self.stdout.write(f'  drained in:    {elapsed:8.2f} s ({total / elapsed:.0f} msg/s)')
+        self.stdout.write(
+            f'  sent {metrics["sent"]}, failed {metrics["failed"]}, retries {metrics["retried"]}, '
+            f'gateway accepted {len(gateway.messages)}'
+        )
+        self.stdout.write(f'  connections:   {gateway.connections - connections_before} for {total} messages')
+
+        if metrics['sent'] != len(gateway.messages):
+            raise CommandError('Sent count does not match what the gateway accepted')
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark complete'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from api.fake_sms_gateway import FakeSMSGateway
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake SMS Portal gateway for development'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8025)
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds before each response')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction answered with HTTP 503')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction answered with a gateway error')
+
+    def handle(self, *args, **options):
+        gateway = FakeSMSGateway(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            failure_rate=options['failure_rate'],
+            error_rate=options['error_rate'],
+        )
+        self.stdout.write(f'📡 Fake SMS gateway listening on {gateway.endpoint}')
+        self.stdout.write(f'   Set SMS_PORTAL_ENDPOINT={gateway.endpoint} to send through it')
+        try:
+            gateway.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            gateway.server.server_close()
+        self.stdout.write(self.style.SUCCESS(f'✅ Gateway stopped after accepting {len(gateway.messages)} messages'))
@@ -80,6 +80,12 @@ class OTPCode(models.Model):
         ('verify_phone', 'Verify Phone'),
     ]
 
+    DELIVERY_STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
     phone_number = models.CharField(max_length=15)
     code = models.CharField(max_length=6)
     purpose = models.CharField(max_length=20, choices=PURPOSE_CHOICES)
@@ -88,6 +94,13 @@ class OTPCode(models.Model):
     expires_at = models.DateTimeField()
     verified_at = models.DateTimeField(blank=True, null=True)
 
+    # SMS delivery, written back by the SMS queue
+    delivery_status = models.CharField(max_length=20, choices=DELIVERY_STATUS_CHOICES, default='pending')
+    delivery_attempts = models.PositiveSmallIntegerField(default=0)
+    delivery_reference = models.CharField(max_length=100, blank=True)  # Gateway event ID
+    delivery_error = models.TextField(blank=True)
+    delivered_at = models.DateTimeField(blank=True, null=True)
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
@@ -1,7 +1,14 @@
+from datetime import timedelta
+
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
 from drivers.models import Driver, DriverLocation
+from bookings.eta import estimate_trip_minutes
 from bookings.models import Booking
+from pricing.promos import PromoCodeError, redeem_promo_code
 from .models import ElderlyMember, CaregiverRelationship
 
 User = get_user_model()
@@ -100,6 +107,7 @@ class BookingSerializer(serializers.ModelSerializer):
             'status',
             'payment_status',
             'booking_time',
+            'scheduled_for',
             'pickup_time',
             'dropoff_time',
             'special_requirements',
@@ -107,7 +115,7 @@ class BookingSerializer(serializers.ModelSerializer):
             'driver_rating',
             'feedback',
         ]
-        read_only_fields = ['id', 'passenger', 'booking_time', 'pickup_time', 'dropoff_time']
+        read_only_fields = ['id', 'passenger', 'booking_time', 'scheduled_for', 'pickup_time', 'dropoff_time']
 
     def get_elderly_member(self, obj):
         """Return elderly member details if present"""
@@ -123,6 +131,7 @@ class BookingSerializer(serializers.ModelSerializer):
 class BookingCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating bookings"""
     elderly_member = serializers.IntegerField(required=False, write_only=True)
+    promo_code = serializers.CharField(required=False, allow_blank=True, write_only=True, max_length=50)
 
     class Meta:
         model = Booking
@@ -139,12 +148,45 @@ class BookingCreateSerializer(serializers.ModelSerializer):
             'fare_amount',
             'special_requirements',
             'elderly_member',
+            'scheduled_for',
+            'promo_code',
         ]
+        # Estimated by the server; a value sent by the client is ignored
+        read_only_fields = ['estimated_duration_minutes']
+
+    def validate_scheduled_for(self, value):
+        """Advance bookings need enough notice to find a driver, and not too much"""
+        if value is None:
+            return value
+        now = timezone.now()
+        if value < now + timedelta(minutes=settings.SCHEDULED_BOOKING_MIN_NOTICE_MINUTES):
+            raise serializers.ValidationError(
+                f"Scheduled rides must be booked at least {settings.SCHEDULED_BOOKING_MIN_NOTICE_MINUTES} minutes ahead."
+            )
+        if value > now + timedelta(days=settings.SCHEDULED_BOOKING_MAX_ADVANCE_DAYS):
+            raise serializers.ValidationError(
+                f"Rides can be scheduled at most {settings.SCHEDULED_BOOKING_MAX_ADVANCE_DAYS} days ahead."
+            )
+        return value
 
     def create(self, validated_data):
         elderly_member_id = validated_data.pop('elderly_member', None)
+        promo_code = validated_data.pop('promo_code', None)
         validated_data['passenger'] = self.context['request'].user
 
+        # Advance bookings wait for the scheduler to start matching
+        if validated_data.get('scheduled_for'):
+            validated_data['status'] = 'scheduled'
+
+        # Durations come from the ETA model, not the client
+        validated_data['estimated_duration_minutes'] = estimate_trip_minutes(
+            validated_data['pickup_latitude'],
+            validated_data['pickup_longitude'],
+            validated_data['dropoff_latitude'],
+            validated_data['dropoff_longitude'],
+            validated_data.get('scheduled_for'),
+        )
+
         # If elderly_member ID is provided, fetch and assign it
         if elderly_member_id:
             try:
@@ -156,7 +198,15 @@ class BookingCreateSerializer(serializers.ModelSerializer):
             except ElderlyMember.DoesNotExist:
                 pass  # Silently ignore if not found
 
-        return super().create(validated_data)
+        # The promo code's use is claimed with the booking, or neither is saved
+        with transaction.atomic():
+            booking = super().create(validated_data)
+            if promo_code:
+                try:
+                    redeem_promo_code(promo_code, booking.passenger, booking)
+                except PromoCodeError as e:
+                    raise serializers.ValidationError({'promo_code': [str(e)]})
+        return booking
 
 
 class DriverLocationUpdateSerializer(serializers.ModelSerializer):
@@ -1,22 +1,23 @@
 import requests
 from django.conf import settings
-from urllib.parse import urlencode
 
 
 class SMSPortalService:
     """Service for sending SMS via SMS Portal API"""
 
     @staticmethod
-    def send_sms(phone_number, message):
+    def send_sms(phone_number, message, session=None):
         """
         Send SMS using SMS Portal API
 
         Args:
             phone_number: Phone number in international format (e.g., +27821234567)
             message: SMS message text
+            session: Optional requests.Session, so keep-alive connections are reused
 
         Returns:
-            dict: Response from SMS Portal API
+            dict: Response from SMS Portal API.  Failures worth retrying
+            (timeouts, connection errors, gateway 5xx) carry ``retryable: True``.
         """
         try:
             # Clean phone number (remove + and spaces)
@@ -31,15 +32,24 @@ class SMSPortalService:
                 'data1': message,
             }
 
-            # Build URL with parameters
-            url = f"{settings.SMS_PORTAL_ENDPOINT}?{urlencode(params)}"
-
             # Send request
-            response = requests.get(url, timeout=30)
+            response = (session or requests).get(
+                settings.SMS_PORTAL_ENDPOINT,
+                params=params,
+                timeout=(settings.SMS_CONNECT_TIMEOUT, settings.SMS_READ_TIMEOUT)
+            )
 
             print(f'📱 SMS sent to {phone_number}')
             print(f'📨 Response: {response.text}')
 
+            if response.status_code >= 500:
+                return {
+                    'success': False,
+                    'error': f'SMS service returned HTTP {response.status_code}',
+                    'response': response.text,
+                    'retryable': True
+                }
+
             # Parse response
             # SMS Portal returns format: EventID|Status|Credits
             # Example success: "12345|OK|95.5"
@@ -75,12 +85,14 @@ class SMSPortalService:
         except requests.exceptions.Timeout:
             return {
                 'success': False,
-                'error': 'SMS service timeout'
+                'error': 'SMS service timeout',
+                'retryable': True
             }
         except requests.exceptions.RequestException as e:
             return {
                 'success': False,
-                'error': f'SMS service error: {str(e)}'
+                'error': f'SMS service error: {str(e)}',
+                'retryable': True
             }
         except Exception as e:
             return {
@@ -100,5 +112,9 @@ class SMSPortalService:
         Returns:
             dict: Response from SMS Portal API
         """
-        message = f"Your CareConnect verification code is: {otp_code}. Valid for 10 minutes. Do not share this code."
-        return SMSPortalService.send_sms(phone_number, message)
+        return SMSPortalService.send_sms(phone_number, SMSPortalService.otp_message(otp_code))
+
+    @staticmethod
+    def otp_message(otp_code):
+        """Text of the OTP SMS"""
+        return f"Your CareConnect verification code is: {otp_code}. Valid for 10 minutes. Do not share this code."
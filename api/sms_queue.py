@@ -0,0 +1,225 @@
+"""
+Background queue for outbound SMS.
+
+Sending an SMS means a round trip to the gateway that can take seconds, so
+request handlers only enqueue the message and return.  A fixed pool of
+worker threads sends queued messages through one shared ``requests.Session``,
+reusing keep-alive connections to the gateway, and the pool size bounds how
+many sends are in flight at once.  Timeouts, connection errors and gateway
+5xx responses are retried with exponential backoff; the outcome of OTP sends
+is written back to the ``OTPCode`` row.  ``shutdown`` stops taking new
+messages, lets the workers finish what is queued and stops them.
+"""
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .services import SMSPortalService
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SMSJob:
+    phone_number: str
+    message: str
+    otp_id: int = None
+    attempts: int = 0
+
+
+class SMSQueue:
+    """Bounded SMS send queue served by a pool of worker threads"""
+
+    def __init__(self, workers=4, max_pending=1000, max_attempts=3, retry_backoff=1.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._jobs = []         # heap of (not_before, seq, job), so retries wait their turn
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._threads = []
+        self._pid = None
+        self._stopping = False
+        self.session = None
+        self.stats = {
+            'enqueued': 0,
+            'rejected': 0,
+            'sent': 0,
+            'failed': 0,
+            'retried': 0,
+        }
+
+    def enqueue(self, phone_number, message, otp_id=None):
+        """
+        Queue an SMS.  Returns False without queueing when the queue is full
+        or shutting down.
+        """
+        self.ensure_started()
+        with self._lock:
+            if self._stopping or len(self._jobs) + self._in_flight >= self.max_pending:
+                self.stats['rejected'] += 1
+                return False
+            self._push(SMSJob(phone_number, message, otp_id), time.monotonic())
+            self.stats['enqueued'] += 1
+        return True
+
+    def enqueue_otp(self, otp):
+        """Queue the SMS carrying an OTPCode"""
+        return self.enqueue(f'+{otp.phone_number}', SMSPortalService.otp_message(otp.code), otp_id=otp.id)
+
+    def _push(self, job, not_before):
+        heapq.heappush(self._jobs, (not_before, next(self._seq), job))
+        self._ready.notify_all()
+
+    def ensure_started(self):
+        """Start the worker pool in this process if it is not running yet"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child inherits no running threads, so start afresh
+            self._pid = os.getpid()
+            self._stopping = False
+            self._jobs = []
+            self._in_flight = 0
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self._threads = [
+                threading.Thread(target=self._work, name=f'sms-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+        for thread in self._threads:
+            thread.start()
+
+    def _next_job(self):
+        """The next job due, or None once shutting down with nothing left to send"""
+        with self._lock:
+            while True:
+                if self._stopping and not self._jobs:
+                    return None
+                if self._jobs:
+                    wait = self._jobs[0][0] - time.monotonic()
+                    if wait <= 0:
+                        _, _, job = heapq.heappop(self._jobs)
+                        self._in_flight += 1
+                        return job
+                    self._ready.wait(wait)
+                else:
+                    self._ready.wait()
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._send(job)
+            except Exception:
+                logger.exception('SMS worker failed on a message to %s', job.phone_number)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._ready.notify_all()
+                close_old_connections()
+
+    def _send(self, job):
+        job.attempts += 1
+        result = SMSPortalService.send_sms(job.phone_number, job.message, session=self.session)
+
+        if not result['success'] and result.get('retryable') and job.attempts < self.max_attempts:
+            # Exponential backoff with jitter so retries don't arrive in lockstep
+            delay = self.retry_backoff * 2 ** (job.attempts - 1) * random.uniform(0.5, 1.5)
+            logger.warning('SMS to %s failed (%s), retrying in %.1fs', job.phone_number, result['error'], delay)
+            with self._lock:
+                self.stats['retried'] += 1
+                self._push(job, time.monotonic() + delay)
+            return
+
+        with self._lock:
+            self.stats['sent' if result['success'] else 'failed'] += 1
+        if not result['success']:
+            logger.error('SMS to %s failed after %d attempts: %s', job.phone_number, job.attempts, result['error'])
+        if job.otp_id is not None:
+            self._record_delivery(job, result)
+
+    @staticmethod
+    def _record_delivery(job, result):
+        from .models import OTPCode
+
+        if result['success']:
+            OTPCode.objects.filter(id=job.otp_id).update(
+                delivery_status='sent',
+                delivery_attempts=job.attempts,
+                delivery_reference=result.get('event_id', ''),
+                delivery_error='',
+                delivered_at=timezone.now()
+            )
+        else:
+            OTPCode.objects.filter(id=job.otp_id).update(
+                delivery_status='failed',
+                delivery_attempts=job.attempts,
+                delivery_error=result['error']
+            )
+
+    def join(self, timeout=None):
+        """Wait until every queued message has been sent or has failed; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._jobs or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._ready.wait(remaining)
+        return True
+
+    def shutdown(self, timeout=None):
+        """
+        Stop taking messages, send what is already queued (retries included)
+        and stop the workers.  Returns False if they are still busy after
+        ``timeout`` seconds; the next ``enqueue`` starts a fresh pool.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return True
+            self._stopping = True
+            self._ready.notify_all()
+            threads = self._threads
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        if any(thread.is_alive() for thread in threads):
+            return False
+
+        with self._lock:
+            self._pid = None
+            self._threads = []
+            self.session.close()
+        return True
+
+    def metrics(self):
+        with self._lock:
+            return {**self.stats, 'pending': len(self._jobs), 'in_flight': self._in_flight}
+
+
+sms_queue = SMSQueue(
+    workers=settings.SMS_QUEUE_WORKERS,
+    max_pending=settings.SMS_QUEUE_MAX_PENDING,
+    max_attempts=settings.SMS_MAX_ATTEMPTS,
+    retry_backoff=settings.SMS_RETRY_BACKOFF,
+)
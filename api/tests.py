@@ -1,3 +1,166 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .fake_sms_gateway import FakeSMSGateway
+from .models import OTPCode
+from .sms_queue import SMSQueue
+
+
+class FakeGatewayMixin:
+    """Runs a local ``FakeSMSGateway`` and points the SMS settings at it"""
+
+    gateway_options = {}
+
+    def setUp(self):
+        super().setUp()
+        self.gateway = FakeSMSGateway(seed=1, **self.gateway_options).start()
+        self.addCleanup(self.gateway.stop)
+        endpoint = override_settings(SMS_PORTAL_ENDPOINT=self.gateway.endpoint, SMS_READ_TIMEOUT=5)
+        endpoint.enable()
+        self.addCleanup(endpoint.disable)
+
+    def make_queue(self, **options):
+        queue = SMSQueue(**{'workers': 4, 'max_attempts': 3, 'retry_backoff': 0.01, **options})
+        self.addCleanup(queue.shutdown, 5)
+        return queue
+
+    def send(self, queue, count):
+        for i in range(count):
+            self.assertTrue(queue.enqueue(f'+2782{i:07d}', f'Message {i}'))
+        self.assertTrue(queue.join(timeout=10))
+        return queue.metrics()
+
+
+class SMSQueueDeliveryTests(FakeGatewayMixin, SimpleTestCase):
+
+    def test_every_message_reaches_the_gateway(self):
+        metrics = self.send(self.make_queue(), 40)
+
+        self.assertEqual(metrics['sent'], 40)
+        self.assertEqual(metrics['failed'], 0)
+        self.assertEqual(metrics['retried'], 0)
+        self.assertEqual(
+            sorted(text for _, text, _ in self.gateway.messages),
+            sorted(f'Message {i}' for i in range(40))
+        )
+
+    def test_workers_reuse_their_connections(self):
+        self.send(self.make_queue(workers=2), 40)
+
+        self.assertLessEqual(self.gateway.connections, 2)
+
+    def test_full_queue_rejects_messages(self):
+        queue = self.make_queue(workers=1, max_pending=2)
+        self.gateway.latency = 0.2
+
+        accepted = [queue.enqueue(f'+2782{i:07d}', 'Hello') for i in range(5)]
+
+        self.assertEqual(accepted.count(True), 2)
+        self.assertEqual(queue.metrics()['rejected'], 3)
+
+
+class SMSQueueRetryTests(FakeGatewayMixin, SimpleTestCase):
+    gateway_options = {'failure_rate': 0.5}
+
+    def test_gateway_errors_are_retried(self):
+        metrics = self.send(self.make_queue(max_attempts=10), 30)
+
+        self.assertGreater(metrics['retried'], 0)
+        self.assertEqual(metrics['sent'] + metrics['failed'], 30)
+        self.assertEqual(metrics['sent'], len(self.gateway.messages))
+
+    def test_gives_up_after_max_attempts(self):
+        self.gateway.failure_rate = 1.0
+        metrics = self.send(self.make_queue(max_attempts=3), 5)
+
+        self.assertEqual(metrics['failed'], 5)
+        self.assertEqual(metrics['retried'], 5 * 2)
+        self.assertEqual(self.gateway.messages, [])
+
+    def test_rejected_messages_are_not_retried(self):
+        self.gateway.failure_rate = 0.0
+        self.gateway.error_rate = 1.0
+        metrics = self.send(self.make_queue(), 5)
+
+        self.assertEqual(metrics['failed'], 5)
+        self.assertEqual(metrics['retried'], 0)
+
+
+class SMSQueueShutdownTests(FakeGatewayMixin, SimpleTestCase):
+
+    def test_shutdown_sends_what_is_queued_and_stops_the_workers(self):
+        self.gateway.latency = 0.02
+        queue = self.make_queue(workers=2)
+        for i in range(10):
+            queue.enqueue(f'+2782{i:07d}', f'Message {i}')
+        threads = list(queue._threads)
+
+        self.assertTrue(queue.shutdown(timeout=10))
+
+        self.assertEqual(queue.metrics()['sent'], 10)
+        self.assertEqual(len(self.gateway.messages), 10)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+
+    def test_shutdown_waits_for_pending_retries(self):
+        self.gateway.failure_rate = 1.0
+        queue = self.make_queue(workers=1, max_attempts=3, retry_backoff=0.05)
+        queue.enqueue('+27820000000', 'Hello')
+
+        self.assertTrue(queue.shutdown(timeout=10))
+
+        self.assertEqual(queue.metrics()['retried'], 2)
+        self.assertEqual(queue.metrics()['failed'], 1)
+
+    def test_messages_are_refused_while_shutting_down(self):
+        self.gateway.latency = 0.3
+        queue = self.make_queue(workers=1)
+        queue.enqueue('+27820000000', 'Hello')
+
+        self.assertFalse(queue.shutdown(timeout=0.05))
+        self.assertFalse(queue.enqueue('+27820000001', 'Too late'))
+        self.assertTrue(queue.shutdown(timeout=5))
+
+    def test_enqueue_after_shutdown_starts_a_new_pool(self):
+        queue = self.make_queue(workers=1)
+        self.send(queue, 1)
+        self.assertTrue(queue.shutdown(timeout=5))
+
+        self.assertEqual(self.send(queue, 1)['sent'], 2)
+
+
+class OTPDeliveryTests(FakeGatewayMixin, TransactionTestCase):
+
+    def create_otp(self):
+        return OTPCode.objects.create(
+            phone_number='27820000000',
+            code='123456',
+            purpose='login',
+            expires_at=timezone.now() + timedelta(minutes=5),
+        )
+
+    def test_delivery_is_recorded_on_the_otp(self):
+        otp = self.create_otp()
+        queue = self.make_queue(workers=1)
+
+        queue.enqueue_otp(otp)
+        self.assertTrue(queue.join(timeout=10))
+
+        otp.refresh_from_db()
+        self.assertEqual(otp.delivery_status, 'sent')
+        self.assertEqual(otp.delivery_attempts, 1)
+        self.assertEqual(otp.delivery_reference, str(self.gateway.messages[0][2]))
+        self.assertIn('123456', self.gateway.messages[0][1])
+
+    def test_failed_delivery_is_recorded_on_the_otp(self):
+        self.gateway.failure_rate = 1.0
+        otp = self.create_otp()
+        queue = self.make_queue(workers=1, max_attempts=2)
+
+        queue.enqueue_otp(otp)
+        self.assertTrue(queue.join(timeout=10))
+
+        otp.refresh_from_db()
+        self.assertEqual(otp.delivery_status, 'failed')
+        self.assertEqual(otp.delivery_attempts, 2)
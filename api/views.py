@@ -6,6 +6,7 @@ from django.contrib.auth.models import User
 
 from drivers.models import Driver, DriverLocation
 from bookings.models import Booking
+from bookings.services import AssignmentService
 from .models import ElderlyMember, CaregiverRelationship
 from .serializers import (
     UserSerializer,
@@ -122,9 +123,9 @@ class BookingViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def active(self, request):
-        """Get active bookings (pending, confirmed, in_progress)"""
+        """Get active bookings (scheduled, pending, confirmed, in_progress)"""
         bookings = self.get_queryset().filter(
-            status__in=['pending', 'confirmed', 'in_progress']
+            status__in=['scheduled', 'pending', 'confirmed', 'in_progress']
         )
         serializer = self.get_serializer(bookings, many=True)
         return Response(serializer.data)
@@ -147,17 +148,13 @@ class BookingViewSet(viewsets.ModelViewSet):
         """Cancel a booking"""
         booking = self.get_object()
 
-        if booking.status not in ['pending', 'confirmed']:
+        # Conditional, so an assignment made meanwhile is never overwritten
+        if not AssignmentService.cancel(booking.id, reason=request.data.get('reason', '')):
             return Response({
                 'error': 'Cannot cancel booking in current status'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        booking.status = 'cancelled'
-        booking.cancellation_reason = request.data.get('reason', '')
-        from django.utils import timezone
-        booking.cancelled_at = timezone.now()
-        booking.save()
-
+        booking.refresh_from_db()
         return Response({
             'message': 'Booking cancelled successfully',
             'booking': self.get_serializer(booking).data
@@ -176,13 +173,19 @@ class BookingViewSet(viewsets.ModelViewSet):
                 'error': 'Driver not found or not verified'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        booking.driver = driver
-        booking.status = 'confirmed'
-        booking.save()
+        result = AssignmentService.assign(booking.id, driver.id)
 
-        # Update driver status
-        driver.status = 'busy'
-        driver.save()
+        if result == AssignmentService.BOOKING_UNAVAILABLE:
+            return Response({
+                'error': 'Booking is no longer pending'
+            }, status=status.HTTP_409_CONFLICT)
+
+        if result == AssignmentService.DRIVER_UNAVAILABLE:
+            return Response({
+                'error': 'Driver is busy with another ride'
+            }, status=status.HTTP_409_CONFLICT)
+
+        booking.refresh_from_db()
 
         return Response({
             'message': 'Driver assigned successfully',
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Booking
+from .models import Booking, TravelSpeedBucket
 
 
 @admin.register(Booking)
@@ -11,9 +11,10 @@ class BookingAdmin(admin.ModelAdmin):
         'status',
         'payment_status',
         'fare_amount',
-        'booking_time'
+        'booking_time',
+        'scheduled_for'
     ]
-    list_filter = ['status', 'payment_status', 'booking_time']
+    list_filter = ['status', 'payment_status', 'booking_time', 'scheduled_for']
     search_fields = [
         'passenger__username',
         'passenger__email',
@@ -43,7 +44,7 @@ class BookingAdmin(admin.ModelAdmin):
             'fields': ('status', 'payment_status')
         }),
         ('Timestamps', {
-            'fields': ('booking_time', 'pickup_time', 'dropoff_time', 'cancelled_at'),
+            'fields': ('booking_time', 'scheduled_for', 'pickup_time', 'dropoff_time', 'cancelled_at'),
             'classes': ('collapse',)
         }),
         ('Additional Information', {
@@ -60,3 +61,17 @@ class BookingAdmin(admin.ModelAdmin):
         """Optimize queryset with select_related"""
         qs = super().get_queryset(request)
         return qs.select_related('passenger', 'driver', 'driver__user')
+
+
+@admin.register(TravelSpeedBucket)
+class TravelSpeedBucketAdmin(admin.ModelAdmin):
+    """Read-only view of the ETA model's training data"""
+
+    list_display = ['hour_of_week', 'cell_row', 'cell_col', 'trip_count', 'total_km', 'total_minutes', 'last_trip_at']
+    list_filter = ['hour_of_week']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
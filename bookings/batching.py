@@ -0,0 +1,235 @@
+"""
+Batched driver matching for peak demand.
+
+Greedy matching offers every booking to its own nearest drivers the moment
+it is made, so the first booking can take the only driver near the next
+one.  With ``MATCHING_MODE = 'batched'`` bookings arriving within
+``MATCHING_BATCH_WINDOW`` seconds are collected and paired with drivers all
+at once.  The pairing minimises the batch's total pickup distance: the
+Hungarian method over a driver-by-rider distance matrix.
+
+Each booking then opens with a single offer to its assigned driver, who is
+held back from every other booking for the length of that offer.  If the
+driver declines or lets it lapse, the booking falls back to the usual
+widening waves (see ``bookings.dispatch``).
+
+Only pairs within ``MATCHING_BATCH_RADIUS_KM`` are allowed.  Bookings with
+no candidate drivers in common are solved separately, so a batch spread
+across a city costs the sum of its neighbourhoods, not the cube of its size.
+A worker only batches bookings made on its own sockets.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+
+from drivers.presence import presence
+from drivers.spatial_index import driver_index
+from geo.distance import haversine_many_to_many
+
+logger = logging.getLogger(__name__)
+
+# Cost of a pair outside the search radius; the solver only takes one when it must
+UNMATCHED_COST = 1e9
+
+
+def min_cost_assignment(cost):
+    """
+    Minimum total cost one-to-one assignment of a rectangular cost matrix.
+
+    Shortest augmenting paths with row and column potentials (the Hungarian
+    method), O(n^2 m) with the column scan vectorised.  Every row is
+    matched when there are no more rows than columns, every column
+    otherwise.  Returns ``(rows, cols)`` index arrays sorted by row.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.shape[0] > cost.shape[1]:
+        cols, rows = min_cost_assignment(cost.T)
+        order = np.argsort(rows)
+        return rows[order], cols[order]
+
+    n, m = cost.shape
+    # Column 0 is a virtual start column; rows are numbered from 1
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=np.intp)     # column -> row assigned to it, 0 for none
+    way = np.zeros(m + 1, dtype=np.intp)
+
+    for row in range(1, n + 1):
+        match[0] = row
+        col = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[col] = True
+            current = match[col]
+            free = ~used
+            reduced = cost[current - 1] - u[current] - v[1:]
+            better = free[1:] & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = col
+
+            slack = np.where(free, minv, np.inf)
+            slack[0] = np.inf
+            next_col = int(np.argmin(slack))
+            delta = slack[next_col]
+            u[match[used]] += delta
+            v[used] -= delta
+            minv[free] -= delta
+
+            col = next_col
+            if match[col] == 0:
+                break
+
+        # Flip the augmenting path
+        while col:
+            previous = way[col]
+            match[col] = match[previous]
+            col = previous
+
+    cols = np.nonzero(match[1:])[0]
+    rows = match[1:][cols] - 1
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def assign_batch(pickups, index, k=20, radius_km=20, where=None):
+    """
+    A driver for each pickup, minimising the batch's total pickup distance.
+
+    Args:
+        pickups: list of ``(lat, lon)``
+        index: ``DriverSpatialIndex`` to draw available drivers from
+        k: nearest drivers per pickup that may join the batch
+        radius_km: furthest a driver may be from a pickup
+        where: optional driver id predicate, as for ``index.nearest``
+
+    Returns:
+        list: ``(driver_id, distance_km)`` or None per pickup
+    """
+    candidates = [index.nearest(lat, lon, k=k, radius_km=radius_km, where=where) for lat, lon in pickups]
+
+    # Pickups sharing a candidate driver, directly or through others, are solved together
+    parent = list(range(len(pickups)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    first_seen = {}
+    for i, found in enumerate(candidates):
+        for driver_id, _ in found:
+            if driver_id in first_seen:
+                parent[find(i)] = find(first_seen[driver_id])
+            else:
+                first_seen[driver_id] = i
+
+    groups = defaultdict(list)
+    for i, found in enumerate(candidates):
+        if found:
+            groups[find(i)].append(i)
+
+    result = [None] * len(pickups)
+    for members in groups.values():
+        driver_ids = list(dict.fromkeys(driver_id for i in members for driver_id, _ in candidates[i]))
+        if len(members) == 1:
+            # Nothing to trade off: the nearest driver it is
+            result[members[0]] = candidates[members[0]][0]
+            continue
+
+        points = np.array([pickups[i] for i in members], dtype=np.float64)
+        positions = index.positions(driver_ids)
+        distances = haversine_many_to_many(points[:, 0], points[:, 1], positions[:, 0], positions[:, 1])
+        # NaN (a driver gone from the index) compares False and is ruled out too
+        cost = np.where(distances <= radius_km, distances, UNMATCHED_COST)
+
+        rows, cols = min_cost_assignment(cost)
+        for row, col in zip(rows, cols):
+            if cost[row, col] < UNMATCHED_COST:
+                result[members[row]] = (driver_ids[col], float(cost[row, col]))
+    return result
+
+
+class BatchMatcher:
+    """Collects bookings for a short window and pairs the batch with drivers at once"""
+
+    def __init__(self, window=2.0, candidates=20, radius_km=20, index=None):
+        self.window = window
+        self.candidates = candidates
+        self.radius_km = radius_km
+        self.index = index or driver_index
+        self._waiting = []      # ((lat, lon), hold seconds, future)
+        self._flush = None
+        self._reserved = {}     # driver id -> monotonic time their hold lapses
+        self.stats = {'batches': 0, 'bookings': 0, 'matched': 0, 'solve_ms_max': 0.0}
+
+    def is_reserved(self, driver_id):
+        until = self._reserved.get(driver_id)
+        return until is not None and until > time.monotonic()
+
+    def is_matchable(self, driver_id):
+        """Whether greedy matching may offer the driver a ride"""
+        return presence.is_matchable(driver_id) and not self.is_reserved(driver_id)
+
+    def release(self, driver_id):
+        self._reserved.pop(driver_id, None)
+
+    async def request(self, lat, lon, hold):
+        """
+        Join the next batch.  Returns the driver assigned to the pickup, who
+        is held back from other bookings for ``hold`` seconds, or None.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiting.append(((lat, lon), hold, future))
+        if self._flush is None:
+            self._flush = loop.call_later(self.window, lambda: loop.create_task(self._solve()))
+        return await future
+
+    async def _solve(self):
+        waiting, self._waiting, self._flush = self._waiting, [], None
+        # Passengers who cancelled while waiting drop out of the batch
+        waiting = [entry for entry in waiting if not entry[2].done()]
+        if not waiting:
+            return
+
+        now = time.monotonic()
+        self._reserved = {driver_id: until for driver_id, until in self._reserved.items() if until > now}
+        started = time.perf_counter()
+        try:
+            results = await asyncio.to_thread(
+                assign_batch,
+                [pickup for pickup, _, _ in waiting],
+                self.index,
+                k=self.candidates,
+                radius_km=self.radius_km,
+                where=self.is_matchable,
+            )
+        except Exception:
+            logger.exception(f'Batch of {len(waiting)} bookings could not be solved')
+            results = [None] * len(waiting)
+
+        self.stats['batches'] += 1
+        self.stats['bookings'] += len(waiting)
+        self.stats['solve_ms_max'] = max(self.stats['solve_ms_max'], (time.perf_counter() - started) * 1000)
+
+        now = time.monotonic()
+        for (_, hold, future), result in zip(waiting, results):
+            driver_id = result[0] if result else None
+            if driver_id is not None:
+                self._reserved[driver_id] = now + hold
+                self.stats['matched'] += 1
+            if not future.done():
+                future.set_result(driver_id)
+
+
+batch_matcher = BatchMatcher(
+    window=settings.MATCHING_BATCH_WINDOW,
+    candidates=settings.MATCHING_BATCH_CANDIDATES,
+    radius_km=settings.MATCHING_BATCH_RADIUS_KM,
+)
@@ -1,58 +1,121 @@
-import json
 import asyncio
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth.models import User
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from decimal import Decimal
-import math
 
+from api.models import CaregiverRelationship
+from care_connect_backend.websocket_auth import (
+    CLOSE_FORBIDDEN, CLOSE_UNAUTHENTICATED, auth_required, is_authenticated
+)
+from care_connect_backend.wire import WireProtocolMixin
+from pricing.promos import PromoCodeError, redeem_promo_code, release_promo_redemption
+from .eta import estimate_trip_minutes
+from .events import caregiver_group, ride_events
+from .matching import BookingMatcher, driver_assigned_data
 from .models import Booking
-from drivers.models import Driver, DriverLocation
+from .scheduler import booking_scheduler
+from .tracking import TrackingStream, ride_tracker
 
+User = get_user_model()
 
-class RideMatchingConsumer(AsyncWebsocketConsumer):
+
+class RideMatchingConsumer(WireProtocolMixin, AsyncWebsocketConsumer):
     """WebSocket consumer for real-time ride matching"""
 
     async def connect(self):
         self.ride_id = self.scope['url_route']['kwargs']['ride_id']
         self.ride_group_name = f'ride_{self.ride_id}'
+        self.booking = None
+        self.booking_group_name = None
+        self.matcher = None
+        self.dispatcher = None
+        self.dispatch_task = None
+        self.tracked_rides = set()
+        self.tracking_streams = {}  # ride id -> TrackingStream
+
+        # How the caller relates to the ride is settled once, here
+        if is_authenticated(self.scope):
+            self.scope['ride_role'] = await self.get_ride_role()
+            if self.scope['ride_role'] is None:
+                print(f'❌ WebSocket refused for ride {self.ride_id}: not a party to it')
+                await self.close(code=CLOSE_FORBIDDEN)
+                return
+        elif auth_required():
+            await self.close(code=CLOSE_UNAUTHENTICATED)
+            return
+        else:
+            self.scope['ride_role'] = 'passenger'
+
+        if settings.BOOKING_SCHEDULER_IN_PROCESS:
+            booking_scheduler.ensure_started()
+
+        # Join ride group; a new ride's id only becomes a group once it is booked
+        if self.scope['ride_role'] != 'new':
+            await self.channel_layer.group_add(
+                self.ride_group_name,
+                self.channel_name
+            )
 
-        # Join ride group
-        await self.channel_layer.group_add(
-            self.ride_group_name,
-            self.channel_name
-        )
-
-        await self.accept()
+        await self.accept_with_codec()
         print(f'✅ WebSocket connected for ride: {self.ride_id}')
 
+        # Reconnecting to a booked ride resumes its driver position stream
+        if self.ride_id.isdigit() and self.scope['ride_role'] != 'new':
+            self.track_ride(int(self.ride_id))
+
         # Send initial connection message
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'connection_established',
             'message': 'Connected to ride matching service',
             'ride_id': self.ride_id
-        }))
+        })
 
     async def disconnect(self, close_code):
+        # Stop offering the ride; outstanding offers are withdrawn and the
+        # booking expires
+        if self.dispatch_task and not self.dispatch_task.done():
+            self.dispatch_task.cancel()
+
         # Leave ride group
         await self.channel_layer.group_discard(
             self.ride_group_name,
             self.channel_name
         )
+        if self.booking_group_name:
+            await self.channel_layer.group_discard(self.booking_group_name, self.channel_name)
+        for stream in self.tracking_streams.values():
+            stream.close()
+        for ride_id in self.tracked_rides:
+            ride_tracker.unsubscribe(ride_id)
         print(f'❌ WebSocket disconnected for ride: {self.ride_id}')
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming WebSocket messages"""
-        data = json.loads(text_data)
+        data = self.decode_message(text_data, bytes_data)
         message_type = data.get('type')
 
         if message_type == 'ping':
             # Respond to ping
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'pong',
                 'timestamp': timezone.now().isoformat()
-            }))
+            })
+
+        elif message_type == 'find_driver' and self.scope['ride_role'] == 'driver':
+            await self.send_message({
+                'type': 'error',
+                'message': 'Drivers cannot book rides here'
+            })
+
+        elif message_type == 'cancel_ride' and self.scope['ride_role'] != 'passenger':
+            await self.send_message({
+                'type': 'error',
+                'message': 'Only the passenger can cancel the ride'
+            })
 
         elif message_type == 'find_driver':
             # Start finding a driver
@@ -64,196 +127,179 @@ class RideMatchingConsumer(AsyncWebsocketConsumer):
             await self.cancel_ride()
 
     async def find_nearest_driver(self, data):
-        """Find the nearest available driver"""
+        """Create the booking and start offering it to nearby drivers"""
+        if self.dispatch_task and not self.dispatch_task.done():
+            await self.send_message({
+                'type': 'error',
+                'message': 'Already searching for a driver'
+            })
+            return
+
         try:
             # Create booking in database
             booking = await self.create_booking(data)
 
             if not booking:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     'type': 'error',
                     'message': 'Failed to create booking'
-                }))
+                })
                 return
 
+            self.booking = booking
+            # Whoever booked the ride is its passenger
+            self.scope['ride_role'] = 'passenger'
+
+            # Driver responses and positions are addressed to the booking's group
+            if f'ride_{booking.id}' != self.ride_group_name:
+                self.booking_group_name = f'ride_{booking.id}'
+                await self.channel_layer.group_add(self.booking_group_name, self.channel_name)
+            self.track_ride(booking.id)
+
             # Send searching status
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'searching',
                 'message': 'Searching for available drivers...',
                 'ride_id': self.ride_id
-            }))
+            })
 
-            # Find nearby drivers
-            nearby_drivers = await self.get_nearby_drivers(
-                float(data['pickup_latitude']),
-                float(data['pickup_longitude'])
-            )
+            self.matcher = BookingMatcher(booking, self.channel_layer)
+            self.dispatcher = self.matcher.dispatcher
+            # Run in the background so driver responses and cancellations
+            # can reach this consumer while the search is in progress
+            self.dispatch_task = asyncio.create_task(self.run_dispatch(booking))
 
-            if not nearby_drivers:
-                await self.send(text_data=json.dumps({
-                    'type': 'no_drivers',
-                    'message': 'No drivers available nearby'
-                }))
-                return
+        except Exception as e:
+            print(f'❌ Error finding driver: {e}')
+            await self.send_message({
+                'type': 'error',
+                'message': str(e)
+            })
 
-            # Notify drivers about the ride
-            for driver in nearby_drivers[:5]:  # Notify top 5 closest drivers
-                await self.notify_driver(driver, booking)
+    async def run_dispatch(self, booking):
+        """Wait for the dispatcher and report the outcome to the passenger"""
+        try:
+            result = await self.matcher.run()
 
-            # Simulate driver acceptance (for testing - remove in production)
-            # In production, drivers will accept via their own WebSocket
-            await asyncio.sleep(3)
+            if result.status == 'assigned':
+                driver = self.matcher.driver(result.driver_id)
+                print(f'✅ Ride {booking.id} assigned to driver {driver.id} after {result.elapsed:.1f}s')
+                await self.driver_assigned(driver, booking, self.matcher.pickup_minutes)
 
-            # For now, auto-assign the first driver
-            await self.assign_driver(nearby_drivers[0], booking)
+            elif result.status in ('exhausted', 'timeout'):
+                await self.send_message({
+                    'type': 'no_drivers',
+                    'message': 'No drivers available nearby'
+                })
 
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             print(f'❌ Error finding driver: {e}')
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': str(e)
-            }))
+            })
+
+    @database_sync_to_async
+    def get_ride_role(self):
+        """
+        'passenger', 'driver' or 'caregiver' for a party to an existing ride,
+        'new' when no ride has this id yet, None for anyone else.  The ride's
+        group carries the driver's position, so caregivers without
+        ``can_view_location`` are left to follow it on ``ws/caregiver/``.
+        """
+        user = self.scope['user']
+        if not self.ride_id.isdigit():
+            return 'new'
+        ride = Booking.objects.filter(id=self.ride_id).values_list(
+            'passenger_id', 'driver__user_id', 'elderly_member__caregiver_id'
+        ).first()
+        if ride is None:
+            return 'new'
+
+        passenger_id, driver_user_id, member_caregiver_id = ride
+        if user.id == passenger_id:
+            return 'passenger'
+        if user.id == driver_user_id:
+            return 'driver'
+        if user.id == member_caregiver_id or CaregiverRelationship.objects.filter(
+            passenger_id=passenger_id, caregiver_id=user.id, is_active=True, can_view_location=True
+        ).exists():
+            return 'caregiver'
+        return None
 
     @database_sync_to_async
     def create_booking(self, data):
         """Create a booking in the database"""
         try:
-            # For testing, use first user (in production, use authenticated user)
-            passenger = User.objects.first()
-
-            booking = Booking.objects.create(
-                passenger=passenger,
-                passenger_phone=data.get('passenger_phone', ''),
-                pickup_latitude=Decimal(str(data['pickup_latitude'])),
-                pickup_longitude=Decimal(str(data['pickup_longitude'])),
-                pickup_address=data['pickup_address'],
-                dropoff_latitude=Decimal(str(data['dropoff_latitude'])),
-                dropoff_longitude=Decimal(str(data['dropoff_longitude'])),
-                dropoff_address=data['dropoff_address'],
-                distance_km=Decimal(str(data.get('distance_km', 0))),
-                estimated_duration_minutes=data.get('estimated_duration_minutes', 0),
-                fare_amount=Decimal(str(data.get('fare_amount', 0))),
-                status='pending'
-            )
+            if is_authenticated(self.scope):
+                passenger = self.scope['user']
+            else:
+                # Unauthenticated connections are only allowed with WEBSOCKET_AUTH_REQUIRED off
+                passenger = User.objects.first()
+
+            # The promo code's use is claimed with the booking, or neither is saved
+            with transaction.atomic():
+                booking = Booking.objects.create(
+                    passenger=passenger,
+                    passenger_phone=data.get('passenger_phone') or passenger.phone_number,
+                    pickup_latitude=Decimal(str(data['pickup_latitude'])),
+                    pickup_longitude=Decimal(str(data['pickup_longitude'])),
+                    pickup_address=data['pickup_address'],
+                    dropoff_latitude=Decimal(str(data['dropoff_latitude'])),
+                    dropoff_longitude=Decimal(str(data['dropoff_longitude'])),
+                    dropoff_address=data['dropoff_address'],
+                    distance_km=Decimal(str(data.get('distance_km', 0))),
+                    # Estimated here rather than taken from the client
+                    estimated_duration_minutes=estimate_trip_minutes(
+                        data['pickup_latitude'], data['pickup_longitude'],
+                        data['dropoff_latitude'], data['dropoff_longitude']
+                    ),
+                    fare_amount=Decimal(str(data.get('fare_amount', 0))),
+                    status='pending'
+                )
+                if data.get('promo_code'):
+                    redeem_promo_code(data['promo_code'], passenger, booking)
             print(f'✅ Booking created: #{booking.id}')
             return booking
+        except PromoCodeError:
+            # Shown to the passenger as is
+            raise
         except Exception as e:
             print(f'❌ Error creating booking: {e}')
             return None
 
-    @database_sync_to_async
-    def get_nearby_drivers(self, pickup_lat, pickup_lon, radius_km=10):
-        """Get available drivers within radius"""
-        available_drivers = Driver.objects.filter(
-            status='available',
-            is_verified=True,
-            location__isnull=False
-        ).select_related('location')
-
-        nearby = []
-        for driver in available_drivers:
-            distance = self.calculate_distance(
-                pickup_lat,
-                pickup_lon,
-                float(driver.location.latitude),
-                float(driver.location.longitude)
-            )
-            if distance <= radius_km:
-                nearby.append({
-                    'driver': driver,
-                    'distance': distance
-                })
-
-        # Sort by distance
-        nearby.sort(key=lambda x: x['distance'])
-        return [item['driver'] for item in nearby]
-
-    def calculate_distance(self, lat1, lon1, lat2, lon2):
-        """Calculate distance between two points using Haversine formula"""
-        lat1_rad = math.radians(lat1)
-        lat2_rad = math.radians(lat2)
-        lon1_rad = math.radians(lon1)
-        lon2_rad = math.radians(lon2)
-
-        dlon = lon2_rad - lon1_rad
-        dlat = lat2_rad - lat1_rad
-        a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
-        c = 2 * math.asin(math.sqrt(a))
-
-        r = 6371  # Radius of earth in kilometers
-        return c * r
-
-    async def notify_driver(self, driver, booking):
-        """Send ride request to driver's WebSocket channel"""
-        print(f'📢 Notifying driver: {driver.user.get_full_name()} (Phone: {driver.user.phone_number})')
-
-        # Send ride request to driver's WebSocket group
-        driver_group_name = f'driver_{driver.user.phone_number}'
-
-        await self.channel_layer.group_send(
-            driver_group_name,
-            {
-                'type': 'ride_request',
-                'data': {
-                    'type': 'ride_request',
-                    'ride_id': str(booking.id),
-                    'passenger_name': booking.passenger.get_full_name(),
-                    'passenger_phone': booking.passenger.phone_number,
-                    'pickup_address': booking.pickup_address,
-                    'dropoff_address': booking.dropoff_address,
-                    'pickup_latitude': float(booking.pickup_latitude),
-                    'pickup_longitude': float(booking.pickup_longitude),
-                    'dropoff_latitude': float(booking.dropoff_latitude),
-                    'dropoff_longitude': float(booking.dropoff_longitude),
-                    'distance': float(booking.distance_km),
-                    'fare': float(booking.fare_amount),
-                    'estimated_duration': booking.estimated_duration_minutes,
-                }
-            }
-        )
-
-    @database_sync_to_async
-    def assign_driver(self, driver, booking):
-        """Assign driver to booking"""
-        booking.driver = driver
-        booking.status = 'confirmed'
-        booking.save()
-
-        driver.status = 'busy'
-        driver.total_rides += 1
-        driver.save()
-
-        return booking
-
-    async def driver_assigned(self, driver, booking):
+    async def driver_assigned(self, driver, booking, pickup_minutes=None):
         """Send driver assigned notification"""
-        await self.send(text_data=json.dumps({
-            'type': 'driver_assigned',
-            'message': 'Driver found!',
-            'booking_id': booking.id,
-            'driver': {
-                'id': driver.id,
-                'name': driver.user.get_full_name(),
-                'phone': driver.phone_number,
-                'vehicle_type': driver.vehicle_type,
-                'vehicle_registration': driver.vehicle_registration,
-                'rating': float(driver.rating),
-                'latitude': float(driver.location.latitude) if hasattr(driver, 'location') else None,
-                'longitude': float(driver.location.longitude) if hasattr(driver, 'location') else None,
-            }
-        }))
+        await self.send_message(driver_assigned_data(driver, booking, pickup_minutes))
 
-    @database_sync_to_async
-    def cancel_ride(self):
+    async def cancel_ride(self):
         """Cancel the current ride"""
-        try:
-            booking = Booking.objects.filter(id=self.ride_id, status='pending').first()
-            if booking:
-                booking.status = 'cancelled'
-                booking.cancelled_at = timezone.now()
-                booking.save()
-                return True
+        # Cancelled first, so the stopped search finds nothing left to expire
+        cancelled = await self.cancel_booking()
+        if self.dispatch_task and not self.dispatch_task.done():
+            self.dispatch_task.cancel()
+        return cancelled
+
+    @database_sync_to_async
+    def cancel_booking(self):
+        """Cancel the booking this socket made, while it is still looking for a driver"""
+        if self.booking is None:
             return False
+        # Without authentication the caller is the passenger create_booking picked
+        caller_id = self.scope['user'].id if is_authenticated(self.scope) else self.booking.passenger_id
+        try:
+            cancelled = bool(Booking.objects.filter(
+                id=self.booking.id, passenger_id=caller_id, status='pending'
+            ).update(
+                status='cancelled',
+                cancelled_at=timezone.now()
+            ))
+            if cancelled:
+                release_promo_redemption(self.booking.id)
+                ride_events.status_changed(self.booking.id)
+            return cancelled
         except Exception as e:
             print(f'❌ Error cancelling ride: {e}')
             return False
@@ -261,4 +307,113 @@ class RideMatchingConsumer(AsyncWebsocketConsumer):
     # Handler for messages sent to the group
     async def ride_update(self, event):
         """Send ride update to WebSocket"""
-        await self.send(text_data=json.dumps(event['data']))
+        await self.send_message(event['data'])
+
+    async def driver_position(self, event):
+        """Assigned driver's position, sent at this socket's pace as keyframes and deltas"""
+        stream = self.tracking_streams.get(event['ride_id'])
+        if stream is None:
+            stream = self.tracking_streams[event['ride_id']] = TrackingStream(self.send_message)
+        await stream.push(event)
+
+
+    def track_ride(self, ride_id):
+        if ride_id not in self.tracked_rides:
+            self.tracked_rides.add(ride_id)
+            ride_tracker.subscribe(ride_id)
+
+    async def driver_response(self, event):
+        """Accept/decline from a driver, routed to this ride's dispatcher"""
+        if self.dispatcher and self.booking and str(event['ride_id']) == str(self.booking.id):
+            self.dispatcher.driver_responded(event['driver_id'], event['accepted'])
+
+
+class CaregiverConsumer(WireProtocolMixin, AsyncWebsocketConsumer):
+    """
+    WebSocket consumer for caregivers following their passengers' rides.
+
+    Status changes are forwarded as they happen.  Driver positions are
+    throttled per ride to one every ``CAREGIVER_LOCATION_MIN_INTERVAL``
+    seconds: the newest position wins and is sent when the interval is up,
+    so a caregiver on a slow connection never falls behind the ride.
+    """
+
+    async def connect(self):
+        self.caregiver_id = self.scope['url_route']['kwargs']['caregiver_id']
+        self.caregiver_group_name = caregiver_group(self.caregiver_id)
+        self.min_interval = settings.CAREGIVER_LOCATION_MIN_INTERVAL
+        self.last_location_sent = {}    # ride id -> loop time of the last position sent
+        self.pending_locations = {}     # ride id -> newest position not sent yet
+        self.location_timers = {}       # ride id -> TimerHandle of the trailing send
+
+        if is_authenticated(self.scope):
+            if str(self.scope['user'].id) != self.caregiver_id:
+                await self.close(code=CLOSE_FORBIDDEN)
+                return
+        elif auth_required():
+            await self.close(code=CLOSE_UNAUTHENTICATED)
+            return
+
+        await self.channel_layer.group_add(self.caregiver_group_name, self.channel_name)
+        await self.accept_with_codec()
+        print(f'✅ Caregiver WebSocket connected: {self.caregiver_id}')
+
+        await self.send_message({
+            'type': 'connection_established',
+            'message': 'Connected to ride updates',
+            'caregiver_id': self.caregiver_id
+        })
+
+    async def disconnect(self, close_code):
+        for timer in self.location_timers.values():
+            timer.cancel()
+        await self.channel_layer.group_discard(self.caregiver_group_name, self.channel_name)
+        print(f'❌ Caregiver WebSocket disconnected: {self.caregiver_id}')
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_message(text_data, bytes_data)
+        if data.get('type') == 'ping':
+            await self.send_message({
+                'type': 'pong',
+                'timestamp': timezone.now().isoformat()
+            })
+
+    # Handler for messages sent to the group
+    async def ride_event(self, event):
+        """Ride status or driver position from the ride event router"""
+        data = event['data']
+        if event.get('kind') != 'location':
+            if data.get('status') in ('completed', 'cancelled'):
+                self.forget_ride(data['ride_id'])
+            await self.send_message(data)
+            return
+
+        ride_id = data['ride_id']
+        loop = asyncio.get_running_loop()
+        wait = self.last_location_sent.get(ride_id, float('-inf')) + self.min_interval - loop.time()
+        if wait <= 0:
+            await self.send_location(ride_id, data)
+            return
+
+        self.pending_locations[ride_id] = data
+        if ride_id not in self.location_timers:
+            self.location_timers[ride_id] = loop.call_later(
+                wait, lambda: asyncio.ensure_future(self.flush_location(ride_id))
+            )
+
+    async def flush_location(self, ride_id):
+        self.location_timers.pop(ride_id, None)
+        data = self.pending_locations.pop(ride_id, None)
+        if data is not None:
+            await self.send_location(ride_id, data)
+
+    async def send_location(self, ride_id, data):
+        self.last_location_sent[ride_id] = asyncio.get_running_loop().time()
+        await self.send_message(data)
+
+    def forget_ride(self, ride_id):
+        timer = self.location_timers.pop(ride_id, None)
+        if timer:
+            timer.cancel()
+        self.pending_locations.pop(ride_id, None)
+        self.last_location_sent.pop(ride_id, None)
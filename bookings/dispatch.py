@@ -0,0 +1,170 @@
+"""
+Driver dispatch state machine.
+
+A ``RideDispatcher`` offers one booking to drivers until one of them
+accepts.  It keeps up to ``wave_size`` offers outstanding; whenever a driver
+declines or lets their offer time out, the next candidate is offered the
+ride, and when the current candidate list runs dry the search ring is
+widened.  The first accept is settled by ``try_assign``, which must
+atomically move the booking out of ``pending`` - so two drivers accepting at
+the same moment cannot both win.
+
+All side effects go through the callables passed in, which keeps the
+machine independent of Channels and the ORM and lets it be driven by
+simulated drivers.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class DispatchResult:
+    status: str                  # 'assigned', 'exhausted', 'timeout' or 'lost'
+    driver_id: object = None
+    offered: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+
+class RideDispatcher:
+    """Offer a booking to drivers in waves until the first one accepts"""
+
+    def __init__(self, candidate_rings, send_offers, try_assign, withdraw_offers=None,
+                 wave_size=3, offer_timeout=15.0, max_duration=120.0, first_wave_size=None):
+        """
+        Args:
+            candidate_rings: async callable ``(ring_index, exclude) -> [driver_id, ...]``
+                returning drivers for the given search ring, closest first, or
+                ``None`` once there are no more rings
+            send_offers: async callable ``(driver_ids)`` sending the ride offer
+            try_assign: async callable ``(driver_id)``; must be an atomic
+                compare-and-set that only succeeds while the booking is still
+                pending.  Returns True when assigned, False when the booking
+                is gone, or None when only this driver could not take it
+            withdraw_offers: optional async callable ``(driver_ids)`` telling
+                drivers whose offers are no longer valid
+            first_wave_size: offers outstanding for the first ring until a
+                driver answers or times out; defaults to ``wave_size``
+        """
+        self.candidate_rings = candidate_rings
+        self.send_offers = send_offers
+        self.try_assign = try_assign
+        self.withdraw_offers = withdraw_offers
+        self.wave_size = wave_size
+        self.offer_timeout = offer_timeout
+        self.max_duration = max_duration
+        self.first_wave_size = wave_size if first_wave_size is None else first_wave_size
+
+        self.state = 'idle'
+        self._responses = asyncio.Queue()
+        self._outstanding = {}   # driver id -> offer deadline
+        self._offered = []
+        self._queue = []
+        self._ring = 0
+        self._rings_exhausted = False
+        self._answered = False
+
+    def driver_responded(self, driver_id, accepted):
+        """Feed a driver's accept/decline into the machine"""
+        self._responses.put_nowait((driver_id, bool(accepted)))
+
+    def is_offered(self, driver_id):
+        return driver_id in self._outstanding
+
+    def _wave_limit(self):
+        if self._answered or self._ring > 1:
+            return self.wave_size
+        return self.first_wave_size
+
+    async def _refill(self):
+        """Top the outstanding offers back up to ``wave_size``"""
+        while len(self._outstanding) < self._wave_limit():
+            if not self._queue:
+                if self._rings_exhausted:
+                    break
+                ring = await self.candidate_rings(self._ring, set(self._offered))
+                self._ring += 1
+                if ring is None:
+                    self._rings_exhausted = True
+                    break
+                self._queue = [driver_id for driver_id in ring if driver_id not in self._offered]
+                continue
+
+            wave = []
+            while self._queue and len(self._outstanding) + len(wave) < self._wave_limit():
+                wave.append(self._queue.pop(0))
+            deadline = time.monotonic() + self.offer_timeout
+            for driver_id in wave:
+                self._outstanding[driver_id] = deadline
+                self._offered.append(driver_id)
+            await self.send_offers(wave)
+
+    async def run(self):
+        """Dispatch until a driver is assigned or every candidate has been tried"""
+        try:
+            return await self._run()
+        except asyncio.CancelledError:
+            # Cancelled by the passenger: make sure nobody keeps a stale offer
+            self.state = 'cancelled'
+            await self._withdraw(list(self._outstanding))
+            raise
+
+    async def _run(self):
+        started = time.monotonic()
+        give_up_at = started + self.max_duration
+        self.state = 'offering'
+
+        def finish(status, driver_id=None):
+            self.state = status
+            return DispatchResult(status, driver_id, list(self._offered), time.monotonic() - started)
+
+        await self._refill()
+        while True:
+            now = time.monotonic()
+            if now >= give_up_at:
+                await self._withdraw(list(self._outstanding))
+                return finish('timeout')
+
+            if not self._outstanding:
+                return finish('exhausted')
+
+            wait = min(min(self._outstanding.values()), give_up_at) - now
+            try:
+                driver_id, accepted = await asyncio.wait_for(self._responses.get(), timeout=max(wait, 0))
+            except asyncio.TimeoutError:
+                self._answered = True
+                now = time.monotonic()
+                expired = [d for d, deadline in self._outstanding.items() if deadline <= now]
+                for expired_id in expired:
+                    del self._outstanding[expired_id]
+                await self._withdraw(expired)
+                if now < give_up_at:
+                    await self._refill()
+                continue
+
+            if driver_id not in self._outstanding:
+                # Late or unsolicited response
+                continue
+
+            self._answered = True
+            del self._outstanding[driver_id]
+            if accepted:
+                assigned = await self.try_assign(driver_id)
+                if assigned:
+                    others = list(self._outstanding)
+                    self._outstanding.clear()
+                    await self._withdraw(others)
+                    return finish('assigned', driver_id)
+                await self._withdraw([driver_id])
+                if assigned is False:
+                    # The booking left pending under us (cancelled or assigned elsewhere)
+                    others = list(self._outstanding)
+                    self._outstanding.clear()
+                    await self._withdraw(others)
+                    return finish('lost')
+
+            await self._refill()
+
+    async def _withdraw(self, driver_ids):
+        if driver_ids and self.withdraw_offers:
+            await self.withdraw_offers(driver_ids)
@@ -0,0 +1,313 @@
+"""
+Trip duration estimates learned from completed rides.
+
+Durations used to be a flat two minutes per kilometre.  Completed bookings
+are now aggregated offline (``manage.py rebuild_eta_model``) into
+``TravelSpeedBucket`` rows: trips, straight-line kilometres and minutes per
+hour of the week and pickup cell of ``ETA_CELL_DEGREES``.  Quotes measure
+trips in straight-line kilometres too, so that is what the model learns to
+convert.  It works in pace, minutes per kilometre, so summed minutes over
+summed kilometres weights every trip by its length.
+
+Sparse buckets are shrunk towards their parent: a cell's pace towards its
+hour of the week, the hour towards the whole city, and the city towards
+``ETA_DEFAULT_SPEED_KMH``, each with ``ETA_PRIOR_KM`` kilometres of
+pseudo-evidence.  A cell with a handful of trips barely moves off its hour,
+a busy one speaks for itself, and with no data at all the model gives the
+old estimate.
+
+Estimates are served from an in-memory table: paces as a (168, cells) array
+with the cells as sorted int64 keys, so a batch of trips is estimated with
+one ``searchsorted`` and one fancy index.  Like the pricing rules the table
+is shared by the whole process, rebuilt after a rebuild in this process and
+reloaded at the latest ``ETA_MODEL_TTL`` seconds after one elsewhere.
+"""
+import hashlib
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from geo.distance import haversine_km, haversine_pairwise
+from geo.routing import get_router
+from .models import Booking, TravelSpeedBucket
+
+HOURS_PER_WEEK = 7 * 24
+
+
+def hour_of_week(when):
+    """0 for Monday 00:00-01:00 local time, up to 167"""
+    if timezone.is_aware(when):
+        when = timezone.localtime(when)
+    return when.weekday() * 24 + when.hour
+
+
+def grid_cells(lats, lons, cell_size_deg):
+    """Row and column arrays of the grid cells containing the points"""
+    rows = np.floor(np.asarray(lats, dtype=np.float64) / cell_size_deg).astype(np.int64)
+    cols = np.floor(np.asarray(lons, dtype=np.float64) / cell_size_deg).astype(np.int64)
+    return rows, cols
+
+
+def cell_keys(rows, cols):
+    """One sortable int64 per cell"""
+    return (np.asarray(rows, dtype=np.int64) << 32) + np.asarray(cols, dtype=np.int64)
+
+
+class EtaModel:
+    """Immutable pace table by hour of the week and pickup cell"""
+
+    def __init__(self, buckets, cell_size_deg=0.05, default_speed_kmh=30.0, prior_km=20.0):
+        """
+        Args:
+            buckets: ``(hour_of_week, cell_row, cell_col, total_km, total_minutes, trip_count)`` tuples
+        """
+        self.loaded_at = time.monotonic()
+        self.cell_size_deg = cell_size_deg
+
+        hour_km = np.zeros(HOURS_PER_WEEK)
+        hour_minutes = np.zeros(HOURS_PER_WEEK)
+        columns = {}
+        for hour, row, col, km, minutes, _ in buckets:
+            hour_km[hour] += km
+            hour_minutes[hour] += minutes
+            columns.setdefault((row, col), len(columns))
+
+        self.trips = sum(bucket[5] for bucket in buckets)
+        self.city_pace = (hour_minutes.sum() + prior_km * 60 / default_speed_kmh) / (hour_km.sum() + prior_km)
+        self.hour_pace = (hour_minutes + prior_km * self.city_pace) / (hour_km + prior_km)
+
+        # Cells sorted by key; the table columns follow the same order
+        cells = sorted(columns, key=lambda cell: (cell[0] << 32) + cell[1])
+        self.columns = {cell: index for index, cell in enumerate(cells)}
+        self.cell_keys = cell_keys([row for row, _ in cells], [col for _, col in cells])
+        km = np.zeros((HOURS_PER_WEEK, len(cells)))
+        minutes = np.zeros((HOURS_PER_WEEK, len(cells)))
+        for hour, row, col, bucket_km, bucket_minutes, _ in buckets:
+            index = self.columns[(row, col)]
+            km[hour, index] = bucket_km
+            minutes[hour, index] = bucket_minutes
+        self.cell_pace = (minutes + prior_km * self.hour_pace[:, None]) / (km + prior_km)
+
+        digest = hashlib.sha256(repr(sorted(buckets)).encode())
+        self.version = digest.hexdigest()[:16]
+
+    @classmethod
+    def load(cls):
+        """Build the table from the database"""
+        return cls(
+            list(TravelSpeedBucket.objects.values_list(
+                'hour_of_week', 'cell_row', 'cell_col', 'total_km', 'total_minutes', 'trip_count'
+            )),
+            cell_size_deg=settings.ETA_CELL_DEGREES,
+            default_speed_kmh=settings.ETA_DEFAULT_SPEED_KMH,
+            prior_km=settings.ETA_PRIOR_KM,
+        )
+
+    def pace(self, lat, lon, hour):
+        """Minutes per straight-line kilometre from a pickup at a given hour of the week"""
+        cell = (int(np.floor(float(lat) / self.cell_size_deg)), int(np.floor(float(lon) / self.cell_size_deg)))
+        index = self.columns.get(cell)
+        if index is None:
+            return float(self.hour_pace[hour])
+        return float(self.cell_pace[hour, index])
+
+    def minutes(self, distance_km, lat, lon, when):
+        """Estimated minutes to drive ``distance_km`` from a pickup at ``when``"""
+        return float(distance_km) * self.pace(lat, lon, hour_of_week(when))
+
+    def minutes_many(self, distances_km, lats, lons, hours):
+        """
+        Vectorised ``minutes``.  ``hours`` is an hour of the week or an array
+        of them, one per trip; returns an array of minutes.
+        """
+        distances_km = np.asarray(distances_km, dtype=np.float64)
+        hours = np.broadcast_to(np.asarray(hours, dtype=np.intp), distances_km.shape)
+        pace = self.hour_pace[hours]
+        if self.cell_keys.size:
+            keys = cell_keys(*grid_cells(lats, lons, self.cell_size_deg))
+            index = np.minimum(np.searchsorted(self.cell_keys, keys), self.cell_keys.size - 1)
+            found = self.cell_keys[index] == keys
+            pace = np.where(found, self.cell_pace[hours, index], pace)
+        return distances_km * pace
+
+
+_lock = threading.Lock()
+_model = None
+_generation = 0
+
+
+def get_eta_model():
+    """The current table, loading it if it was invalidated or is too old"""
+    global _model
+    model = _model
+    if model is None or time.monotonic() - model.loaded_at > settings.ETA_MODEL_TTL:
+        with _lock:
+            model = _model
+            if model is None or time.monotonic() - model.loaded_at > settings.ETA_MODEL_TTL:
+                generation = _generation
+                model = EtaModel.load()
+                # Don't keep a table that was invalidated while it loaded
+                if generation == _generation:
+                    _model = model
+    return model
+
+
+def invalidate_eta_model():
+    global _model, _generation
+    _generation += 1
+    _model = None
+
+
+def estimate_trip_minutes(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, when=None):
+    """
+    Whole minutes from pickup to dropoff, leaving at ``when`` (default now).
+    A road route's free-flow time is a floor under the model's estimate.
+    """
+    distance_km = haversine_km(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon)
+    minutes = get_eta_model().minutes(distance_km, pickup_lat, pickup_lon, when or timezone.now())
+    road_minutes = get_router().route(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon).minutes
+    if road_minutes is not None:
+        minutes = max(minutes, road_minutes)
+    return round(minutes)
+
+
+def aggregate_trips(trips, cell_size_deg):
+    """
+    Sum a chunk of completed trips into buckets.
+
+    Args:
+        trips: ``(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, pickup_time, dropoff_time)`` tuples
+
+    Returns:
+        dict: ``(hour_of_week, cell_row, cell_col) -> [trips, km, minutes, last dropoff]``
+    """
+    if not trips:
+        return {}
+    lats, lons, dropoff_lats, dropoff_lons = (
+        np.array([float(trip[i]) for trip in trips]) for i in range(4)
+    )
+    minutes = np.array([(trip[5] - trip[4]).total_seconds() / 60 for trip in trips])
+    hours = np.array([hour_of_week(trip[4]) for trip in trips], dtype=np.int64)
+    km = haversine_pairwise(lats, lons, dropoff_lats, dropoff_lons)
+
+    # GPS glitches and trips left open by mistake would drag the buckets around
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = km / (minutes / 60)
+    keep = (
+        (km >= settings.ETA_MIN_TRIP_KM)
+        & (speed >= settings.ETA_MIN_SPEED_KMH)
+        & (speed <= settings.ETA_MAX_SPEED_KMH)
+    )
+    rows, cols = grid_cells(lats[keep], lons[keep], cell_size_deg)
+    buckets, inverse = np.unique(np.stack([hours[keep], rows, cols], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse, minlength=len(buckets))
+    km_sums = np.bincount(inverse, weights=km[keep], minlength=len(buckets))
+    minute_sums = np.bincount(inverse, weights=minutes[keep], minlength=len(buckets))
+
+    last = {}
+    for bucket, trip_index in zip(inverse.tolist(), np.flatnonzero(keep).tolist()):
+        dropoff_time = trips[trip_index][5]
+        if bucket not in last or dropoff_time > last[bucket]:
+            last[bucket] = dropoff_time
+
+    return {
+        tuple(int(value) for value in buckets[i]): [int(counts[i]), float(km_sums[i]), float(minute_sums[i]), last[i]]
+        for i in range(len(buckets))
+    }
+
+
+def rebuild_speed_buckets(full=False, days=None, chunk_size=2000):
+    """
+    Fold completed trips into ``TravelSpeedBucket``.
+
+    Incremental by default: only trips not yet counted are read, whenever
+    they were completed, and each is marked with ``eta_counted_at`` in the
+    same transaction as the buckets it went into.  ``full`` starts over from
+    the trips of the last ``days`` days (default ``ETA_TRAINING_DAYS``);
+    older ones are marked counted without being read.
+
+    Returns:
+        dict: trips read, buckets created and updated
+    """
+    cell_size_deg = settings.ETA_CELL_DEGREES
+    completed = Booking.objects.filter(
+        status='completed', pickup_time__isnull=False, dropoff_time__isnull=False
+    )
+    if full:
+        since = timezone.now() - timedelta(days=days or settings.ETA_TRAINING_DAYS)
+        trips = completed.filter(dropoff_time__gte=since)
+    else:
+        trips = completed.filter(eta_counted_at__isnull=True)
+
+    totals = {}
+    chunk = []
+    counted = []
+    rows = trips.order_by().values_list(
+        'id', 'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude',
+        'pickup_time', 'dropoff_time'
+    ).iterator(chunk_size=chunk_size)
+    for booking_id, *trip in rows:
+        counted.append(booking_id)
+        chunk.append(trip)
+        if len(chunk) == chunk_size:
+            _merge(totals, aggregate_trips(chunk, cell_size_deg))
+            chunk = []
+    _merge(totals, aggregate_trips(chunk, cell_size_deg))
+
+    now = timezone.now()
+    with transaction.atomic():
+        if full:
+            TravelSpeedBucket.objects.all().delete()
+            Booking.objects.filter(eta_counted_at__isnull=False).update(eta_counted_at=None)
+            completed.filter(dropoff_time__lt=since).update(eta_counted_at=now)
+            existing = {}
+        else:
+            existing = {
+                (bucket.hour_of_week, bucket.cell_row, bucket.cell_col): bucket
+                for bucket in TravelSpeedBucket.objects.all()
+            }
+
+        created = []
+        updated = []
+        for (hour, row, col), (count, km, minutes, last) in totals.items():
+            bucket = existing.get((hour, row, col))
+            if bucket is None:
+                created.append(TravelSpeedBucket(
+                    hour_of_week=hour, cell_row=row, cell_col=col,
+                    trip_count=count, total_km=km, total_minutes=minutes, last_trip_at=last,
+                ))
+            else:
+                bucket.trip_count += count
+                bucket.total_km += km
+                bucket.total_minutes += minutes
+                bucket.last_trip_at = max(bucket.last_trip_at or last, last)
+                bucket.updated_at = now
+                updated.append(bucket)
+
+        TravelSpeedBucket.objects.bulk_create(created, batch_size=1000)
+        TravelSpeedBucket.objects.bulk_update(
+            updated, ['trip_count', 'total_km', 'total_minutes', 'last_trip_at', 'updated_at'], batch_size=1000
+        )
+        for start in range(0, len(counted), chunk_size):
+            Booking.objects.filter(id__in=counted[start:start + chunk_size]).update(eta_counted_at=now)
+        transaction.on_commit(invalidate_eta_model)
+
+    return {'trips': len(counted), 'created': len(created), 'updated': len(updated)}
+
+
+def _merge(totals, buckets):
+    for key, (count, km, minutes, last) in buckets.items():
+        total = totals.get(key)
+        if total is None:
+            totals[key] = [count, km, minutes, last]
+        else:
+            total[0] += count
+            total[1] += km
+            total[2] += minutes
+            total[3] = max(total[3], last)
@@ -0,0 +1,228 @@
+"""
+Ride event fan-out to caregivers.
+
+Caregivers follow their passengers' rides over ``ws/caregiver/<id>/``.  The
+``RideEventRouter`` decides who hears what: caregivers with
+``can_receive_notifications`` get ride status changes, caregivers with
+``can_view_location`` get the driver's position, and the caregiver an
+``ElderlyMember`` belongs to gets both.  Each ride's audience is resolved
+once and cached while the ride lasts; every event then goes out to all
+caregiver groups in one batched send.
+
+Drivers report positions without knowing their ride, so the router also
+caches which ride each driver is on.  Those entries expire after
+``RIDE_EVENTS_DRIVER_RIDE_TTL`` seconds, which is how a WebSocket worker
+notices rides assigned or finished by another process.
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+from care_connect_backend.channel_layers import group_send_many
+
+ACTIVE_STATUSES = ('confirmed', 'in_progress')
+FINISHED_STATUSES = ('completed', 'cancelled')
+
+
+def caregiver_group(user_id):
+    return f'caregiver_{user_id}'
+
+
+@dataclass
+class RideAudience:
+    passenger_id: int
+    location_groups: list = field(default_factory=list)
+    notification_groups: list = field(default_factory=list)
+    expires_at: float = 0.0
+
+
+class RideEventRouter:
+    """Resolves and caches who follows each ride, and fans ride events out to them"""
+
+    def __init__(self, audience_ttl=4 * 3600, driver_ride_ttl=10):
+        self.audience_ttl = audience_ttl
+        self.driver_ride_ttl = driver_ride_ttl
+        self._lock = threading.Lock()
+        self._audiences = {}     # booking id -> RideAudience
+        self._driver_rides = {}  # driver id -> (expires_at, booking id or None)
+
+    # Audience resolution
+
+    def audience(self, booking):
+        """Caregiver groups following ``booking``, resolved on first use"""
+        now = time.monotonic()
+        with self._lock:
+            audience = self._audiences.get(booking.id)
+        if audience is not None and audience.expires_at > now:
+            return audience
+
+        audience = self._resolve(booking.passenger_id, booking.elderly_member_id)
+        audience.expires_at = now + self.audience_ttl
+        with self._lock:
+            self._audiences[booking.id] = audience
+        return audience
+
+    @staticmethod
+    def _resolve(passenger_id, elderly_member_id):
+        from api.models import CaregiverRelationship, ElderlyMember
+
+        # caregiver id -> (can_view_location, can_receive_notifications)
+        caregivers = {
+            caregiver_id: (can_view_location, can_receive_notifications)
+            for caregiver_id, can_view_location, can_receive_notifications in
+            CaregiverRelationship.objects.filter(passenger_id=passenger_id, is_active=True).values_list(
+                'caregiver_id', 'can_view_location', 'can_receive_notifications'
+            )
+        }
+        if elderly_member_id:
+            member_caregiver = ElderlyMember.objects.filter(id=elderly_member_id).values_list(
+                'caregiver_id', flat=True
+            ).first()
+            if member_caregiver:
+                # The caregiver who booked for the member sees everything
+                caregivers[member_caregiver] = (True, True)
+
+        return RideAudience(
+            passenger_id=passenger_id,
+            location_groups=[caregiver_group(c) for c, (location, _) in caregivers.items() if location],
+            notification_groups=[caregiver_group(c) for c, (_, notify) in caregivers.items() if notify],
+        )
+
+    def forget_ride(self, booking_id):
+        with self._lock:
+            self._audiences.pop(booking_id, None)
+            for driver_id, (_, ride_id) in list(self._driver_rides.items()):
+                if ride_id == booking_id:
+                    del self._driver_rides[driver_id]
+
+    def forget_passenger(self, passenger_id):
+        """Drop cached audiences after a passenger's caregivers changed"""
+        with self._lock:
+            for booking_id, audience in list(self._audiences.items()):
+                if audience.passenger_id == passenger_id:
+                    del self._audiences[booking_id]
+
+    def forget_elderly_member(self, elderly_member_id):
+        from .models import Booking
+
+        for booking_id in Booking.objects.filter(
+            elderly_member_id=elderly_member_id, status__in=ACTIVE_STATUSES
+        ).values_list('id', flat=True):
+            self.forget_ride(booking_id)
+
+    # Driver -> ride
+
+    def ride_for_driver(self, driver_id):
+        """The booking the driver is currently on, or None"""
+        from .models import Booking
+
+        booking = Booking.objects.filter(driver_id=driver_id, status__in=ACTIVE_STATUSES).only(
+            'id', 'passenger_id', 'elderly_member_id', 'driver_id'
+        ).order_by('-booking_time').first()
+        # Negative results are cached too, so idle drivers cost one query per TTL
+        with self._lock:
+            self._driver_rides[driver_id] = (
+                time.monotonic() + self.driver_ride_ttl, booking.id if booking else None
+            )
+        return booking
+
+    # Publishing
+
+    def status_changed(self, booking):
+        """
+        Tell the ride's caregivers about its current status.  Accepts a
+        Booking or its id; must be called from synchronous code.
+        """
+        from .models import Booking
+
+        if not isinstance(booking, Booking):
+            booking = Booking.objects.filter(id=booking).first()
+            if booking is None:
+                return
+
+        audience = self.audience(booking)
+        if booking.status in FINISHED_STATUSES:
+            self.forget_ride(booking.id)
+        elif booking.status in ACTIVE_STATUSES and booking.driver_id:
+            with self._lock:
+                self._driver_rides[booking.driver_id] = (time.monotonic() + self.driver_ride_ttl, booking.id)
+
+        async_to_sync(group_send_many)(
+            get_channel_layer(),
+            audience.notification_groups,
+            {
+                'type': 'ride_event',
+                'kind': 'status',
+                'data': {
+                    'type': 'ride_status',
+                    'ride_id': booking.id,
+                    'status': booking.status,
+                    'passenger_id': booking.passenger_id,
+                    'elderly_member_id': booking.elderly_member_id,
+                    'driver_id': booking.driver_id,
+                    'timestamp': timezone.now().isoformat(),
+                }
+            }
+        )
+
+    async def driver_location(self, driver_id, latitude, longitude, heading=None, speed=None):
+        """Forward a driver's position to caregivers allowed to see the ride they are on"""
+        ride_id, audience = await self._location_audience(driver_id)
+        if ride_id is None or not audience.location_groups:
+            return
+
+        await group_send_many(
+            get_channel_layer(),
+            audience.location_groups,
+            {
+                'type': 'ride_event',
+                'kind': 'location',
+                'data': {
+                    'type': 'driver_location',
+                    'ride_id': ride_id,
+                    'latitude': float(latitude),
+                    'longitude': float(longitude),
+                    'heading': float(heading) if heading is not None else None,
+                    'speed': float(speed) if speed is not None else None,
+                    'timestamp': time.time(),
+                }
+            }
+        )
+
+    async def driver_ride_id(self, driver_id):
+        """Id of the ride ``driver_id`` is on, or None; cached for RIDE_EVENTS_DRIVER_RIDE_TTL"""
+        with self._lock:
+            cached = self._driver_rides.get(driver_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        booking = await database_sync_to_async(self.ride_for_driver)(driver_id)
+        return booking.id if booking else None
+
+    async def _location_audience(self, driver_id):
+        # Served from the caches without leaving the event loop when possible
+        ride_id = await self.driver_ride_id(driver_id)
+        if ride_id is None:
+            return None, None
+        with self._lock:
+            audience = self._audiences.get(ride_id)
+        if audience is None or audience.expires_at <= time.monotonic():
+            audience = await database_sync_to_async(self._ride_audience)(ride_id)
+        return ride_id, audience
+
+    def _ride_audience(self, ride_id):
+        from .models import Booking
+
+        booking = Booking.objects.only('id', 'passenger_id', 'elderly_member_id').get(id=ride_id)
+        return self.audience(booking)
+
+
+ride_events = RideEventRouter(
+    audience_ttl=settings.RIDE_EVENTS_AUDIENCE_TTL,
+    driver_ride_ttl=settings.RIDE_EVENTS_DRIVER_RIDE_TTL,
+)
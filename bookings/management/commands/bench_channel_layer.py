@@ -0,0 +1,102 @@
+import asyncio
+import multiprocessing
+import time
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+
+from care_connect_backend.channel_layers import group_send_many
+
+
+def _worker(index, ready, results):
+    """Join ``bench_<index>`` and record the delivery latency of every message"""
+
+    async def run():
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(f'bench_{index}', channel)
+        ready.set()
+
+        latencies = []
+        last_received_at = None
+        while True:
+            message = await layer.receive(channel)
+            if message['type'] == 'bench.stop':
+                break
+            last_received_at = time.time()
+            latencies.append(last_received_at - message['sent_at'])
+        await layer.group_discard(f'bench_{index}', channel)
+        results.put((latencies, last_received_at))
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = 'Measure cross-process fan-out throughput and delivery latency of the configured channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Receiving worker processes')
+        parser.add_argument('--messages', type=int, default=500, help='Fan-out rounds to send')
+        parser.add_argument('--rate', type=float, default=0, help='Rounds per second (0 = as fast as possible)')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        rounds = options['messages']
+        rate = options['rate']
+
+        layer = get_channel_layer()
+        if isinstance(layer, InMemoryChannelLayer):
+            raise CommandError(
+                'InMemoryChannelLayer cannot cross processes; set CHANNEL_LAYER_BACKEND=sqlite or redis'
+            )
+
+        context = multiprocessing.get_context('fork')
+        ready_events = [context.Event() for _ in range(workers)]
+        results = context.Queue()
+        processes = [
+            context.Process(target=_worker, args=(i, ready_events[i], results), daemon=True)
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for event in ready_events:
+            if not event.wait(timeout=30):
+                raise CommandError('Workers did not come up in time')
+
+        self.stdout.write(f'📡 {type(layer).__name__}: {rounds} rounds x {workers} workers')
+        groups = [f'bench_{i}' for i in range(workers)]
+
+        async def send_all():
+            start = time.perf_counter()
+            for i in range(rounds):
+                await group_send_many(layer, groups, {'type': 'bench.message', 'seq': i, 'sent_at': time.time()})
+                if rate:
+                    await asyncio.sleep(max(0.0, start + (i + 1) / rate - time.perf_counter()))
+            await group_send_many(layer, groups, {'type': 'bench.stop'})
+
+        started_at = time.time()
+        asyncio.run(send_all())
+
+        latencies = []
+        finished_at = started_at
+        for _ in processes:
+            worker_latencies, last_received_at = results.get(timeout=120)
+            latencies.extend(worker_latencies)
+            finished_at = max(finished_at, last_received_at or started_at)
+        for process in processes:
+            process.join(timeout=10)
+        elapsed = max(finished_at - started_at, 1e-9)
+
+        latencies.sort()
+        delivered = len(latencies)
+        expected = rounds * workers
+
+        def percentile(p):
+            return latencies[min(delivered - 1, int(delivered * p))] * 1000 if latencies else 0.0
+
+        self.stdout.write(f'  delivered     {delivered}/{expected}')
+        self.stdout.write(f'  throughput    {delivered / elapsed:,.0f} msg/s')
+        self.stdout.write(f'  latency p50   {percentile(0.50):.2f} ms')
+        self.stdout.write(f'  latency p99   {percentile(0.99):.2f} ms')
+        self.stdout.write(f'  latency max   {latencies[-1] * 1000 if latencies else 0:.2f} ms')
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark complete'))
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from care_connect_backend.channel_layers import LocalChannelLayer
+from bookings.tracking import RideTracker, TrackingStream, ride_group
+
+
+class Command(BaseCommand):
+    help = 'Find how many concurrently tracked rides one worker can stream to passengers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rides', default='250,500,1000,2000,4000',
+                            help='Comma-separated numbers of concurrent rides to try')
+        parser.add_argument('--subscribers', type=int, default=2, help='Sockets following each ride')
+        parser.add_argument('--rate', type=float, default=1.0, help='Location frames per driver per second')
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per round')
+        parser.add_argument('--max-p99-ms', type=float, default=250.0,
+                            help='Delivery latency a round must stay under to count as sustained')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"🛰️  {options['subscribers']} subscribers per ride, {options['rate']:g} frames/s per driver, "
+            f"{options['duration']:g}s per round"
+        )
+        self.stdout.write(
+            f"  {'rides':>6} {'in/s':>8} {'out/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+            f"{'loop lag':>9} {'bytes':>6} {'stale':>6} {'late':>6}"
+        )
+
+        sustained = 0
+        for rides in [int(n) for n in options['rides'].split(',')]:
+            result = asyncio.run(self.run_round(rides, options))
+            ok = result['p99'] <= options['max_p99_ms']
+            self.stdout.write(
+                f"  {rides:>6} {result['in_rate']:>8,.0f} {result['out_rate']:>8,.0f} {result['p50']:>8.1f} "
+                f"{result['p99']:>8.1f} {result['loop_lag']:>7.1f}ms {result['frame_bytes']:>6.0f} "
+                f"{result['stale']:>6} {result['late']:>6} {'✓' if ok else '✗'}"
+            )
+            if not ok:
+                break
+            sustained = rides
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ One worker sustains {sustained} tracked rides under {options['max_p99_ms']:g} ms p99"
+        ))
+
+    async def run_round(self, rides, options):
+        layer = LocalChannelLayer(capacity=1000)
+
+        async def resolve_ride(driver_id):
+            return driver_id  # one ride per driver, numbered alike
+
+        tracker = RideTracker(
+            min_interval=settings.TRACKING_MIN_INTERVAL,
+            subscribers_per_step=settings.TRACKING_SUBSCRIBERS_PER_STEP,
+            max_point_age=settings.TRACKING_MAX_POINT_AGE,
+            resolve_ride=resolve_ride,
+            channel_layer=layer,
+        )
+        latencies = []
+        frame_bytes = []
+        streams = []
+        loop_lag = []
+        running = True
+
+        async def subscriber(ride_id):
+            channel = await layer.new_channel()
+            await layer.group_add(ride_group(ride_id), channel)
+            tracker.subscribe(ride_id)
+
+            async def send(frame):
+                text = json.dumps(frame, separators=(',', ':'))
+                frame_bytes.append(len(text))
+
+            stream = TrackingStream(send)
+            streams.append(stream)
+            while True:
+                message = await layer.receive(channel)
+                latencies.append(time.time() - message['sent_at'])
+                await stream.push(message)
+
+        async def driver(driver_id):
+            rng = random.Random(driver_id)
+            lat, lng, heading = -26.2 + rng.random() * 0.2, 28.0 + rng.random() * 0.2, rng.random() * 360
+            await asyncio.sleep(rng.random() / options['rate'])
+            while running:
+                lat += rng.uniform(-0.0002, 0.0002)
+                lng += rng.uniform(-0.0002, 0.0002)
+                await tracker.publish(driver_id, lat, lng, heading, 12.5, time.time())
+                await asyncio.sleep(1 / options['rate'])
+
+        async def watch_loop():
+            while running:
+                start = time.perf_counter()
+                await asyncio.sleep(0.05)
+                loop_lag.append(time.perf_counter() - start - 0.05)
+
+        subscribers = [
+            asyncio.create_task(subscriber(ride_id))
+            for ride_id in range(1, rides + 1) for _ in range(options['subscribers'])
+        ]
+        await asyncio.sleep(0)
+        drivers = [asyncio.create_task(driver(ride_id)) for ride_id in range(1, rides + 1)]
+        watcher = asyncio.create_task(watch_loop())
+
+        # Let every driver get going before measuring
+        await asyncio.sleep(1 / options['rate'])
+        latencies.clear()
+        frame_bytes.clear()
+        received = tracker.stats['received']
+        start = time.perf_counter()
+        await asyncio.sleep(options['duration'])
+        elapsed = time.perf_counter() - start
+        in_rate = (tracker.stats['received'] - received) / elapsed
+        out_rate = len(latencies) / elapsed
+        measured = sorted(latencies)
+        sizes = list(frame_bytes)
+
+        running = False
+        for task in subscribers + drivers + [watcher]:
+            task.cancel()
+        await asyncio.gather(*subscribers, *drivers, watcher, return_exceptions=True)
+        for stream in streams:
+            stream.close()
+
+        def percentile(p):
+            return measured[min(len(measured) - 1, int(len(measured) * p))] * 1000 if measured else float('inf')
+
+        return {
+            'in_rate': in_rate,
+            'out_rate': out_rate,
+            'p50': percentile(0.50),
+            'p99': percentile(0.99),
+            'loop_lag': max(loop_lag) * 1000 if loop_lag else 0.0,
+            'frame_bytes': sum(sizes) / len(sizes) if sizes else 0.0,
+            'stale': tracker.stats['stale'],
+            'late': sum(stream.stats['late'] for stream in streams),
+        }
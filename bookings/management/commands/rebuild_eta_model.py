@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bookings.eta import EtaModel, rebuild_speed_buckets
+
+
+class Command(BaseCommand):
+    help = 'Fold completed trips into the travel speed buckets the ETA model is served from'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Start over instead of adding the trips not counted yet')
+        parser.add_argument('--days', type=int, default=settings.ETA_TRAINING_DAYS,
+                            help='Days of trips a full rebuild learns from')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            self.stdout.write(f"🧮 Rebuilding travel speeds from the last {options['days']} days of trips")
+        else:
+            self.stdout.write('🧮 Adding newly completed trips to the travel speeds')
+
+        started = time.perf_counter()
+        result = rebuild_speed_buckets(full=options['full'], days=options['days'])
+        self.stdout.write(
+            f"  {result['trips']} trips read, {result['created']} buckets created, "
+            f"{result['updated']} updated in {time.perf_counter() - started:.1f}s"
+        )
+
+        model = EtaModel.load()
+        self.stdout.write(
+            f"  {model.trips} trips over {len(model.columns)} cells, city average "
+            f"{60 / model.city_pace:.1f} km/h (version {model.version})"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ ETA model rebuilt; other processes pick it up within {settings.ETA_MODEL_TTL}s'
+        ))
@@ -0,0 +1,50 @@
+import asyncio
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from bookings.scheduler import BookingScheduler
+
+
+class Command(BaseCommand):
+    help = 'Release scheduled bookings for matching ahead of pickup (one instance per deployment)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lead-minutes', type=int, default=settings.SCHEDULED_BOOKING_LEAD_MINUTES,
+                            help='Minutes before pickup that matching starts')
+        parser.add_argument('--once', action='store_true',
+                            help='Release what is due now, wait for its matching to finish and exit')
+
+    def handle(self, *args, **options):
+        if isinstance(get_channel_layer(), InMemoryChannelLayer):
+            raise CommandError(
+                'The in-memory channel layer cannot reach driver sockets in other processes; the web worker '
+                'runs the scheduler itself.  Set CHANNEL_LAYER_BACKEND=sqlite or redis to run it here.'
+            )
+
+        scheduler = BookingScheduler(
+            lead_time=options['lead_minutes'] * 60,
+            grace=settings.SCHEDULED_BOOKING_GRACE_MINUTES * 60,
+            bucket_seconds=settings.BOOKING_SCHEDULER_BUCKET_SECONDS,
+            refresh_interval=settings.BOOKING_SCHEDULER_REFRESH_SECONDS,
+            chunk_size=settings.BOOKING_SCHEDULER_CHUNK_SIZE,
+            max_concurrent=settings.BOOKING_SCHEDULER_MAX_CONCURRENT,
+            reload_driver_index=True,
+        )
+        self.stdout.write(
+            f"🗓️  Matching scheduled bookings {options['lead_minutes']} minutes before pickup"
+        )
+
+        try:
+            asyncio.run(scheduler.run_once() if options['once'] else scheduler.run())
+        except KeyboardInterrupt:
+            pass
+
+        stats = scheduler.stats
+        self.stdout.write(
+            f"  released {stats['released']}, expired {stats['expired']}, assigned {stats['assigned']}, "
+            f"unmatched {stats['unmatched']}, lost {stats['lost']}"
+        )
+        self.stdout.write(self.style.SUCCESS('✅ Booking scheduler stopped'))
+
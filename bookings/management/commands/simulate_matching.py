@@ -0,0 +1,162 @@
+import heapq
+import math
+import random
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bookings.batching import assign_batch
+from drivers.spatial_index import DriverSpatialIndex
+from geo.distance import haversine_km
+
+CITY = (-26.2041, 28.0473)
+CITY_SPAN_DEG = 0.15
+
+
+class Command(BaseCommand):
+    help = 'Replay a synthetic peak through greedy and batched matching and compare pickup ETAs and throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=300)
+        parser.add_argument('--rate', type=float, default=30.0, help='Ride requests per minute')
+        parser.add_argument('--minutes', type=float, default=30.0, help='Simulated minutes of demand')
+        parser.add_argument('--window', type=float, default=settings.MATCHING_BATCH_WINDOW,
+                            help='Batch window in seconds')
+        parser.add_argument('--speed-kmh', type=float, default=30.0, help='Average driving speed')
+        parser.add_argument('--patience', type=float, default=300.0,
+                            help='Seconds a passenger waits for a driver before giving up')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"🚕 {options['drivers']} drivers, {options['rate']:g} requests/min for {options['minutes']:g} "
+            f"simulated minutes, {options['window']:g}s batch window; every offer is accepted"
+        )
+        self.stdout.write(
+            f"  {'mode':<8} {'served':>7} {'gave up':>8} {'rides/h':>8} {'pickup min':>11} "
+            f"{'p90 min':>8} {'wait min':>9} {'ms/round':>9}"
+        )
+        for mode in ('greedy', 'batched'):
+            result = self.simulate(mode, options)
+            self.stdout.write(
+                f"  {mode:<8} {result['served']:>7} {result['abandoned']:>8} {result['per_hour']:>8.0f} "
+                f"{result['pickup_mean']:>11.2f} {result['pickup_p90']:>8.2f} {result['wait_mean']:>9.2f} "
+                f"{result['solve_ms']:>9.2f}"
+            )
+        self.stdout.write(self.style.SUCCESS('✅ Simulation complete'))
+
+    def requests(self, options):
+        """Poisson arrivals, two thirds around a few busy hotspots"""
+        rng = random.Random(options['seed'])
+        hotspots = [
+            (CITY[0] + rng.uniform(-0.08, 0.08), CITY[1] + rng.uniform(-0.08, 0.08)) for _ in range(4)
+        ]
+        arrivals = []
+        t = 0.0
+        while True:
+            t += rng.expovariate(options['rate'] / 60)
+            if t > options['minutes'] * 60:
+                return arrivals
+            if rng.random() < 2 / 3:
+                lat, lon = rng.choice(hotspots)
+                pickup = (lat + rng.gauss(0, 0.01), lon + rng.gauss(0, 0.01))
+            else:
+                pickup = (CITY[0] + rng.uniform(-CITY_SPAN_DEG, CITY_SPAN_DEG),
+                          CITY[1] + rng.uniform(-CITY_SPAN_DEG, CITY_SPAN_DEG))
+            dropoff = (pickup[0] + rng.uniform(-0.05, 0.05), pickup[1] + rng.uniform(-0.05, 0.05))
+            arrivals.append((t, pickup, dropoff))
+
+    def simulate(self, mode, options):
+        rng = random.Random(options['seed'] + 1)
+        index = DriverSpatialIndex(cell_size_deg=settings.DRIVER_INDEX_CELL_DEGREES)
+        for driver_id in range(options['drivers']):
+            index.update_position(
+                driver_id,
+                CITY[0] + rng.uniform(-CITY_SPAN_DEG, CITY_SPAN_DEG),
+                CITY[1] + rng.uniform(-CITY_SPAN_DEG, CITY_SPAN_DEG),
+            )
+            index.set_available(driver_id, True)
+
+        radius_km = settings.DISPATCH_SEARCH_RADII_KM[-1]
+        km_per_second = options['speed_kmh'] / 3600
+        step = options['window'] if mode == 'batched' else 0.5
+        arrivals = self.requests(options)
+        next_arrival = 0
+        waiting = []        # (requested at, pickup, dropoff)
+        freeing = []        # heap of (free at, driver id, lat, lon)
+        free = options['drivers']
+        pickups = []
+        waits = []
+        solve_times = []
+        abandoned = 0
+
+        def dispatch(now, request, driver_id, distance_km):
+            nonlocal free
+            free -= 1
+            requested_at, pickup, dropoff = request
+            pickup_seconds = distance_km / km_per_second
+            trip_seconds = haversine_km(*pickup, *dropoff) / km_per_second
+            index.set_available(driver_id, False)
+            heapq.heappush(freeing, (now + pickup_seconds + trip_seconds, driver_id, *dropoff))
+            pickups.append(pickup_seconds / 60)
+            waits.append((now - requested_at + pickup_seconds) / 60)
+
+        now = 0.0
+        end = options['minutes'] * 60
+        while now <= end or (waiting and now <= end + options['patience']):
+            while freeing and freeing[0][0] <= now:
+                _, driver_id, lat, lon = heapq.heappop(freeing)
+                index.update_position(driver_id, lat, lon)
+                index.set_available(driver_id, True)
+                free += 1
+            while next_arrival < len(arrivals) and arrivals[next_arrival][0] <= now:
+                waiting.append(arrivals[next_arrival])
+                next_arrival += 1
+
+            kept = []
+            for request in waiting:
+                if now - request[0] > options['patience']:
+                    abandoned += 1
+                else:
+                    kept.append(request)
+            waiting = kept
+
+            if waiting and free:
+                started = time.perf_counter()
+                if mode == 'greedy':
+                    # First come, first served: each request takes its nearest free driver
+                    still_waiting = []
+                    for request in waiting:
+                        found = index.nearest(*request[1], k=1, radius_km=radius_km)
+                        if found:
+                            dispatch(now, request, *found[0])
+                        else:
+                            still_waiting.append(request)
+                    waiting = still_waiting
+                else:
+                    results = assign_batch(
+                        [request[1] for request in waiting], index,
+                        k=settings.MATCHING_BATCH_CANDIDATES, radius_km=radius_km
+                    )
+                    still_waiting = []
+                    for request, result in zip(waiting, results):
+                        if result:
+                            dispatch(now, request, *result)
+                        else:
+                            still_waiting.append(request)
+                    waiting = still_waiting
+                solve_times.append((time.perf_counter() - started) * 1000)
+            now += step
+
+        pickups = np.array(pickups) if pickups else np.array([math.nan])
+        return {
+            'served': len(waits),
+            'abandoned': abandoned + len(waiting),
+            'per_hour': len(waits) / (options['minutes'] / 60),
+            'pickup_mean': float(pickups.mean()),
+            'pickup_p90': float(np.percentile(pickups, 90)),
+            'wait_mean': float(np.mean(waits)) if waits else math.nan,
+            'solve_ms': float(np.mean(solve_times)) if solve_times else 0.0,
+        }
@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from bookings.models import Booking
+from bookings.services import AssignmentService
+from drivers.models import Driver
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    # Many accepts at a single booking are covered by
+    # bookings.tests.ConcurrentAssignmentTests
+    help = 'Fire simultaneous driver accepts at many bookings and check that each is won at most once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=300)
+        parser.add_argument('--bookings', type=int, default=50)
+        parser.add_argument('--threads', type=int, default=64)
+
+    def handle(self, *args, **options):
+        bookings = options['bookings']
+        threads = options['threads']
+        run = random.randint(100000, 999999)
+
+        self.stdout.write(f'🏁 Assignment stress run {run}')
+        passenger = User.objects.create(username=f'stress_{run}_passenger', phone_number=f'8{run}0000')
+        try:
+            drivers = self.create_drivers(run, options['drivers'])
+
+            # Drivers race for many bookings at once
+            booking_ids = [self.create_booking(passenger).id for _ in range(bookings)]
+            attempts = [(booking_id, driver.id) for booking_id in booking_ids for driver in random.sample(drivers, 10)]
+            random.shuffle(attempts)
+            results = self.fire(threads, attempts)
+            self.check_many_bookings(booking_ids, drivers, results)
+        finally:
+            # Drivers and bookings cascade with their users
+            User.objects.filter(username__startswith=f'stress_{run}_').delete()
+
+        self.stdout.write(self.style.SUCCESS('✅ All assignment invariants held'))
+
+    def create_drivers(self, run, count):
+        users = User.objects.bulk_create([
+            User(username=f'stress_{run}_driver{i}', phone_number=f'9{run}{i:04d}') for i in range(count)
+        ])
+        return Driver.objects.bulk_create([
+            Driver(
+                user=user,
+                phone_number=user.phone_number,
+                license_number=f'STRESS-{user.phone_number}',
+                vehicle_registration='STRESS',
+                status='available',
+                is_verified=True,
+            )
+            for user in users
+        ])
+
+    def create_booking(self, passenger):
+        return Booking.objects.create(
+            passenger=passenger,
+            passenger_phone=passenger.phone_number,
+            pickup_latitude=Decimal('-26.204100'),
+            pickup_longitude=Decimal('28.047300'),
+            pickup_address='Stress pickup',
+            dropoff_latitude=Decimal('-26.185000'),
+            dropoff_longitude=Decimal('28.055000'),
+            dropoff_address='Stress dropoff',
+            fare_amount=Decimal('50.00'),
+            status='pending',
+        )
+
+    def fire(self, threads, attempts):
+        """Run every (booking, driver) accept in parallel, all released at the same moment"""
+        go = threading.Event()
+
+        def accept(attempt):
+            booking_id, driver_id = attempt
+            try:
+                go.wait()
+                return booking_id, driver_id, AssignmentService.assign(booking_id, driver_id)
+            except Exception as e:
+                return booking_id, driver_id, f'error: {e}'
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = [pool.submit(accept, attempt) for attempt in attempts]
+            start = time.perf_counter()
+            go.set()
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+
+        outcomes = Counter(result for _, _, result in results)
+        self.stdout.write(f'  {len(attempts)} accepts in {elapsed:.2f}s: {dict(outcomes)}')
+        return results
+
+    def check_many_bookings(self, booking_ids, drivers, results):
+        wins = [(booking_id, driver_id) for booking_id, driver_id, result in results
+                if result == AssignmentService.ASSIGNED]
+        per_booking = Counter(booking_id for booking_id, _ in wins)
+        if any(count > 1 for count in per_booking.values()):
+            raise CommandError('A booking was won more than once')
+
+        assigned = dict(Booking.objects.filter(id__in=booking_ids, status='confirmed').values_list('id', 'driver_id'))
+        if assigned != dict(wins):
+            raise CommandError('Confirmed bookings do not match the reported winners')
+
+        rides = Counter(driver_id for _, driver_id in wins)
+        recorded = dict(Driver.objects.filter(id__in=[d.id for d in drivers]).values_list('id', 'total_rides'))
+        if any(recorded[driver_id] != rides.get(driver_id, 0) for driver_id in recorded):
+            raise CommandError('total_rides does not match the number of won bookings')
+        self.stdout.write(f'  many bookings: {len(assigned)}/{len(booking_ids)} assigned, no double wins')
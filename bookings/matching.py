@@ -0,0 +1,240 @@
+"""
+Matching one booking to a driver.
+
+``BookingMatcher`` wires a ``RideDispatcher`` to the real world: candidates
+come from the driver spatial index, offers go out to the drivers' WebSocket
+groups, and the winner is settled by ``AssignmentService``.  The ride socket
+uses it for immediate bookings and the booking scheduler for advance ones.
+Either way, driver responses arrive on the ``ride_<id>`` group and must be
+fed to ``matcher.dispatcher.driver_responded``.  In batched mode the first
+offer goes to the driver ``bookings.batching`` paired the booking with.
+"""
+import asyncio
+import math
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from care_connect_backend.channel_layers import group_send_many
+from drivers.models import Driver
+from drivers.spatial_index import driver_index, ensure_driver_index_loaded
+from pricing.heatmap import heatmap
+from pricing.promos import release_promo_redemption
+from .batching import batch_matcher
+from .dispatch import RideDispatcher
+from .eta import estimate_trip_minutes
+from .events import ride_events
+from .models import Booking
+from .services import AssignmentService
+
+
+def get_nearby_drivers(pickup_lat, pickup_lon, radius_km=10, limit=5):
+    """Get the closest available drivers within radius whose app is still connected"""
+    ensure_driver_index_loaded()
+    matches = driver_index.nearest(
+        pickup_lat, pickup_lon, k=limit, radius_km=radius_km, where=batch_matcher.is_matchable
+    )
+    return load_drivers([driver_id for driver_id, _ in matches])
+
+
+def load_drivers(driver_ids):
+    """The drivers that are still available, in the order given"""
+    # The status filter guards against the index lagging behind a status
+    # change in another process.
+    drivers = Driver.objects.select_related('user', 'location').filter(
+        status='available',
+        is_verified=True
+    ).in_bulk(driver_ids)
+
+    return [drivers[driver_id] for driver_id in driver_ids if driver_id in drivers]
+
+
+def ride_request_data(booking):
+    """The offer a driver sees; needs ``booking.passenger`` loaded"""
+    return {
+        'type': 'ride_request',
+        'ride_id': str(booking.id),
+        'passenger_name': booking.passenger.get_full_name(),
+        'passenger_phone': booking.passenger.phone_number,
+        'pickup_address': booking.pickup_address,
+        'dropoff_address': booking.dropoff_address,
+        'pickup_latitude': float(booking.pickup_latitude),
+        'pickup_longitude': float(booking.pickup_longitude),
+        'dropoff_latitude': float(booking.dropoff_latitude),
+        'dropoff_longitude': float(booking.dropoff_longitude),
+        'distance': float(booking.distance_km or 0),  # optional on API bookings
+        'fare': float(booking.fare_amount),
+        'estimated_duration': booking.estimated_duration_minutes,
+    }
+
+
+def driver_assigned_data(driver, booking, pickup_minutes=None):
+    """The message telling the passenger who is coming, and roughly when"""
+    return {
+        'type': 'driver_assigned',
+        'message': 'Driver found!',
+        'booking_id': booking.id,
+        'eta_minutes': pickup_minutes,
+        'driver': {
+            'id': driver.id,
+            'name': driver.user.get_full_name(),
+            'phone': driver.phone_number,
+            'vehicle_type': driver.vehicle_type,
+            'vehicle_registration': driver.vehicle_registration,
+            'rating': float(driver.rating),
+            'latitude': float(driver.location.latitude) if hasattr(driver, 'location') else None,
+            'longitude': float(driver.location.longitude) if hasattr(driver, 'location') else None,
+        }
+    }
+
+
+@database_sync_to_async
+def expire_booking(booking_id, reason='No driver accepted the ride'):
+    """Cancel a booking no driver accepted, unless it moved on meanwhile"""
+    if Booking.objects.filter(id=booking_id, status='pending').update(
+        status='cancelled',
+        cancellation_reason=reason,
+        cancelled_at=timezone.now()
+    ):
+        release_promo_redemption(booking_id)
+        ride_events.status_changed(booking_id)
+
+
+class BookingMatcher:
+    """Offers one pending booking to nearby drivers until one accepts"""
+
+    def __init__(self, booking, channel_layer):
+        self.booking = booking
+        self.channel_layer = channel_layer
+        self.pickup = (float(booking.pickup_latitude), float(booking.pickup_longitude))
+        self.candidates = {}  # driver id -> Driver
+        self.batched = settings.MATCHING_MODE == 'batched'
+        self.batch_driver_id = None
+        self.pickup_minutes = None  # the assigned driver's estimated time to the pickup
+        self.dispatcher = RideDispatcher(
+            candidate_rings=self.candidate_ring,
+            send_offers=self.send_offers,
+            try_assign=self.try_assign,
+            withdraw_offers=self.withdraw_offers,
+            wave_size=settings.DISPATCH_WAVE_SIZE,
+            offer_timeout=settings.DISPATCH_OFFER_TIMEOUT,
+            max_duration=settings.DISPATCH_MAX_SECONDS,
+            # A batch assignment is offered to its driver alone
+            first_wave_size=1 if self.batched else None,
+        )
+
+    async def run(self):
+        """
+        Dispatch, confirm the winner's offer and expire the booking when
+        nobody took it.  Returns the ``DispatchResult``.  A search cancelled
+        midway, say by the passenger's socket closing, expires the booking
+        too rather than leaving it pending with nobody offering it.
+        """
+        heatmap.record_request(*self.pickup)
+        try:
+            result = await self.dispatcher.run()
+        except asyncio.CancelledError:
+            # The dispatcher has withdrawn its outstanding offers
+            await asyncio.shield(expire_booking(self.booking.id, 'Driver search was stopped'))
+            raise
+        finally:
+            if self.batch_driver_id is not None:
+                batch_matcher.release(self.batch_driver_id)
+
+        if result.status == 'assigned':
+            await self.send_offer_update([result.driver_id], 'ride_confirmed')
+        elif result.status in ('exhausted', 'timeout'):
+            await expire_booking(self.booking.id)
+        return result
+
+    def driver(self, driver_id):
+        return self.candidates[driver_id]
+
+    async def candidate_ring(self, ring, exclude):
+        """Drivers in the given search ring that have not been offered the ride yet"""
+        if self.batched:
+            # Ring 0 is the driver the batch assigned; the search rings follow
+            if ring == 0:
+                return await self.batch_ring()
+            ring -= 1
+
+        radii = settings.DISPATCH_SEARCH_RADII_KM
+        if ring >= len(radii):
+            return None
+
+        drivers = await database_sync_to_async(get_nearby_drivers)(
+            self.pickup[0],
+            self.pickup[1],
+            radius_km=radii[ring],
+            limit=settings.DISPATCH_CANDIDATES_PER_RING + len(exclude)
+        )
+        fresh = [driver for driver in drivers if driver.id not in exclude]
+        self.candidates.update((driver.id, driver) for driver in fresh)
+        return [driver.id for driver in fresh]
+
+    async def batch_ring(self):
+        await database_sync_to_async(ensure_driver_index_loaded)()
+        self.batch_driver_id = await batch_matcher.request(
+            self.pickup[0], self.pickup[1], hold=settings.DISPATCH_OFFER_TIMEOUT
+        )
+        if self.batch_driver_id is None:
+            return []
+        drivers = await database_sync_to_async(load_drivers)([self.batch_driver_id])
+        self.candidates.update((driver.id, driver) for driver in drivers)
+        return [driver.id for driver in drivers]
+
+    async def send_offers(self, driver_ids):
+        """Send the ride request to every driver's WebSocket group in one batch"""
+        drivers = [self.candidates[driver_id] for driver_id in driver_ids]
+        for driver in drivers:
+            print(f'📢 Notifying driver: {driver.user.get_full_name()} (Phone: {driver.user.phone_number})')
+
+        await group_send_many(
+            self.channel_layer,
+            [f'driver_{driver.user.phone_number}' for driver in drivers],
+            {
+                'type': 'ride_request',
+                'data': ride_request_data(self.booking)
+            }
+        )
+
+    async def withdraw_offers(self, driver_ids):
+        await self.send_offer_update(driver_ids, 'ride_unavailable')
+
+    async def send_offer_update(self, driver_ids, update_type):
+        """Tell drivers their offer was confirmed or is no longer available"""
+        await group_send_many(
+            self.channel_layer,
+            [f'driver_{self.candidates[driver_id].user.phone_number}' for driver_id in driver_ids],
+            {
+                'type': 'ride_offer_update',
+                'data': {
+                    'type': update_type,
+                    'ride_id': str(self.booking.id),
+                }
+            }
+        )
+
+    @database_sync_to_async
+    def try_assign(self, driver_id):
+        """Assign driver to booking; None means the driver could not take it"""
+        result = AssignmentService.assign(self.booking.id, driver_id)
+        if result == AssignmentService.BOOKING_UNAVAILABLE:
+            return False
+        if result == AssignmentService.DRIVER_UNAVAILABLE:
+            return None
+
+        self.booking.driver = self.candidates[driver_id]
+        self.booking.status = 'confirmed'
+        self.pickup_minutes = self.estimate_pickup_minutes(self.booking.driver)
+        return True
+
+    def estimate_pickup_minutes(self, driver):
+        """Minutes for the driver to reach the pickup, None when they have no known position"""
+        (lat, lon), = driver_index.positions([driver.id])
+        if math.isnan(lat):
+            if not hasattr(driver, 'location'):
+                return None
+            lat, lon = driver.location.latitude, driver.location.longitude
+        return estimate_trip_minutes(lat, lon, *self.pickup)
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_otpcode_delivery_status'),
+        ('bookings', '0002_scheduled_bookings'),
+        ('drivers', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TravelSpeedBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour_of_week', models.PositiveSmallIntegerField(help_text='0 = Monday 00:00-01:00, local time')),
+                ('cell_row', models.IntegerField()),
+                ('cell_col', models.IntegerField()),
+                ('trip_count', models.PositiveIntegerField(default=0)),
+                ('total_km', models.FloatField(default=0)),
+                ('total_minutes', models.FloatField(default=0)),
+                ('last_trip_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['hour_of_week', 'cell_row', 'cell_col'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'dropoff_time'], name='bookings_bo_status_578a0a_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='travelspeedbucket',
+            constraint=models.UniqueConstraint(fields=('hour_of_week', 'cell_row', 'cell_col'), name='unique_speed_bucket'),
+        ),
+    ]
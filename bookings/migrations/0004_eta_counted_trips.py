@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:23
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+
+
+def mark_counted_trips(apps, schema_editor):
+    """
+    Mark the trips the old dropoff watermark already folded into the speed
+    buckets, so the first incremental rebuild does not count them again.
+    """
+    Booking = apps.get_model('bookings', 'Booking')
+    TravelSpeedBucket = apps.get_model('bookings', 'TravelSpeedBucket')
+
+    watermark = TravelSpeedBucket.objects.aggregate(last=Max('last_trip_at'))['last']
+    if watermark is not None:
+        Booking.objects.filter(status='completed', dropoff_time__lte=watermark).update(eta_counted_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_otpcode_delivery_status'),
+        ('bookings', '0003_travel_speed_buckets'),
+        ('drivers', '0002_driver_location_updated_at_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='eta_counted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'eta_counted_at'], name='bookings_bo_status_ab049d_idx'),
+        ),
+        migrations.RunPython(mark_counted_trips, migrations.RunPython.noop),
+    ]
@@ -8,6 +8,7 @@ class Booking(models.Model):
     """Booking model for Care Connect Mobility"""
 
     STATUS_CHOICES = [
+        ('scheduled', 'Scheduled'),
         ('pending', 'Pending'),
         ('confirmed', 'Confirmed'),
         ('in_progress', 'In Progress'),
@@ -64,9 +65,12 @@ class Booking(models.Model):
 
     # Timestamps
     booking_time = models.DateTimeField(auto_now_add=True)
+    scheduled_for = models.DateTimeField(null=True, blank=True)  # pickup time of an advance booking
     pickup_time = models.DateTimeField(null=True, blank=True)
     dropoff_time = models.DateTimeField(null=True, blank=True)
     cancelled_at = models.DateTimeField(null=True, blank=True)
+    # When the completed trip was folded into the travel speed buckets (see bookings.eta)
+    eta_counted_at = models.DateTimeField(null=True, blank=True)
 
     # Additional information
     special_requirements = models.TextField(blank=True)
@@ -83,6 +87,11 @@ class Booking(models.Model):
             models.Index(fields=['status', '-booking_time']),
             models.Index(fields=['passenger', '-booking_time']),
             models.Index(fields=['driver', '-booking_time']),
+            # Range scans for scheduled bookings coming due
+            models.Index(fields=['status', 'scheduled_for']),
+            # Full ETA model rebuilds scan recent trips, incremental ones the uncounted
+            models.Index(fields=['status', 'dropoff_time']),
+            models.Index(fields=['status', 'eta_counted_at']),
         ]
 
     def __str__(self):
@@ -95,3 +104,32 @@ class Booking(models.Model):
             duration = self.dropoff_time - self.pickup_time
             return duration.total_seconds() / 60
         return None
+
+
+class TravelSpeedBucket(models.Model):
+    """
+    Completed trips aggregated by hour of the week and pickup grid cell,
+    the training data of the ETA model (see ``bookings.eta``)
+    """
+
+    hour_of_week = models.PositiveSmallIntegerField(help_text='0 = Monday 00:00-01:00, local time')
+    cell_row = models.IntegerField()
+    cell_col = models.IntegerField()
+
+    trip_count = models.PositiveIntegerField(default=0)
+    # Straight-line kilometres and minutes driven, summed over the trips
+    total_km = models.FloatField(default=0)
+    total_minutes = models.FloatField(default=0)
+    # Latest dropoff counted in
+    last_trip_at = models.DateTimeField(null=True, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['hour_of_week', 'cell_row', 'cell_col']
+        constraints = [
+            models.UniqueConstraint(fields=['hour_of_week', 'cell_row', 'cell_col'], name='unique_speed_bucket'),
+        ]
+
+    def __str__(self):
+        return f"Hour {self.hour_of_week} cell ({self.cell_row}, {self.cell_col}): {self.trip_count} trips"
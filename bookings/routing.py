@@ -4,5 +4,6 @@ from drivers import consumers as driver_consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/ride/(?P<ride_id>\w+)/$', consumers.RideMatchingConsumer.as_asgi()),
+    re_path(r'ws/caregiver/(?P<caregiver_id>\d+)/$', consumers.CaregiverConsumer.as_asgi()),
     re_path(r'ws/driver/(?P<driver_id>[\w\+]+)/$', driver_consumers.DriverConsumer.as_asgi()),
 ]
@@ -0,0 +1,334 @@
+"""
+Advance bookings.
+
+A booking made with ``scheduled_for`` waits in ``scheduled`` until
+``SCHEDULED_BOOKING_LEAD_MINUTES`` before pickup.  The scheduler then moves
+it to ``pending`` and offers it to drivers exactly like an immediate ride,
+telling the passenger's ride socket how it went.
+
+The table is never polled as a whole.  Every ``BOOKING_SCHEDULER_REFRESH_SECONDS``
+one range scan over the ``(status, scheduled_for)`` index reads the
+bookings whose matching starts before the next scan.  They go into a
+``BucketQueue`` of ``BOOKING_SCHEDULER_BUCKET_SECONDS`` wide buckets, and the
+scheduler sleeps until the earliest bucket is due.  A whole bucket is
+released with one conditional UPDATE per ``BOOKING_SCHEDULER_CHUNK_SIZE``
+bookings.  Bookings cancelled or moved later in the meantime simply fail the
+condition.  Bookings whose pickup time passed more than
+``SCHEDULED_BOOKING_GRACE_MINUTES`` ago, because the scheduler was not
+running, are cancelled with a reason instead of being sent to drivers.
+
+With the in-memory channel layer the scheduler runs inside the web worker
+and is started by the first ride or driver socket.  With a shared layer run
+exactly one ``manage.py run_booking_scheduler`` instead; it refreshes its
+copy of the driver index from the database before matching.
+"""
+import asyncio
+import heapq
+import logging
+import math
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from drivers.spatial_index import driver_index, ensure_driver_index_loaded
+from pricing.promos import release_promo_redemption
+from .events import ride_events
+from .matching import BookingMatcher, driver_assigned_data
+from .models import Booking
+
+logger = logging.getLogger(__name__)
+
+
+def _aware(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+class BucketQueue:
+    """Booking ids grouped into fixed-width time buckets, earliest bucket first"""
+
+    def __init__(self, bucket_seconds=60):
+        self.bucket_seconds = bucket_seconds
+        self._heap = []         # bucket keys, each pushed once
+        self._buckets = {}      # bucket key -> set of booking ids
+        self._bucket_of = {}    # booking id -> bucket key
+
+    def __len__(self):
+        return len(self._bucket_of)
+
+    def __contains__(self, booking_id):
+        return booking_id in self._bucket_of
+
+    def push(self, booking_id, due):
+        """Queue a booking to come due at epoch time ``due``, moving it if already queued"""
+        key = math.floor(due / self.bucket_seconds)
+        previous = self._bucket_of.get(booking_id)
+        if previous == key:
+            return
+        if previous is not None:
+            self._buckets[previous].discard(booking_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = set()
+            heapq.heappush(self._heap, key)
+        bucket.add(booking_id)
+        self._bucket_of[booking_id] = key
+
+    def discard(self, booking_id):
+        # An emptied bucket stays in the heap until it comes due
+        key = self._bucket_of.pop(booking_id, None)
+        if key is not None:
+            self._buckets[key].discard(booking_id)
+
+    def next_due(self):
+        """Epoch time the earliest non-empty bucket opens, or None"""
+        while self._heap and not self._buckets[self._heap[0]]:
+            del self._buckets[heapq.heappop(self._heap)]
+        return self._heap[0] * self.bucket_seconds if self._heap else None
+
+    def pop_due(self, now):
+        """Remove and return the bookings in every bucket opened by ``now``"""
+        due = []
+        while self._heap and self._heap[0] * self.bucket_seconds <= now:
+            for booking_id in self._buckets.pop(heapq.heappop(self._heap)):
+                del self._bucket_of[booking_id]
+                due.append(booking_id)
+        return due
+
+
+class BookingScheduler:
+    """Releases scheduled bookings for matching ahead of their pickup time"""
+
+    EXPIRED_REASON = 'Pickup time passed before the ride could be sent to drivers'
+
+    def __init__(self, lead_time=900, grace=600, bucket_seconds=60, refresh_interval=300, chunk_size=500,
+                 max_concurrent=200, channel_layer=None, reload_driver_index=False):
+        self.lead_time = lead_time
+        self.grace = grace
+        self.refresh_interval = refresh_interval
+        self.chunk_size = chunk_size
+        self.max_concurrent = max_concurrent
+        self.reload_driver_index = reload_driver_index
+        self.queue = BucketQueue(bucket_seconds)
+        self._channel_layer = channel_layer
+        self.channel_name = None
+        self._matchers = {}     # booking id -> BookingMatcher
+        self._matching = set()
+        self._slots = None
+        self._listener = None
+        self._task = None
+        self.stats = {
+            'scans': 0, 'scanned': 0, 'released': 0, 'expired': 0, 'assigned': 0, 'unmatched': 0, 'lost': 0
+        }
+
+    @property
+    def channel_layer(self):
+        return self._channel_layer or get_channel_layer()
+
+    # Database side
+
+    def refresh(self, now):
+        """Queue every scheduled booking whose matching starts before the next refresh"""
+        horizon = now + self.lead_time + self.refresh_interval + self.queue.bucket_seconds
+        rows = Booking.objects.filter(
+            status='scheduled',
+            scheduled_for__lt=_aware(horizon)
+        ).order_by().values_list('id', 'scheduled_for')
+
+        scanned = 0
+        for booking_id, scheduled_for in rows.iterator(chunk_size=self.chunk_size):
+            self.queue.push(booking_id, scheduled_for.timestamp() - self.lead_time)
+            scanned += 1
+        self.stats['scans'] += 1
+        self.stats['scanned'] += scanned
+        return scanned
+
+    def release(self, booking_ids, now):
+        """
+        Move due bookings from scheduled to pending, one UPDATE per chunk.
+        Returns the released bookings with their passengers loaded.
+        """
+        cutoff = _aware(now + self.lead_time + self.queue.bucket_seconds)
+        stale = _aware(now - self.grace)
+        released = []
+        for start in range(0, len(booking_ids), self.chunk_size):
+            chunk = booking_ids[start:start + self.chunk_size]
+            self.expire(chunk, stale)
+            if Booking.objects.filter(
+                id__in=chunk,
+                status='scheduled',
+                scheduled_for__gte=stale,
+                scheduled_for__lte=cutoff
+            ).update(status='pending'):
+                released.extend(Booking.objects.select_related('passenger').filter(
+                    id__in=chunk,
+                    status='pending',
+                    driver__isnull=True
+                ))
+
+        # Queryset updates bypass the signals that tell caregivers
+        for booking in released:
+            ride_events.status_changed(booking)
+
+        if released and self.reload_driver_index:
+            # Driver sockets live in other processes; take their positions from the database
+            driver_index.clear()
+            ensure_driver_index_loaded()
+
+        self.stats['released'] += len(released)
+        if released:
+            logger.info(f'Released {len(released)} scheduled bookings for matching')
+        return released
+
+    def expire(self, booking_ids, stale):
+        """Cancel the bookings among ``booking_ids`` still scheduled for before ``stale``"""
+        expirable = Booking.objects.filter(id__in=booking_ids, status='scheduled', scheduled_for__lt=stale)
+        if not expirable.exists():
+            return 0
+
+        cancelled_at = timezone.now()
+        with transaction.atomic():
+            # Conditional, so a booking cancelled or moved meanwhile is left alone
+            if not expirable.update(
+                status='cancelled',
+                cancelled_at=cancelled_at,
+                cancellation_reason=self.EXPIRED_REASON
+            ):
+                return 0
+            expired_ids = list(Booking.objects.filter(
+                id__in=booking_ids,
+                status='cancelled',
+                cancelled_at=cancelled_at,
+                cancellation_reason=self.EXPIRED_REASON
+            ).values_list('id', flat=True))
+            for booking_id in expired_ids:
+                release_promo_redemption(booking_id)
+
+        # Queryset updates bypass the signals that tell caregivers
+        for booking_id in expired_ids:
+            ride_events.status_changed(booking_id)
+        self.stats['expired'] += len(expired_ids)
+        logger.warning(f'Expired {len(expired_ids)} scheduled bookings whose pickup time had passed')
+        return len(expired_ids)
+
+    # Matching
+
+    def start_matching(self, booking):
+        task = asyncio.get_running_loop().create_task(self.match(booking))
+        self._matching.add(task)
+        task.add_done_callback(self._matching.discard)
+
+    async def match(self, booking):
+        """Offer a released booking to drivers and tell the passenger how it went"""
+        async with self._slots:
+            group = f'ride_{booking.id}'
+            matcher = self._matchers[booking.id] = BookingMatcher(booking, self.channel_layer)
+            await self.channel_layer.group_add(group, self.channel_name)
+            try:
+                await self.notify(group, {
+                    'type': 'searching',
+                    'message': 'Searching for available drivers...',
+                    'ride_id': str(booking.id)
+                })
+                result = await matcher.run()
+
+                if result.status == 'assigned':
+                    self.stats['assigned'] += 1
+                    await self.notify(group, driver_assigned_data(
+                        matcher.driver(result.driver_id), booking, matcher.pickup_minutes
+                    ))
+                elif result.status in ('exhausted', 'timeout'):
+                    self.stats['unmatched'] += 1
+                    await self.notify(group, {
+                        'type': 'no_drivers',
+                        'message': 'No drivers available nearby'
+                    })
+                else:
+                    self.stats['lost'] += 1
+            except Exception:
+                logger.exception(f'Matching scheduled booking {booking.id} failed')
+            finally:
+                del self._matchers[booking.id]
+                await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def notify(self, group, data):
+        await self.channel_layer.group_send(group, {'type': 'ride_update', 'data': data})
+
+    async def _listen(self):
+        """Route driver responses on the ride groups to the bookings' dispatchers"""
+        while True:
+            message = await self.channel_layer.receive(self.channel_name)
+            if message.get('type') != 'driver_response':
+                continue
+            matcher = self._matchers.get(int(message['ride_id']))
+            if matcher is not None:
+                matcher.dispatcher.driver_responded(message['driver_id'], message['accepted'])
+
+    # Loop
+
+    def ensure_started(self):
+        """Start scheduling on the running event loop if it is not running yet"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        """Schedule until cancelled"""
+        await self._open()
+        next_refresh = 0.0
+        try:
+            while True:
+                now = time.time()
+                refresh = now >= next_refresh
+                if refresh:
+                    next_refresh = now + self.refresh_interval
+                try:
+                    await self.run_pass(now, refresh=refresh)
+                except Exception:
+                    logger.exception('Booking scheduler pass failed')
+
+                next_due = self.queue.next_due()
+                wake_at = next_refresh if next_due is None else min(next_due, next_refresh)
+                await asyncio.sleep(max(wake_at - time.time(), 0.05))
+        finally:
+            self._close()
+
+    async def run_once(self):
+        """Release what is due now and wait until it has been matched"""
+        await self._open()
+        try:
+            await self.run_pass(time.time())
+            await asyncio.gather(*self._matching, return_exceptions=True)
+        finally:
+            self._close()
+
+    async def run_pass(self, now, refresh=True):
+        if refresh:
+            await database_sync_to_async(self.refresh)(now)
+        due = self.queue.pop_due(now)
+        if due:
+            for booking in await database_sync_to_async(self.release)(due, now):
+                self.start_matching(booking)
+
+    async def _open(self):
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self.channel_name = await self.channel_layer.new_channel()
+        self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    def _close(self):
+        self._listener.cancel()
+        for task in list(self._matching):
+            task.cancel()
+
+
+booking_scheduler = BookingScheduler(
+    lead_time=settings.SCHEDULED_BOOKING_LEAD_MINUTES * 60,
+    grace=settings.SCHEDULED_BOOKING_GRACE_MINUTES * 60,
+    bucket_seconds=settings.BOOKING_SCHEDULER_BUCKET_SECONDS,
+    refresh_interval=settings.BOOKING_SCHEDULER_REFRESH_SECONDS,
+    chunk_size=settings.BOOKING_SCHEDULER_CHUNK_SIZE,
+    max_concurrent=settings.BOOKING_SCHEDULER_MAX_CONCURRENT,
+)
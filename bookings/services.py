@@ -0,0 +1,113 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from drivers.models import Driver
+from drivers.spatial_index import driver_index
+from pricing.promos import release_promo_redemption
+from .events import ride_events
+from .models import Booking
+
+
+class AssignmentService:
+    """Race-free assignment of drivers to bookings"""
+
+    ASSIGNED = 'assigned'
+    BOOKING_UNAVAILABLE = 'booking_unavailable'
+    DRIVER_UNAVAILABLE = 'driver_unavailable'
+
+    CANCELLABLE = ('scheduled', 'pending', 'confirmed')
+
+    @staticmethod
+    def assign(booking_id, driver_id):
+        """
+        Assign a driver to a pending booking.
+
+        Both rows are changed with conditional UPDATEs, one round trip each,
+        inside a transaction: the booking only moves if it is still pending
+        and the driver is only claimed if verified and not already busy.  Of
+        any number of concurrent calls for the same booking exactly one
+        returns ASSIGNED, and total_rides is incremented in the database so
+        no increment is lost.
+
+        Args:
+            booking_id: Booking primary key
+            driver_id: Driver primary key
+
+        Returns:
+            str: ASSIGNED, BOOKING_UNAVAILABLE or DRIVER_UNAVAILABLE
+        """
+        with transaction.atomic():
+            booked = Booking.objects.filter(id=booking_id, status='pending').update(
+                driver_id=driver_id,
+                status='confirmed'
+            )
+            if not booked:
+                return AssignmentService.BOOKING_UNAVAILABLE
+
+            claimed = Driver.objects.filter(id=driver_id, is_verified=True).exclude(status='busy').update(
+                status='busy',
+                total_rides=F('total_rides') + 1
+            )
+            if not claimed:
+                # Leave the booking pending for someone else
+                transaction.set_rollback(True)
+                return AssignmentService.DRIVER_UNAVAILABLE
+
+        # Queryset updates bypass the model signals that maintain the index
+        # and tell caregivers about the ride
+        driver_index.set_available(driver_id, False)
+        transaction.on_commit(partial(ride_events.status_changed, booking_id))
+        return AssignmentService.ASSIGNED
+
+    @staticmethod
+    def cancel(booking_id, reason='', statuses=CANCELLABLE):
+        """
+        Cancel a booking that is still in one of ``statuses``.
+
+        The booking is moved with a conditional UPDATE on its status and
+        driver as read just before, so an assignment landing in between is
+        never overwritten; the read is simply retried.  The driver of a
+        confirmed booking is freed and the promo code use released in the
+        same transaction.
+
+        Args:
+            booking_id: Booking primary key
+            reason: Stored as the cancellation reason
+            statuses: Statuses the booking may be cancelled from
+
+        Returns:
+            bool: True if this call cancelled the booking
+        """
+        for _ in range(3):
+            row = Booking.objects.filter(id=booking_id, status__in=statuses).values('driver_id').first()
+            if row is None:
+                return False
+            current = row['driver_id']
+
+            with transaction.atomic():
+                cancelled = Booking.objects.filter(id=booking_id, status__in=statuses, driver_id=current).update(
+                    status='cancelled',
+                    cancellation_reason=reason,
+                    cancelled_at=timezone.now()
+                )
+                if not cancelled:
+                    # Assigned or moved on since the read; look again
+                    continue
+
+                if current is not None:
+                    Driver.objects.filter(id=current, status='busy').update(status='available')
+                    transaction.on_commit(partial(AssignmentService._driver_freed, current))
+                release_promo_redemption(booking_id)
+
+            transaction.on_commit(partial(ride_events.status_changed, booking_id))
+            return True
+        return False
+
+    @staticmethod
+    def _driver_freed(driver_id):
+        # Verified drivers only; the index follows the row the signal would have seen
+        if Driver.objects.filter(id=driver_id, status='available', is_verified=True).exists():
+            driver_index.set_available(driver_id, True)
@@ -0,0 +1,36 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from api.models import CaregiverRelationship, ElderlyMember
+from .events import ride_events
+from .models import Booking
+
+
+@receiver(post_init, sender=Booking)
+def remember_booking_status(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred status field is not loaded just for this
+    instance._saved_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Booking)
+def booking_saved(sender, instance, created, **kwargs):
+    """Tell caregivers about status changes once the change is committed"""
+    if created or instance.status != instance._saved_status:
+        instance._saved_status = instance.status
+        transaction.on_commit(partial(ride_events.status_changed, instance))
+
+
+@receiver(post_save, sender=CaregiverRelationship)
+@receiver(post_delete, sender=CaregiverRelationship)
+def caregivers_changed(sender, instance, **kwargs):
+    """Re-resolve the passenger's ride audiences after their caregivers changed"""
+    transaction.on_commit(partial(ride_events.forget_passenger, instance.passenger_id))
+
+
+@receiver(post_save, sender=ElderlyMember)
+def elderly_member_saved(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(partial(ride_events.forget_elderly_member, instance.id))
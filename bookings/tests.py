@@ -1,3 +1,497 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from drivers.models import Driver
+from pricing.models import PromoCode, PromoRedemption
+from .dispatch import RideDispatcher
+from .eta import rebuild_speed_buckets
+from .events import ride_events
+from .matching import BookingMatcher
+from .models import Booking, TravelSpeedBucket
+from .scheduler import BookingScheduler, BucketQueue
+from .services import AssignmentService
+from .tracking import RideTracker
+
+User = get_user_model()
+
+
+class SimulatedDrivers:
+    """
+    Callbacks for a ``RideDispatcher`` backed by scripted drivers.
+
+    ``rings`` lists the driver ids found in each search ring.  ``answers``
+    maps a driver id to True (accept) or False (decline), sent shortly after
+    the offer; drivers missing from it never answer.
+    """
+
+    def __init__(self, rings, answers=None, assignable=True):
+        self.rings = rings
+        self.answers = answers or {}
+        self.assignable = assignable
+        self.dispatcher = None
+        self.ring_calls = []
+        self.offered = []
+        self.withdrawn = []
+        self.assign_attempts = []
+
+    def build(self, **options):
+        self.dispatcher = RideDispatcher(
+            candidate_rings=self.candidate_rings,
+            send_offers=self.send_offers,
+            try_assign=self.try_assign,
+            withdraw_offers=self.withdraw_offers,
+            **options
+        )
+        return self.dispatcher
+
+    async def candidate_rings(self, ring, exclude):
+        self.ring_calls.append((ring, set(exclude)))
+        if ring >= len(self.rings):
+            return None
+        return self.rings[ring]
+
+    async def send_offers(self, driver_ids):
+        self.offered.append(list(driver_ids))
+        loop = asyncio.get_running_loop()
+        for driver_id in driver_ids:
+            if driver_id in self.answers:
+                loop.call_later(0.01, self.dispatcher.driver_responded, driver_id, self.answers[driver_id])
+
+    async def try_assign(self, driver_id):
+        self.assign_attempts.append(driver_id)
+        if callable(self.assignable):
+            return self.assignable(driver_id)
+        return self.assignable
+
+    async def withdraw_offers(self, driver_ids):
+        self.withdrawn.extend(driver_ids)
+
+
+class RideDispatcherTests(SimpleTestCase):
+
+    async def test_first_accept_wins_and_other_offers_are_withdrawn(self):
+        drivers = SimulatedDrivers([[1, 2, 3]], answers={2: True})
+        result = await drivers.build(wave_size=3, offer_timeout=5).run()
+
+        self.assertEqual(result.status, 'assigned')
+        self.assertEqual(result.driver_id, 2)
+        self.assertEqual(drivers.offered, [[1, 2, 3]])
+        self.assertEqual(sorted(drivers.withdrawn), [1, 3])
+        self.assertEqual(drivers.dispatcher.state, 'assigned')
+
+    async def test_decline_offers_the_next_candidate(self):
+        drivers = SimulatedDrivers([[1, 2]], answers={1: False, 2: True})
+        result = await drivers.build(wave_size=1, offer_timeout=5).run()
+
+        self.assertEqual(result.status, 'assigned')
+        self.assertEqual(result.driver_id, 2)
+        self.assertEqual(drivers.offered, [[1], [2]])
+        self.assertEqual(drivers.assign_attempts, [2])
+
+    async def test_unanswered_offer_times_out_and_is_withdrawn(self):
+        drivers = SimulatedDrivers([[1, 2]], answers={2: True})
+        result = await drivers.build(wave_size=1, offer_timeout=0.05).run()
+
+        self.assertEqual(result.status, 'assigned')
+        self.assertEqual(result.driver_id, 2)
+        self.assertEqual(drivers.offered, [[1], [2]])
+        self.assertEqual(drivers.withdrawn, [1])
+
+    async def test_search_widens_to_the_next_ring(self):
+        drivers = SimulatedDrivers([[1], [1, 2]], answers={1: False, 2: True})
+        result = await drivers.build(wave_size=2, offer_timeout=5).run()
+
+        self.assertEqual(result.status, 'assigned')
+        self.assertEqual(result.driver_id, 2)
+        self.assertEqual(drivers.ring_calls[:2], [(0, set()), (1, {1})])
+        # Driver 1 is found again in the wider ring but not offered twice
+        self.assertEqual(drivers.offered, [[1], [2]])
+
+    async def test_exhausted_when_every_candidate_declines(self):
+        drivers = SimulatedDrivers([[1, 2], [3]], answers={1: False, 2: False, 3: False})
+        result = await drivers.build(wave_size=2, offer_timeout=5).run()
+
+        self.assertEqual(result.status, 'exhausted')
+        self.assertEqual(result.offered, [1, 2, 3])
+        self.assertEqual(drivers.assign_attempts, [])
+
+    async def test_exhausted_when_nobody_is_nearby(self):
+        drivers = SimulatedDrivers([[], []])
+        result = await drivers.build(offer_timeout=5).run()
+
+        self.assertEqual(result.status, 'exhausted')
+        self.assertEqual(result.offered, [])
+
+    async def test_gives_up_after_max_duration(self):
+        drivers = SimulatedDrivers([[1, 2]])
+        result = await drivers.build(wave_size=2, offer_timeout=5, max_duration=0.1).run()
+
+        self.assertEqual(result.status, 'timeout')
+        self.assertEqual(sorted(drivers.withdrawn), [1, 2])
+        self.assertLess(result.elapsed, 1)
+
+    async def test_driver_who_cannot_take_the_ride_is_skipped(self):
+        drivers = SimulatedDrivers(
+            [[1, 2]], answers={1: True, 2: True}, assignable=lambda driver_id: driver_id == 2 or None
+        )
+        result = await drivers.build(wave_size=1, offer_timeout=5).run()
+
+        self.assertEqual(result.status, 'assigned')
+        self.assertEqual(result.driver_id, 2)
+        self.assertEqual(drivers.assign_attempts, [1, 2])
+
+    async def test_lost_when_the_booking_is_gone(self):
+        drivers = SimulatedDrivers([[1, 2]], answers={1: True}, assignable=False)
+        result = await drivers.build(wave_size=2, offer_timeout=5).run()
+
+        self.assertEqual(result.status, 'lost')
+        self.assertEqual(sorted(drivers.withdrawn), [1, 2])
+
+    async def test_cancelling_withdraws_outstanding_offers(self):
+        drivers = SimulatedDrivers([[1, 2]])
+        task = asyncio.create_task(drivers.build(wave_size=2, offer_timeout=5).run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(sorted(drivers.withdrawn), [1, 2])
+        self.assertEqual(drivers.dispatcher.state, 'cancelled')
+
+
+class RecordingChannelLayer:
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message))
+
+
+class RideTrackerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.layer = RecordingChannelLayer()
+        self.tracker = RideTracker(
+            min_interval=0, max_point_age=0.2, resolve_ride=self.resolve_ride, channel_layer=self.layer
+        )
+
+    async def resolve_ride(self, driver_id):
+        return 7
+
+    async def publish(self, clock_offset):
+        """A frame stamped by a phone whose clock is ``clock_offset`` seconds behind"""
+        return await self.tracker.publish(1, -26.2, 28.0, recorded_at=time.time() - clock_offset)
+
+    async def test_phone_clock_far_behind_is_still_tracked(self):
+        for _ in range(3):
+            self.assertTrue(await self.publish(clock_offset=60))
+            await asyncio.sleep(0.01)
+
+        self.assertEqual(len(self.layer.sent), 3)
+        # Forwarded on the server's clock
+        self.assertAlmostEqual(self.layer.sent[-1][1]['recorded_at'], time.time(), delta=0.1)
+
+    async def test_late_frame_is_dropped_against_the_learned_clock(self):
+        recorded_at = time.time() - 60
+        self.assertTrue(await self.tracker.publish(1, -26.2, 28.0, recorded_at=recorded_at))
+        await asyncio.sleep(0.3)
+
+        # Newer than the last frame, but held back on the phone too long
+        self.assertFalse(await self.tracker.publish(1, -26.2, 28.0, recorded_at=recorded_at + 0.01))
+        self.assertEqual(self.tracker.stats['stale'], 1)
+
+    async def test_clock_set_back_is_learned_again(self):
+        self.assertTrue(await self.publish(clock_offset=0))
+        await asyncio.sleep(0.01)
+
+        results = []
+        for _ in range(8):
+            await asyncio.sleep(0.05)
+            results.append(await self.publish(clock_offset=30))
+
+        # Dropped for one max_point_age, then tracked on the new offset
+        self.assertFalse(results[0])
+        self.assertTrue(results[-1])
+
+
+class BookingMatcherTests(TestCase):
+
+    def setUp(self):
+        passenger = User.objects.create_user(username='passenger', phone_number='+27820000001', password='x')
+        self.booking = Booking.objects.create(
+            passenger=passenger,
+            passenger_phone=passenger.phone_number,
+            pickup_latitude=Decimal('-26.204100'),
+            pickup_longitude=Decimal('28.047300'),
+            pickup_address='Pickup',
+            dropoff_latitude=Decimal('-26.185000'),
+            dropoff_longitude=Decimal('28.055000'),
+            dropoff_address='Dropoff',
+            fare_amount=Decimal('50.00'),
+            status='pending',
+        )
+
+    async def test_cancelled_search_expires_the_booking(self):
+        matcher = BookingMatcher(self.booking, get_channel_layer())
+        drivers = SimulatedDrivers([[1, 2]])
+        matcher.dispatcher = drivers.build(wave_size=2, offer_timeout=5)
+        task = asyncio.create_task(matcher.run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        booking = await Booking.objects.aget(id=self.booking.id)
+        self.assertEqual(booking.status, 'cancelled')
+        self.assertEqual(sorted(drivers.withdrawn), [1, 2])
+
+
+class ConcurrentAssignmentTests(TransactionTestCase):
+    """Hundreds of drivers accepting one booking at the same moment"""
+
+    ACCEPTS = 200
+
+    def setUp(self):
+        passenger = User.objects.create(username='passenger', phone_number='+27820000001')
+        self.booking = Booking.objects.create(
+            passenger=passenger,
+            passenger_phone=passenger.phone_number,
+            pickup_latitude=Decimal('-26.204100'),
+            pickup_longitude=Decimal('28.047300'),
+            pickup_address='Pickup',
+            dropoff_latitude=Decimal('-26.185000'),
+            dropoff_longitude=Decimal('28.055000'),
+            dropoff_address='Dropoff',
+            fare_amount=Decimal('50.00'),
+            status='pending',
+        )
+        users = User.objects.bulk_create([
+            User(username=f'driver{i}', phone_number=f'+2783{i:07d}') for i in range(self.ACCEPTS)
+        ])
+        self.drivers = Driver.objects.bulk_create([
+            Driver(
+                user=user,
+                phone_number=user.phone_number,
+                license_number=f'L-{user.phone_number}',
+                vehicle_registration='TEST',
+                status='available',
+                is_verified=True,
+            )
+            for user in users
+        ])
+
+    def accept_all(self):
+        go = threading.Event()
+
+        def accept(driver_id):
+            go.wait()
+            try:
+                while True:
+                    try:
+                        return driver_id, AssignmentService.assign(self.booking.id, driver_id)
+                    except OperationalError:
+                        # The in-memory test database refuses concurrent writers
+                        # instead of queueing them; the transaction was rolled
+                        # back, so try again like a client would
+                        time.sleep(0.001)
+            finally:
+                connection.close()
+
+        # Caregiver notifications read the database after the commit, where a
+        # refused read could not be told apart from a lost race
+        with mock.patch.object(ride_events, 'status_changed'), ThreadPoolExecutor(max_workers=32) as pool:
+            futures = [pool.submit(accept, driver.id) for driver in self.drivers]
+            go.set()
+            return [future.result() for future in futures]
+
+    def test_exactly_one_driver_wins(self):
+        results = self.accept_all()
+
+        outcomes = Counter(result for _, result in results)
+        self.assertEqual(outcomes, {
+            AssignmentService.ASSIGNED: 1,
+            AssignmentService.BOOKING_UNAVAILABLE: self.ACCEPTS - 1,
+        })
+        winners = [driver_id for driver_id, result in results if result == AssignmentService.ASSIGNED]
+
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.status, 'confirmed')
+        self.assertEqual(self.booking.driver_id, winners[0])
+
+        drivers = Driver.objects.filter(id__in=[driver.id for driver in self.drivers])
+        self.assertEqual(list(drivers.filter(status='busy').values_list('id', flat=True)), winners)
+        self.assertEqual(drivers.filter(status='available').count(), self.ACCEPTS - 1)
+        rides = dict(drivers.values_list('id', 'total_rides'))
+        self.assertEqual(rides[winners[0]], 1)
+        self.assertEqual(sum(rides.values()), 1)
+
+
+class SpeedBucketRebuildTests(TestCase):
+
+    def setUp(self):
+        self.passenger = User.objects.create(username='passenger', phone_number='+27820000001')
+        self.dropoff_time = timezone.now() - timedelta(hours=2)
+
+    def trip(self, status='completed'):
+        return Booking.objects.create(
+            passenger=self.passenger,
+            passenger_phone=self.passenger.phone_number,
+            pickup_latitude=Decimal('-26.204100'),
+            pickup_longitude=Decimal('28.047300'),
+            pickup_address='Pickup',
+            dropoff_latitude=Decimal('-26.104100'),
+            dropoff_longitude=Decimal('28.147300'),
+            dropoff_address='Dropoff',
+            fare_amount=Decimal('150.00'),
+            status=status,
+            pickup_time=self.dropoff_time - timedelta(minutes=30),
+            dropoff_time=self.dropoff_time,
+        )
+
+    def trips_counted(self):
+        return sum(TravelSpeedBucket.objects.values_list('trip_count', flat=True))
+
+    def test_trip_completed_late_is_counted_once(self):
+        self.trip()
+        self.assertEqual(rebuild_speed_buckets()['trips'], 1)
+
+        # Dropped off at the same moment, but only marked completed after the rebuild
+        late = self.trip(status='in_progress')
+        self.assertEqual(rebuild_speed_buckets()['trips'], 0)
+        Booking.objects.filter(id=late.id).update(status='completed')
+
+        self.assertEqual(rebuild_speed_buckets()['trips'], 1)
+        self.assertEqual(rebuild_speed_buckets()['trips'], 0)
+        self.assertEqual(self.trips_counted(), 2)
+
+    def test_full_rebuild_counts_every_recent_trip_once(self):
+        self.trip()
+        rebuild_speed_buckets()
+        self.trip()
+
+        self.assertEqual(rebuild_speed_buckets(full=True)['trips'], 2)
+        self.assertEqual(rebuild_speed_buckets()['trips'], 0)
+        self.assertEqual(self.trips_counted(), 2)
+
+
+class BucketQueueTests(SimpleTestCase):
+
+    def setUp(self):
+        self.queue = BucketQueue(bucket_seconds=60)
+
+    def test_buckets_come_due_in_order(self):
+        for booking_id, due in [(1, 250), (2, 70), (3, 130), (4, 75)]:
+            self.queue.push(booking_id, due)
+
+        self.assertEqual(self.queue.next_due(), 60)
+        self.assertEqual(self.queue.pop_due(59), [])
+        self.assertEqual(sorted(self.queue.pop_due(60)), [2, 4])
+        self.assertEqual(self.queue.next_due(), 120)
+        self.assertEqual(self.queue.pop_due(1000), [3, 1])
+        self.assertEqual(len(self.queue), 0)
+        self.assertIsNone(self.queue.next_due())
+
+    def test_pushing_again_moves_the_booking(self):
+        self.queue.push(1, 70)
+        self.queue.push(1, 200)
+
+        self.assertEqual(self.queue.next_due(), 180)
+        self.assertEqual(self.queue.pop_due(100), [])
+        self.assertEqual(self.queue.pop_due(200), [1])
+
+    def test_discarded_booking_never_comes_due(self):
+        self.queue.push(1, 70)
+        self.queue.push(2, 130)
+        self.queue.discard(1)
+
+        self.assertNotIn(1, self.queue)
+        self.assertEqual(self.queue.next_due(), 120)
+        self.assertEqual(self.queue.pop_due(1000), [2])
+
+
+@mock.patch('bookings.scheduler.ride_events.status_changed')
+class BookingSchedulerTests(TestCase):
+    """The scheduler's database side, driven by a clock the test controls"""
+
+    def setUp(self):
+        self.passenger = User.objects.create(username='passenger', phone_number='+27820000001')
+        self.scheduler = BookingScheduler(lead_time=900, grace=600, bucket_seconds=60, refresh_interval=300)
+        self.now = float(int(time.time()))
+
+    def schedule(self, seconds_from_now):
+        return Booking.objects.create(
+            passenger=self.passenger,
+            passenger_phone=self.passenger.phone_number,
+            pickup_latitude=Decimal('-26.204100'),
+            pickup_longitude=Decimal('28.047300'),
+            pickup_address='Pickup',
+            dropoff_latitude=Decimal('-26.185000'),
+            dropoff_longitude=Decimal('28.055000'),
+            dropoff_address='Dropoff',
+            fare_amount=Decimal('120.00'),
+            status='scheduled',
+            scheduled_for=datetime.fromtimestamp(self.now + seconds_from_now, tz=dt_timezone.utc),
+        )
+
+    def run_pass(self, now):
+        self.scheduler.refresh(now)
+        return self.scheduler.release(self.scheduler.queue.pop_due(now), now)
+
+    def status(self, booking):
+        booking.refresh_from_db()
+        return booking.status
+
+    def test_bookings_are_released_once_within_the_lead_time(self, status_changed):
+        soon = self.schedule(600)
+        later = self.schedule(3600)
+
+        self.assertEqual(self.scheduler.refresh(self.now), 1)
+        self.assertEqual([booking.id for booking in self.run_pass(self.now)], [soon.id])
+        self.assertEqual(self.status(soon), 'pending')
+        self.assertEqual(self.status(later), 'scheduled')
+
+        # Queued by the refresh before its bucket opens, released when it does
+        self.assertEqual(self.run_pass(self.now + 2500), [])
+        self.assertIn(later.id, self.scheduler.queue)
+        self.assertEqual([booking.id for booking in self.run_pass(self.now + 2700)], [later.id])
+        self.assertEqual(self.scheduler.stats['released'], 2)
+
+    def test_booking_cancelled_while_queued_is_not_released(self, status_changed):
+        booking = self.schedule(600)
+        self.scheduler.refresh(self.now)
+        Booking.objects.filter(id=booking.id).update(status='cancelled')
+
+        self.assertEqual(self.scheduler.release(self.scheduler.queue.pop_due(self.now), self.now), [])
+        self.assertEqual(self.status(booking), 'cancelled')
+
+    def test_stale_booking_is_expired_and_gives_its_promo_use_back(self, status_changed):
+        stale = self.schedule(-1200)
+        promo = PromoCode.objects.create(
+            code='LAUNCH', description='Launch discount', discount_type='fixed', discount_value=Decimal('20.00'),
+            uses_count=1, valid_from=timezone.now() - timedelta(days=1), valid_until=timezone.now() + timedelta(days=1)
+        )
+        redemption = PromoRedemption.objects.create(promo_code=promo, user=self.passenger, booking=stale)
+
+        self.assertEqual(self.run_pass(self.now), [])
+
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'cancelled')
+        self.assertEqual(stale.cancellation_reason, BookingScheduler.EXPIRED_REASON)
+        redemption.refresh_from_db()
+        self.assertIsNotNone(redemption.released_at)
+        promo.refresh_from_db()
+        self.assertEqual(promo.uses_count, 0)
+        self.assertEqual(self.scheduler.stats['expired'], 1)
+        status_changed.assert_called_once_with(stale.id)
@@ -0,0 +1,318 @@
+"""
+Live driver positions for passengers.
+
+Once a driver is assigned, every location frame the driver WebSocket accepts
+is handed to the ``RideTracker``, which forwards it to the ride's
+``ride_{id}`` group:
+
+* stale points are dropped: frames recorded more than
+  ``TRACKING_MAX_POINT_AGE`` seconds ago, or no newer than the last point
+  accepted for the ride.  Phones stamp frames with their own clocks, which
+  can be minutes off, so ages are measured after subtracting a clock offset
+  learned per driver: the smallest apparent age the driver's frames have
+  shown.  A driver whose frames keep looking stale for a whole
+  ``TRACKING_MAX_POINT_AGE`` had their clock set back, and the offset is
+  learned again.  Forwarded positions carry their time on the server's
+  clock;
+* each ride is forwarded at most once per interval, newest position wins and
+  goes out when the interval is up.  The interval starts at
+  ``TRACKING_MIN_INTERVAL`` and grows by that much for every
+  ``TRACKING_SUBSCRIBERS_PER_STEP`` sockets this worker has following the
+  ride, since each frame is fanned out to all of them.
+
+Subscribers get full positions over the channel layer and turn them into
+compact frames per socket with a ``TrackingStream``:
+
+* a keyframe first and every ``TRACKING_KEYFRAME_INTERVAL`` frames::
+
+    {"type": "driver_position", "ride_id": 7, "lat": -26.20411, "lng": 28.04731,
+     "heading": 90.0, "speed": 12.5, "t": 1760000000000}
+
+* deltas in between, with latitude and longitude in 1e-5 degrees (about a
+  metre) and time in milliseconds; ``heading`` and ``speed`` are only
+  included when they changed::
+
+    {"type": "driver_position_delta", "ride_id": 7, "d": [-12, 30, 1000]}
+
+A socket that falls behind, so that frames reach it more than
+``TRACKING_MAX_LAG`` seconds after they were published, drops them and
+doubles its own interval, up to ``TRACKING_MAX_INTERVAL``; every frame sent
+on time shrinks it by a tenth again.
+"""
+import asyncio
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .events import ride_events
+
+
+def ride_group(ride_id):
+    return f'ride_{ride_id}'
+
+
+@dataclass
+class _DriverClock:
+    offset: float                           # phone clock behind the server's, plus the fastest delivery
+    stale_since: Optional[float] = None     # server time of the first of a run of stale frames
+
+
+@dataclass
+class _RideState:
+    driver_id: int
+    last_recorded: float = 0.0
+    last_sent: float = float('-inf')
+    pending: Optional[dict] = None
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class RideTracker:
+    """Forwards assigned drivers' positions to their ride groups at a controlled rate"""
+
+    def __init__(self, min_interval=1.0, subscribers_per_step=5, max_point_age=10.0,
+                 resolve_ride=None, channel_layer=None):
+        """
+        Args:
+            resolve_ride: Coroutine function mapping a driver id to the id of
+                the ride they are on, or None; defaults to the ride event
+                router's cached lookup
+            channel_layer: Defaults to the configured layer
+        """
+        self.min_interval = min_interval
+        self.subscribers_per_step = subscribers_per_step
+        self.max_point_age = max_point_age
+        self.resolve_ride = resolve_ride or ride_events.driver_ride_id
+        self._channel_layer = channel_layer
+        self._rides = {}            # ride id -> _RideState
+        self._driver_rides = {}     # driver id -> ride id being tracked
+        self._clocks = {}           # driver id -> _DriverClock
+        self._subscribers = Counter()
+        self.stats = {'received': 0, 'untracked': 0, 'stale': 0, 'coalesced': 0, 'forwarded': 0}
+
+    @property
+    def channel_layer(self):
+        if self._channel_layer is None:
+            self._channel_layer = get_channel_layer()
+        return self._channel_layer
+
+    # Subscribers
+
+    def subscribe(self, ride_id):
+        self._subscribers[ride_id] += 1
+
+    def unsubscribe(self, ride_id):
+        self._subscribers[ride_id] -= 1
+        if self._subscribers[ride_id] <= 0:
+            del self._subscribers[ride_id]
+
+    def interval(self, ride_id):
+        """Seconds between frames forwarded for ``ride_id``"""
+        return self.min_interval * (1 + self._subscribers.get(ride_id, 0) // self.subscribers_per_step)
+
+    # Publishing
+
+    async def publish(self, driver_id, latitude, longitude, heading=None, speed=None, recorded_at=None):
+        """
+        Forward a driver position to the ride the driver is on.  Returns False
+        when the point was dropped as stale or the driver has no ride.
+        """
+        self.stats['received'] += 1
+        ride_id = await self.resolve_ride(driver_id)
+        if self._driver_rides.get(driver_id) not in (None, ride_id):
+            self.end_ride(self._driver_rides.pop(driver_id))
+        if ride_id is None:
+            self.stats['untracked'] += 1
+            return False
+
+        now = time.time()
+        recorded_at = recorded_at or now
+        state = self._rides.get(ride_id)
+        if state is None:
+            state = self._rides[ride_id] = _RideState(driver_id)
+            self._driver_rides[driver_id] = ride_id
+        # The phone's timestamp, moved onto our clock by the learned offset,
+        # only orders the driver's own frames
+        age = self.point_age(driver_id, recorded_at, now)
+        recorded_at = now - age
+        if age > self.max_point_age or recorded_at <= state.last_recorded:
+            self.stats['stale'] += 1
+            return False
+        state.last_recorded = recorded_at
+
+        position = {
+            'type': 'driver_position',
+            'ride_id': ride_id,
+            'latitude': float(latitude),
+            'longitude': float(longitude),
+            'heading': float(heading) if heading is not None else None,
+            'speed': float(speed) if speed is not None else None,
+            'recorded_at': recorded_at,
+        }
+
+        loop = asyncio.get_running_loop()
+        wait = state.last_sent + self.interval(ride_id) - loop.time()
+        if wait <= 0 and state.timer is None:
+            await self._forward(ride_id, state, position)
+            return True
+
+        if state.pending is not None:
+            self.stats['coalesced'] += 1
+        state.pending = position
+        if state.timer is None:
+            state.timer = loop.call_later(max(wait, 0), self._send_pending, ride_id)
+        return True
+
+    def point_age(self, driver_id, recorded_at, now):
+        """Seconds between ``recorded_at`` on the driver's clock and ``now`` on ours"""
+        apparent = now - recorded_at
+        clock = self._clocks.get(driver_id)
+        if clock is None or apparent < clock.offset:
+            self._clocks[driver_id] = _DriverClock(apparent)
+            return 0.0
+
+        age = apparent - clock.offset
+        if age <= self.max_point_age:
+            clock.stale_since = None
+        elif clock.stale_since is None:
+            clock.stale_since = now
+        elif now - clock.stale_since >= self.max_point_age:
+            # Frames still arriving but all stale: the phone's clock moved back
+            self._clocks[driver_id] = _DriverClock(apparent)
+            return 0.0
+        return age
+
+    def _send_pending(self, ride_id):
+        state = self._rides.get(ride_id)
+        if state is None:
+            return
+        state.timer = None
+        position, state.pending = state.pending, None
+        if position is not None:
+            asyncio.ensure_future(self._forward(ride_id, state, position))
+
+    async def _forward(self, ride_id, state, position):
+        state.last_sent = asyncio.get_running_loop().time()
+        position['sent_at'] = time.time()
+        self.stats['forwarded'] += 1
+        await self.channel_layer.group_send(ride_group(ride_id), position)
+
+    def end_ride(self, ride_id):
+        """Stop tracking ``ride_id``, discarding any position not sent yet"""
+        state = self._rides.pop(ride_id, None)
+        if state is not None and state.timer is not None:
+            state.timer.cancel()
+
+    def forget_driver(self, driver_id):
+        """Drop tracking state for a driver who disconnected"""
+        self._clocks.pop(driver_id, None)
+        ride_id = self._driver_rides.pop(driver_id, None)
+        if ride_id is not None:
+            self.end_ride(ride_id)
+
+
+class TrackingStream:
+    """
+    One socket's view of one ride: throttles to the socket's own pace and
+    delta-encodes what it sends.
+    """
+
+    def __init__(self, send, min_interval=None, max_interval=None, max_lag=None, keyframe_interval=None):
+        """
+        Args:
+            send: Coroutine function taking one frame dict
+        """
+        self.send = send
+        self.min_interval = settings.TRACKING_MIN_INTERVAL if min_interval is None else min_interval
+        self.max_interval = settings.TRACKING_MAX_INTERVAL if max_interval is None else max_interval
+        self.max_lag = settings.TRACKING_MAX_LAG if max_lag is None else max_lag
+        self.keyframe_interval = keyframe_interval or settings.TRACKING_KEYFRAME_INTERVAL
+        self.interval = self.min_interval
+        self.last_sent = float('-inf')
+        self.pending = None
+        self.timer = None
+        self.reference = None       # (lat e5, lng e5, t ms, heading, speed) the client last saw
+        self.since_keyframe = 0
+        self.stats = {'sent': 0, 'keyframes': 0, 'late': 0, 'coalesced': 0}
+
+    async def push(self, position):
+        """Take a position published by the tracker"""
+        if time.time() - position['sent_at'] > self.max_lag:
+            # The socket is not keeping up; skip ahead and slow down
+            self.stats['late'] += 1
+            self.interval = min(self.max_interval, self.interval * 2)
+            return
+
+        loop = asyncio.get_running_loop()
+        wait = self.last_sent + self.interval - loop.time()
+        if wait <= 0 and self.timer is None:
+            await self._send(position)
+            return
+
+        if self.pending is not None:
+            self.stats['coalesced'] += 1
+        self.pending = position
+        if self.timer is None:
+            self.timer = loop.call_later(max(wait, 0), self._send_pending)
+
+    def _send_pending(self):
+        self.timer = None
+        position, self.pending = self.pending, None
+        if position is not None:
+            asyncio.ensure_future(self._send(position))
+
+    async def _send(self, position):
+        self.last_sent = asyncio.get_running_loop().time()
+        self.interval = max(self.min_interval, self.interval * 0.9)
+        self.stats['sent'] += 1
+        await self.send(self.encode(position))
+
+    def encode(self, position):
+        """Keyframe or delta frame for ``position``, advancing the reference the client holds"""
+        lat = round(position['latitude'] * 100000)
+        lng = round(position['longitude'] * 100000)
+        t = round(position['recorded_at'] * 1000)
+        heading, speed = position['heading'], position['speed']
+
+        if self.reference is None or self.since_keyframe >= self.keyframe_interval:
+            self.reference = (lat, lng, t, heading, speed)
+            self.since_keyframe = 0
+            self.stats['keyframes'] += 1
+            return {
+                'type': 'driver_position',
+                'ride_id': position['ride_id'],
+                'lat': lat / 100000,
+                'lng': lng / 100000,
+                'heading': heading,
+                'speed': speed,
+                't': t,
+            }
+
+        ref_lat, ref_lng, ref_t, ref_heading, ref_speed = self.reference
+        frame = {
+            'type': 'driver_position_delta',
+            'ride_id': position['ride_id'],
+            'd': [lat - ref_lat, lng - ref_lng, t - ref_t],
+        }
+        if heading != ref_heading:
+            frame['heading'] = heading
+        if speed != ref_speed:
+            frame['speed'] = speed
+        self.reference = (lat, lng, t, heading, speed)
+        self.since_keyframe += 1
+        return frame
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+ride_tracker = RideTracker(
+    min_interval=settings.TRACKING_MIN_INTERVAL,
+    subscribers_per_step=settings.TRACKING_SUBSCRIBERS_PER_STEP,
+    max_point_age=settings.TRACKING_MAX_POINT_AGE,
+)
@@ -0,0 +1,259 @@
+"""
+Channel layer helpers.
+
+``SQLiteChannelLayer`` is a multi-process channel layer backed by a shared
+sqlite file.  It needs no server, so it is the stand-in for Redis in tests
+and local multi-worker runs; production should use ``channels_redis``.
+
+``LocalChannelLayer`` is the in-memory layer for single-process runs.
+
+``group_send_many`` fans one message out to many groups.  Layers that can do
+it in a single round trip expose their own ``group_send_many`` and are used
+directly; for any other layer the sends are issued concurrently.
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import string
+import threading
+import time
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer, InMemoryChannelLayer
+
+
+async def group_send_many(channel_layer, groups, message):
+    """Send ``message`` to every group in ``groups``"""
+    groups = list(groups)
+    if not groups:
+        return
+    if hasattr(channel_layer, 'group_send_many'):
+        await channel_layer.group_send_many(groups, message)
+    else:
+        await asyncio.gather(*(channel_layer.group_send(group, message) for group in groups))
+
+
+class LocalChannelLayer(InMemoryChannelLayer):
+    """
+    ``InMemoryChannelLayer`` with its expiry sweep rate-limited.
+
+    The stock layer walks every channel and group membership on each send,
+    so fanning positions out to thousands of sockets costs time quadratic in
+    the number of sockets.  Sweeping at most every ``cleanup_interval``
+    seconds keeps sends constant-time; expired messages and memberships
+    just linger up to that much longer.
+    """
+
+    def __init__(self, cleanup_interval=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.cleanup_interval = cleanup_interval
+        self._next_cleanup = 0.0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now >= self._next_cleanup:
+            self._next_cleanup = now + self.cleanup_interval
+            super()._clean_expired()
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """
+    Channel layer storing messages and group memberships in sqlite.
+
+    Every worker process points at the same database file; sqlite's WAL mode
+    lets them read and write it concurrently.  Receivers poll their channel
+    with a short back-off, which keeps delivery latency in the low
+    milliseconds without any extra infrastructure.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path='channels.sqlite3', expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, poll_interval=0.001, max_poll_interval=0.05):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self._local = threading.local()
+        self._schema_ready = False
+
+    # Connection handling
+
+    def _connection(self):
+        # Connections are per thread and must not survive a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            if not self._schema_ready:
+                self._create_schema(conn)
+                self._schema_ready = True
+        return conn
+
+    @staticmethod
+    def _create_schema(conn):
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS channel_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                body BLOB NOT NULL,
+                expires REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS channel_messages_channel ON channel_messages (channel, id);
+            CREATE TABLE IF NOT EXISTS channel_groups (
+                grp TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                expires REAL NOT NULL,
+                PRIMARY KEY (grp, channel)
+            );
+            """
+        )
+
+    async def _run(self, func, *args):
+        return await asyncio.to_thread(func, *args)
+
+    # Channel API
+
+    async def new_channel(self, prefix='specific.'):
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f'{prefix}sqlite!{suffix}'
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        await self._run(self._send, channel, msgpack.packb(message, use_bin_type=True))
+
+    def _send(self, channel, body):
+        conn = self._connection()
+        now = time.time()
+        # The count and the insert share a write lock, so concurrent senders
+        # cannot both see room for the last message
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            (queued,) = conn.execute(
+                'SELECT COUNT(*) FROM channel_messages WHERE channel = ? AND expires > ?', (channel, now)
+            ).fetchone()
+            if queued >= self.get_capacity(channel):
+                raise ChannelFull(channel)
+            conn.execute(
+                'INSERT INTO channel_messages (channel, body, expires) VALUES (?, ?, ?)',
+                (channel, body, now + self.expiry)
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        delay = self.poll_interval
+        while True:
+            body = await self._run(self._pop, channel)
+            if body is not None:
+                return msgpack.unpackb(body, raw=False)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def _pop(self, channel):
+        row = self._connection().execute(
+            """
+            DELETE FROM channel_messages WHERE id = (
+                SELECT id FROM channel_messages
+                WHERE channel = ? AND expires > ?
+                ORDER BY id LIMIT 1
+            ) RETURNING body
+            """,
+            (channel, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    async def flush(self):
+        await self._run(self._flush)
+
+    def _flush(self):
+        conn = self._connection()
+        conn.execute('DELETE FROM channel_messages')
+        conn.execute('DELETE FROM channel_groups')
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(self._group_add, group, channel)
+
+    def _group_add(self, group, channel):
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO channel_groups (grp, channel, expires) VALUES (?, ?, ?)',
+            (group, channel, now + self.group_expiry)
+        )
+        # Joins happen once per connection, which makes them a cheap place to
+        # sweep out messages and memberships nobody collected.
+        conn.execute('DELETE FROM channel_messages WHERE expires <= ?', (now,))
+        conn.execute('DELETE FROM channel_groups WHERE expires <= ?', (now,))
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(
+            lambda: self._connection().execute(
+                'DELETE FROM channel_groups WHERE grp = ? AND channel = ?', (group, channel)
+            )
+        )
+
+    async def group_send(self, group, message):
+        await self.group_send_many([group], message)
+
+    async def group_send_many(self, groups, message):
+        """Deliver ``message`` to every member of every group in one transaction"""
+        assert isinstance(message, dict), 'message is not a dict'
+        for group in groups:
+            self.require_valid_group_name(group)
+        await self._run(self._group_send_many, list(groups), msgpack.packb(message, use_bin_type=True))
+
+    def _group_send_many(self, groups, body):
+        conn = self._connection()
+        now = time.time()
+        placeholders = ','.join('?' * len(groups))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # One row per membership, matching what separate group_send calls deliver
+            channels = [
+                channel for (channel,) in conn.execute(
+                    f'SELECT channel FROM channel_groups WHERE grp IN ({placeholders}) AND expires > ?',
+                    (*groups, now)
+                )
+            ]
+            queued = {}
+            if channels:
+                queued = dict(conn.execute(
+                    f"""
+                    SELECT channel, COUNT(*) FROM channel_messages
+                    WHERE expires > ? AND channel IN ({','.join('?' * len(channels))})
+                    GROUP BY channel
+                    """,
+                    (now, *channels)
+                ).fetchall())
+
+            rows = []
+            for channel in channels:
+                # Full channels are skipped silently, as group_send does on Redis
+                if queued.get(channel, 0) >= self.get_capacity(channel):
+                    continue
+                queued[channel] = queued.get(channel, 0) + 1
+                rows.append((channel, body, now + self.expiry))
+            conn.executemany('INSERT INTO channel_messages (channel, body, expires) VALUES (?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
     "settings",
     "pricing",
     "payments",
+    "geo",
 ]
 
 MIDDLEWARE = [
@@ -85,21 +87,189 @@ WSGI_APPLICATION = "care_connect_backend.wsgi.application"
 ASGI_APPLICATION = "care_connect_backend.asgi.application"
 
 # Channels configuration
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+# CHANNEL_LAYER_BACKEND selects the layer:
+#   memory - single process only (default, development)
+#   redis  - channels_redis, required for more than one Daphne worker
+#   sqlite - shared sqlite file, a server-less multi-process stand-in for tests
+CHANNEL_LAYER_BACKEND = os.getenv('CHANNEL_LAYER_BACKEND', 'memory')
+
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')],
+                "capacity": int(os.getenv('CHANNEL_LAYER_CAPACITY', '1000')),
+            },
+        },
+    }
+elif CHANNEL_LAYER_BACKEND == 'sqlite':
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "care_connect_backend.channel_layers.SQLiteChannelLayer",
+            "CONFIG": {
+                "path": os.getenv('CHANNEL_LAYER_SQLITE_PATH', str(BASE_DIR / 'channels.sqlite3')),
+                "capacity": int(os.getenv('CHANNEL_LAYER_CAPACITY', '1000')),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "care_connect_backend.channel_layers.LocalChannelLayer"
+        }
     }
-}
 
-# For production with Redis:
-# CHANNEL_LAYERS = {
-#     "default": {
-#         "BACKEND": "channels_redis.core.RedisChannelLayer",
-#         "CONFIG": {
-#             "hosts": [("127.0.0.1", 6379)],
-#         },
-#     },
-# }
+# WebSockets authenticate with a JWT access token (?token=...) when one is
+# sent.  Off by default so clients that predate tokens keep connecting by URL
+# identity alone; once every client sends a token, set
+# WEBSOCKET_AUTH_REQUIRED=True to refuse connections without one.
+WEBSOCKET_AUTH_REQUIRED = os.getenv('WEBSOCKET_AUTH_REQUIRED', 'False') == 'True'
+
+# Driver matching
+# Grid cell size of the in-process driver spatial index (0.01 degrees ~ 1.1km)
+DRIVER_INDEX_CELL_DEGREES = 0.01
+# With a shared channel layer other workers see drivers this one does not;
+# its index then catches up from the database every REFRESH_SECONDS
+DRIVER_INDEX_REFRESH_SECONDS = (
+    0 if CHANNEL_LAYER_BACKEND == 'memory' else float(os.getenv('DRIVER_INDEX_REFRESH_SECONDS', '5'))
+)
+# Driver location frames are coalesced in memory and written in batches
+DRIVER_LOCATION_FLUSH_INTERVAL = float(os.getenv('DRIVER_LOCATION_FLUSH_INTERVAL', '2.0'))
+DRIVER_LOCATION_BUFFER_MAX_PENDING = 5000
+# Drivers silent for PRESENCE_TIMEOUT seconds (DISCONNECT_GRACE after closing
+# their socket) are taken out of matching and marked offline.  Presence is
+# authoritative when one worker sees every driver socket.
+DRIVER_PRESENCE_TIMEOUT = int(os.getenv('DRIVER_PRESENCE_TIMEOUT', '45'))
+DRIVER_PRESENCE_DISCONNECT_GRACE = 10
+DRIVER_PRESENCE_TICK = 1.0
+DRIVER_PRESENCE_AUTHORITATIVE = CHANNEL_LAYER_BACKEND == 'memory'
+# Ride offers: search rings widen outwards, WAVE_SIZE offers are outstanding
+# at a time and each driver has OFFER_TIMEOUT seconds to respond
+DISPATCH_SEARCH_RADII_KM = [5, 10, 20]
+DISPATCH_CANDIDATES_PER_RING = 10
+DISPATCH_WAVE_SIZE = 3
+DISPATCH_OFFER_TIMEOUT = 15
+DISPATCH_MAX_SECONDS = 120
+# 'greedy' offers each booking to its nearest drivers at once; 'batched'
+# collects bookings for BATCH_WINDOW seconds and pairs the batch with drivers
+# minimising total pickup distance, from each pickup's BATCH_CANDIDATES
+# nearest drivers within BATCH_RADIUS_KM
+MATCHING_MODE = os.getenv('MATCHING_MODE', 'greedy')
+MATCHING_BATCH_WINDOW = float(os.getenv('MATCHING_BATCH_WINDOW', '2.0'))
+MATCHING_BATCH_CANDIDATES = 20
+MATCHING_BATCH_RADIUS_KM = 20
+
+# Scheduled bookings
+# Matching starts LEAD_MINUTES before pickup; rides can be booked between
+# MIN_NOTICE_MINUTES and MAX_ADVANCE_DAYS ahead
+SCHEDULED_BOOKING_LEAD_MINUTES = int(os.getenv('SCHEDULED_BOOKING_LEAD_MINUTES', '15'))
+# A booking still scheduled this long after its pickup time (the scheduler
+# was down) is expired instead of being sent to drivers
+SCHEDULED_BOOKING_GRACE_MINUTES = int(os.getenv('SCHEDULED_BOOKING_GRACE_MINUTES', '10'))
+SCHEDULED_BOOKING_MIN_NOTICE_MINUTES = 30
+SCHEDULED_BOOKING_MAX_ADVANCE_DAYS = 90
+# Due bookings are released a BUCKET_SECONDS bucket at a time; the index is
+# scanned for upcoming ones every REFRESH_SECONDS, which must stay below
+# MIN_NOTICE - LEAD so no booking is found late
+BOOKING_SCHEDULER_BUCKET_SECONDS = 60
+BOOKING_SCHEDULER_REFRESH_SECONDS = 300
+BOOKING_SCHEDULER_CHUNK_SIZE = 500
+BOOKING_SCHEDULER_MAX_CONCURRENT = 500
+# Run the scheduler inside the web worker; otherwise run_booking_scheduler
+BOOKING_SCHEDULER_IN_PROCESS = CHANNEL_LAYER_BACKEND == 'memory'
+
+# Caregiver ride events
+# Who follows a ride is resolved once per ride and kept at most this long
+RIDE_EVENTS_AUDIENCE_TTL = 4 * 3600
+# Seconds a worker trusts its record of which ride a driver is on
+RIDE_EVENTS_DRIVER_RIDE_TTL = 10
+# Each caregiver gets at most one driver position per ride this often
+CAREGIVER_LOCATION_MIN_INTERVAL = float(os.getenv('CAREGIVER_LOCATION_MIN_INTERVAL', '2.0'))
+
+# Live driver positions for passengers
+# Each ride's position is forwarded at most every MIN_INTERVAL seconds, slower
+# by MIN_INTERVAL for every SUBSCRIBERS_PER_STEP sockets following it
+TRACKING_MIN_INTERVAL = float(os.getenv('TRACKING_MIN_INTERVAL', '1.0'))
+TRACKING_SUBSCRIBERS_PER_STEP = 5
+# Points recorded longer ago than this are not forwarded
+TRACKING_MAX_POINT_AGE = 10
+# Sockets receiving frames later than MAX_LAG seconds back off, up to MAX_INTERVAL
+TRACKING_MAX_LAG = 0.5
+TRACKING_MAX_INTERVAL = 8.0
+# Full position every KEYFRAME_INTERVAL frames, deltas in between
+TRACKING_KEYFRAME_INTERVAL = 20
+
+# Pricing
+# Fares are quoted from an in-memory snapshot of the pricing rules.  Saves in
+# this process invalidate it immediately; other processes reload it at the
+# latest this many seconds after a change.
+PRICING_RULES_TTL = int(os.getenv('PRICING_RULES_TTL', '60'))
+# Grid cell size of the surge zone index; zones spanning more cells than
+# MAX_CELLS_PER_ZONE are checked on every quote instead
+PRICING_SURGE_CELL_DEGREES = 0.05
+PRICING_SURGE_MAX_CELLS_PER_ZONE = 400
+# Largest number of trips accepted by the batch fare endpoint
+PRICING_BATCH_MAX_TRIPS = 500
+# Quotes are cached per pair of pickup/dropoff grid cells (0.0005 degrees ~ 55m)
+PRICING_QUOTE_CACHE_CELL_DEGREES = 0.0005
+PRICING_QUOTE_CACHE_TTL = int(os.getenv('PRICING_QUOTE_CACHE_TTL', '60'))
+PRICING_QUOTE_CACHE_MAX_ENTRIES = 10000
+# Promo codes are cached per code; unknown codes are remembered for
+# NEGATIVE_TTL so repeated guesses don't reach the database
+PROMO_CACHE_TTL = int(os.getenv('PROMO_CACHE_TTL', '60'))
+PROMO_CACHE_NEGATIVE_TTL = 300
+PROMO_CACHE_MAX_ENTRIES = 10000
+
+# Automatic surge
+# Ride requests and available drivers are counted per heatmap cell over the
+# last SLOTS x SLOT_SECONDS.  Every EVALUATE_INTERVAL seconds cells whose
+# requests per driver reach PRESSURE_ON surge, one STEP per PRESSURE_PER_STEP
+# above it up to MAX_MULTIPLIER, until pressure drops below PRESSURE_OFF.
+# Counts are per process, so this is on by default only with one worker.
+SURGE_AUTO_ENABLED = os.getenv('SURGE_AUTO_ENABLED', str(CHANNEL_LAYER_BACKEND == 'memory')) == 'True'
+SURGE_HEATMAP_CELL_DEGREES = 0.01
+SURGE_HEATMAP_SLOT_SECONDS = 30
+SURGE_HEATMAP_SLOTS = 10
+SURGE_EVALUATE_INTERVAL = 30
+SURGE_MIN_REQUESTS = 3
+SURGE_PRESSURE_ON = 2.0
+SURGE_PRESSURE_OFF = 1.2
+SURGE_PRESSURE_PER_STEP = 1.0
+SURGE_MULTIPLIER_STEP = 0.25
+SURGE_MAX_MULTIPLIER = 3.0
+# Automatic zones end this many seconds ahead and are extended while the surge lasts
+SURGE_ZONE_TTL = 300
+
+# Trip duration estimates
+# Minutes per km are learned from completed trips by hour of the week and
+# pickup cell (manage.py rebuild_eta_model).  Sparse buckets lean on their
+# hour, the hour on the city and the city on DEFAULT_SPEED_KMH, each with
+# PRIOR_KM km of pseudo-evidence.
+ETA_CELL_DEGREES = 0.05
+ETA_DEFAULT_SPEED_KMH = 30.0
+ETA_PRIOR_KM = 20.0
+ETA_MODEL_TTL = int(os.getenv('ETA_MODEL_TTL', '300'))
+# Full rebuilds learn from this many days of trips
+ETA_TRAINING_DAYS = 90
+# Trips shorter than MIN_TRIP_KM or outside these average speeds are ignored
+ETA_MIN_TRIP_KM = 0.2
+ETA_MIN_SPEED_KMH = 3.0
+ETA_MAX_SPEED_KMH = 120.0
+
+# Routing
+# 'haversine' measures trips as straight lines; 'graph' routes them over the
+# road graph at ROUTING_GRAPH_PATH (manage.py build_road_graph).  Pickups
+# and dropoffs further than MAX_SNAP_KM from the graph fall back to straight
+# lines.
+ROUTING_BACKEND = os.getenv('ROUTING_BACKEND', 'haversine')
+ROUTING_GRAPH_PATH = os.getenv('ROUTING_GRAPH_PATH', str(BASE_DIR / 'road_graph.npz'))
+ROUTING_MAX_SNAP_KM = 0.5
+ROUTING_SNAP_CELL_DEGREES = 0.005
+# Speed of the legs between the pickup or dropoff and the road graph
+ROUTING_ACCESS_SPEED_KMH = 15.0
+# Fastest paths memoised per pair of graph nodes
+ROUTING_CACHE_MAX_ENTRIES = 50000
 
 
 # Database
@@ -167,6 +337,10 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    'DEFAULT_THROTTLE_RATES': {
+        # Promo code checks per user, against guessing codes by brute force
+        'promo_codes': os.getenv('PROMO_CODE_THROTTLE_RATE', '20/min'),
+    },
 }
 
 # JWT Settings
@@ -183,7 +357,6 @@ CORS_ALLOWED_ORIGINS = [
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
 
 # Email Configuration
-import os
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
 EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
 EMAIL_PORT = int(os.getenv('EMAIL_PORT', '587'))
@@ -196,6 +369,30 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'noreply@careconnect.com')
 SMS_PORTAL_USERNAME = os.getenv('SMS_PORTAL_USERNAME', 'cb3fe3f5-99c9-4ca2-89de-4af71abdc41b')
 SMS_PORTAL_PASSWORD = os.getenv('SMS_PORTAL_PASSWORD', 'b5849253-76d8-4875-90de-c89cc9253b55')
 SMS_PORTAL_ENDPOINT = os.getenv('SMS_PORTAL_ENDPOINT', 'https://api.smsportal.com/api5/http5.aspx')
+SMS_CONNECT_TIMEOUT = 3.05
+SMS_READ_TIMEOUT = 10
+# Outbound SMS are sent by a pool of background workers; failed sends that
+# are worth retrying get SMS_MAX_ATTEMPTS tries with exponential backoff
+SMS_QUEUE_WORKERS = int(os.getenv('SMS_QUEUE_WORKERS', '4'))
+SMS_QUEUE_MAX_PENDING = 1000
+SMS_MAX_ATTEMPTS = 3
+SMS_RETRY_BACKOFF = 1.0
+
+# BulkSMS Configuration
+BULKSMS_API_URL = os.getenv('BULKSMS_API_URL', 'https://api.bulksms.com/v1/messages')
+BULKSMS_API_KEY = os.getenv('BULKSMS_API_KEY', '')
+BULKSMS_API_SECRET = os.getenv('BULKSMS_API_SECRET', '')
+BULKSMS_SENDER_ID = os.getenv('BULKSMS_SENDER_ID', 'CareConnect')
+# Messages submitted per BulkSMS API request
+BULKSMS_BATCH_SIZE = 500
+
+# Message outbox (see communications/outbox.py)
+COMMUNICATIONS_OUTBOX_BATCH_SIZE = 1000
+# Seconds before an unfinished claim expires and the message can be retried
+COMMUNICATIONS_OUTBOX_CLAIM_TIMEOUT = 300
+COMMUNICATIONS_OUTBOX_MAX_ATTEMPTS = 3
+# Seconds a failing provider is skipped while others of its type take its traffic
+COMMUNICATIONS_PROVIDER_COOLDOWN = 60
 
 # Paystack Configuration
 PAYSTACK_SECRET_KEY = os.getenv('PAYSTACK_SECRET_KEY', 'sk_test_xxxxx')
@@ -0,0 +1,85 @@
+"""
+JWT authentication for WebSockets.
+
+Clients send their simplejwt access token as ``?token=<access>``, since
+browsers cannot set headers on a WebSocket, or as an ``Authorization:
+Bearer`` header.  ``JWTAuthMiddleware`` validates the token once at connect;
+checking the signature and expiry needs no database.  It then loads the user
+together with their driver profile in one query and leaves both in the
+scope, so consumers find the caller in ``scope['user']`` and
+``scope['driver']`` and never look them up again.
+
+Connections without a valid token get an ``AnonymousUser``.  While
+``WEBSOCKET_AUTH_REQUIRED`` is on, consumers refuse them with close code
+``4401``, and refuse callers who are not allowed on the route with
+``4403``.
+"""
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+CLOSE_UNAUTHENTICATED = 4401
+CLOSE_FORBIDDEN = 4403
+
+
+def token_from_scope(scope):
+    """The access token from the query string or Authorization header, or None"""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][0]
+    for name, value in scope.get('headers', ()):
+        if name == b'authorization':
+            scheme, _, token = value.decode().partition(' ')
+            if scheme.lower() == 'bearer' and token.strip():
+                return token.strip()
+    return None
+
+
+@database_sync_to_async
+def get_token_user(user_id):
+    """Active user with their driver profile, in one query"""
+    return get_user_model().objects.select_related('driver_profile').filter(
+        **{api_settings.USER_ID_FIELD: user_id}, is_active=True
+    ).first()
+
+
+def is_authenticated(scope):
+    user = scope.get('user')
+    return user is not None and user.is_authenticated
+
+
+def auth_required():
+    return settings.WEBSOCKET_AUTH_REQUIRED
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Resolves the caller of a WebSocket from its JWT access token, once per connection"""
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope['user'] = AnonymousUser()
+        scope['driver'] = None
+
+        token = token_from_scope(scope)
+        if token:
+            try:
+                user_id = AccessToken(token)[api_settings.USER_ID_CLAIM]
+            except (TokenError, KeyError):
+                user_id = None
+            user = await get_token_user(user_id) if user_id is not None else None
+            if user is not None:
+                scope['user'] = user
+                scope['driver'] = getattr(user, 'driver_profile', None)
+
+        return await super().__call__(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return JWTAuthMiddleware(inner)
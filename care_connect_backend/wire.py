@@ -0,0 +1,123 @@
+"""
+Wire protocols for the ride and driver WebSockets.
+
+JSON text frames remain the default.  A client opts into the compact
+protocol by offering the ``care-connect.msgpack`` WebSocket subprotocol, or
+with ``?codec=msgpack`` where it cannot set subprotocols.  Messages then
+travel as MessagePack binary frames with the same fields as the JSON ones.
+
+Location updates, the bulk of driver traffic, also have a fixed 25-byte
+layout.  It can be sent as a binary frame under either protocol::
+
+    B  tag        0x01
+    i  latitude   degrees x 1e7
+    i  longitude  degrees x 1e7
+    f  heading    degrees, NaN when unknown
+    f  speed      m/s, NaN when unknown
+    q  timestamp  epoch milliseconds, 0 when unknown
+
+All fields are little-endian.  A MessagePack message is always a map, so it
+never starts with 0x01 and the two cannot be confused.  Text frames are
+read as JSON whatever was negotiated.
+"""
+import json
+import math
+import struct
+from urllib.parse import parse_qs
+
+import msgpack
+
+# Built once: json.dumps with non-default separators makes a new encoder per call
+_json_encoder = json.JSONEncoder(separators=(',', ':'))
+
+LOCATION_TAG = 0x01
+LOCATION_FRAME = struct.Struct('<BiiffQ')
+
+
+def encode_location(latitude, longitude, heading=None, speed=None, timestamp=None):
+    """Pack a location update into the fixed binary layout"""
+    return LOCATION_FRAME.pack(
+        LOCATION_TAG,
+        round(latitude * 1e7),
+        round(longitude * 1e7),
+        math.nan if heading is None else heading,
+        math.nan if speed is None else speed,
+        int(timestamp or 0),
+    )
+
+
+def decode_location(frame):
+    """(latitude, longitude, heading, speed, timestamp) from a packed location update"""
+    _, latitude, longitude, heading, speed, timestamp = LOCATION_FRAME.unpack(frame)
+    return (
+        latitude / 1e7,
+        longitude / 1e7,
+        None if math.isnan(heading) else heading,
+        None if math.isnan(speed) else speed,
+        timestamp or None,
+    )
+
+
+def is_location_frame(bytes_data):
+    return len(bytes_data) == LOCATION_FRAME.size and bytes_data[0] == LOCATION_TAG
+
+
+class JSONCodec:
+    name = 'json'
+    subprotocol = 'care-connect.json'
+
+    @staticmethod
+    def encode(message):
+        return {'text_data': _json_encoder.encode(message)}
+
+    @staticmethod
+    def decode(text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    subprotocol = 'care-connect.msgpack'
+
+    @staticmethod
+    def encode(message):
+        return {'bytes_data': msgpack.packb(message, use_bin_type=True)}
+
+    @staticmethod
+    def decode(text_data=None, bytes_data=None):
+        if text_data is not None:
+            return json.loads(text_data)
+        return msgpack.unpackb(bytes_data, raw=False)
+
+
+CODECS = {codec.name: codec for codec in (JSONCodec, MsgpackCodec)}
+SUBPROTOCOLS = {codec.subprotocol: codec for codec in (JSONCodec, MsgpackCodec)}
+
+
+def negotiate(scope):
+    """
+    The codec for a connection and the subprotocol to accept it with.
+    Offered subprotocols win over ``?codec=``; anything unknown falls back
+    to JSON.
+    """
+    for subprotocol in scope.get('subprotocols') or ():
+        if subprotocol in SUBPROTOCOLS:
+            return SUBPROTOCOLS[subprotocol], subprotocol
+    query = parse_qs(scope.get('query_string', b'').decode())
+    return CODECS.get((query.get('codec') or ['json'])[0], JSONCodec), None
+
+
+class WireProtocolMixin:
+    """Codec negotiation and encoding for AsyncWebsocketConsumer subclasses"""
+
+    codec = JSONCodec
+
+    async def accept_with_codec(self):
+        self.codec, subprotocol = negotiate(self.scope)
+        await self.accept(subprotocol=subprotocol)
+
+    async def send_message(self, message):
+        await self.send(**self.codec.encode(message))
+
+    def decode_message(self, text_data=None, bytes_data=None):
+        return self.codec.decode(text_data, bytes_data)
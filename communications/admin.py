@@ -27,17 +27,17 @@ class CommunicationMessageAdmin(admin.ModelAdmin):
     list_display = ['recipient', 'message_type', 'status', 'user', 'sent_at', 'created_at']
     list_filter = ['message_type', 'status', 'created_at']
     search_fields = ['recipient', 'subject', 'content', 'user__username', 'user__email']
-    readonly_fields = ['created_at', 'updated_at', 'sent_at', 'delivered_at']
+    readonly_fields = ['created_at', 'updated_at', 'sent_at', 'delivered_at', 'attempts', 'claim_token', 'claimed_at']
     date_hierarchy = 'created_at'
     fieldsets = (
         ('Message Information', {
             'fields': ('user', 'provider', 'message_type', 'recipient')
         }),
         ('Content', {
-            'fields': ('subject', 'content')
+            'fields': ('subject', 'content', 'html_content')
         }),
         ('Status', {
-            'fields': ('status', 'error_message', 'metadata')
+            'fields': ('status', 'error_message', 'metadata', 'attempts', 'claim_token', 'claimed_at')
         }),
         ('Timestamps', {
             'fields': ('sent_at', 'delivered_at', 'created_at', 'updated_at'),
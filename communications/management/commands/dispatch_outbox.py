@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from communications.outbox import OutboxDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Send pending outbox messages in batches, grouped per provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Messages claimed per batch')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new messages')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        dispatcher = OutboxDispatcher(batch_size=options['batch_size'])
+        self.stdout.write(f'📤 Dispatching outbox (batches of {dispatcher.batch_size})')
+
+        start = time.perf_counter()
+        try:
+            while True:
+                batches = dispatcher.stats['batches']
+                dispatcher.run(max_batches=options['max_batches'])
+                if dispatcher.stats['batches'] != batches:
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(
+                        f"  {dispatcher.stats['claimed']} claimed, {dispatcher.stats['sent']} sent, "
+                        f"{dispatcher.stats['failed']} failed, {dispatcher.stats['retrying']} to retry "
+                        f"({dispatcher.stats['claimed'] / elapsed:.0f} msg/s)"
+                    )
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Outbox dispatch complete: {dispatcher.stats}"))
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communications', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='communicationmessage',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='communicationmessage',
+            name='claim_token',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='communicationmessage',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='communicationmessage',
+            name='html_content',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='communicationmessage',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed'), ('delivered', 'Delivered')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='communicationmessage',
+            index=models.Index(fields=['status', 'created_at'], name='communicati_status_f4df57_idx'),
+        ),
+    ]
@@ -48,6 +48,7 @@ class CommunicationMessage(models.Model):
 
     STATUS_CHOICES = [
         ('pending', 'Pending'),
+        ('sending', 'Sending'),
         ('sent', 'Sent'),
         ('failed', 'Failed'),
         ('delivered', 'Delivered'),
@@ -59,8 +60,13 @@ class CommunicationMessage(models.Model):
     recipient = models.CharField(max_length=255)  # Email or phone number
     subject = models.CharField(max_length=255, blank=True)
     content = models.TextField()
+    html_content = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     error_message = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Set by the outbox dispatcher while a batch holding this message is in flight
+    claim_token = models.CharField(max_length=32, blank=True, db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
     metadata = models.JSONField(default=dict, blank=True)
     sent_at = models.DateTimeField(null=True, blank=True)
     delivered_at = models.DateTimeField(null=True, blank=True)
@@ -74,6 +80,7 @@ class CommunicationMessage(models.Model):
             models.Index(fields=['user', 'message_type']),
             models.Index(fields=['status']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['status', 'created_at']),
         ]
 
     def __str__(self):
@@ -0,0 +1,226 @@
+"""
+Transactional outbox for outgoing messages.
+
+Messages are written as ``pending`` ``CommunicationMessage`` rows, ideally
+in the same transaction as whatever caused them, and sent later by an
+``OutboxDispatcher``.  The dispatcher claims a batch of pending rows with a
+conditional UPDATE, so several dispatchers can run side by side without
+sending a message twice.  Each batch is grouped by provider and handed to
+that provider's bulk send - one multi-recipient request per chunk of SMS,
+one SMTP connection for all emails - and the results are written back in
+bulk, one UPDATE per outcome plus a ``bulk_update`` of provider responses.
+
+A claim that is never completed (the dispatcher died, or the provider asked
+us to try again) expires after ``COMMUNICATIONS_OUTBOX_CLAIM_TIMEOUT``
+seconds, when the message can be claimed again.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import CommunicationMessage
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_messages(messages):
+    """Add unsaved CommunicationMessage instances to the outbox with one INSERT per 1000"""
+    for message in messages:
+        message.status = 'pending'
+    return CommunicationMessage.objects.bulk_create(messages, batch_size=1000)
+
+
+def mark_sent(message, metadata=None):
+    message.status = 'sent'
+    message.error_message = ''
+    if metadata is not None:
+        message.metadata = metadata
+    message.claim_token = ''
+
+
+def mark_failed(message, error, retryable=False):
+    """
+    Record a failed send.  Retryable failures stay ``sending``; the
+    dispatcher fails them over to another provider or, failing that, leaves
+    them claimed so they are retried once the claim expires, until they have
+    used up ``COMMUNICATIONS_OUTBOX_MAX_ATTEMPTS`` (or at once for direct
+    sends, see ``OutboxDispatcher.dispatch_batch``).
+    """
+    message.error_message = error
+    if retryable:
+        return
+    message.status = 'failed'
+    message.claim_token = ''
+
+
+class OutboxDispatcher:
+    """Claims pending outbox messages in batches and sends them per provider"""
+
+    def __init__(self, batch_size=None, claim_timeout=None):
+        self.batch_size = batch_size or settings.COMMUNICATIONS_OUTBOX_BATCH_SIZE
+        self.claim_timeout = claim_timeout or settings.COMMUNICATIONS_OUTBOX_CLAIM_TIMEOUT
+        self.stats = {'claimed': 0, 'sent': 0, 'failed': 0, 'retrying': 0, 'batches': 0}
+
+    def claim(self, queryset=None):
+        """Claim up to ``batch_size`` sendable messages; returns them with their providers"""
+        now = timezone.now()
+        claimable = Q(status='pending') | Q(status='sending', claimed_at__lt=now - timedelta(seconds=self.claim_timeout))
+        queryset = CommunicationMessage.objects.all() if queryset is None else queryset
+
+        ids = list(
+            queryset.filter(claimable).order_by('created_at').values_list('id', flat=True)[:self.batch_size]
+        )
+        if not ids:
+            return []
+
+        # Re-checking the claim condition in the UPDATE makes concurrent claims safe:
+        # a row another dispatcher took in the meantime no longer matches
+        token = uuid.uuid4().hex
+        CommunicationMessage.objects.filter(claimable, id__in=ids).update(
+            status='sending',
+            claim_token=token,
+            claimed_at=now,
+            attempts=F('attempts') + 1,
+            updated_at=now
+        )
+        return list(CommunicationMessage.objects.select_related('provider').filter(claim_token=token))
+
+    def dispatch_batch(self, queryset=None, retry=True):
+        """
+        Claim and send one batch; returns the messages it handled.
+
+        With ``retry=False`` retryable failures are failed too, for callers
+        who send directly and tell the user the outcome: a message they
+        were told failed must not turn up minutes later.
+        """
+        messages = self.claim(queryset)
+        if not messages:
+            return []
+
+        # Every message in the batch was claimed under the same token
+        claim_token = messages[0].claim_token
+        by_provider = {}
+        for message in messages:
+            by_provider.setdefault(message.provider, []).append(message)
+
+        for provider, provider_messages in by_provider.items():
+            if provider is None:
+                for message in provider_messages:
+                    mark_failed(message, 'No provider')
+                continue
+            self.send_with_failover(provider, provider_messages)
+
+        for message in messages:
+            if message.status == 'sending' and (
+                not retry or message.attempts >= settings.COMMUNICATIONS_OUTBOX_MAX_ATTEMPTS
+            ):
+                message.status = 'failed'
+                message.claim_token = ''
+
+        self.save_results(messages, claim_token)
+
+        self.stats['batches'] += 1
+        self.stats['claimed'] += len(messages)
+        for message in messages:
+            if message.status == 'sent':
+                self.stats['sent'] += 1
+            elif message.status == 'failed':
+                self.stats['failed'] += 1
+            else:
+                self.stats['retrying'] += 1
+        return messages
+
+    @staticmethod
+    def send_with_failover(provider, messages):
+        """
+        Send ``messages`` through ``provider``.  Whatever it fails to take
+        with a retryable error moves on to the next active provider of the
+        same type until every provider has been tried.
+        """
+        from .providers import provider_registry
+        from .services import sender_for
+
+        tried = []
+        while provider is not None and messages:
+            tried.append(provider)
+            sender = sender_for(provider)
+            if sender is None:
+                for message in messages:
+                    mark_failed(message, f'No sender for provider {provider}')
+                return
+
+            for message in messages:
+                message.provider = provider
+            try:
+                sender.send_batch(provider, messages)
+            except Exception as e:
+                logger.exception(f"Batch send through {provider} failed")
+                for message in messages:
+                    if message.status == 'sending':
+                        mark_failed(message, str(e), retryable=True)
+
+            remaining = [message for message in messages if message.status == 'sending']
+            if not remaining:
+                provider_registry.report_success(provider)
+                return
+            provider_registry.report_failure(provider)
+            messages = remaining
+            provider = provider_registry.pick(provider.provider_type, exclude=tried)
+
+    @staticmethod
+    def save_results(messages, claim_token):
+        """
+        Write back a batch claimed under ``claim_token``.  Messages with the
+        same outcome share one UPDATE; only the per-message provider
+        responses need ``bulk_update``, whose CASE expressions get expensive
+        on large batches.  Every write is conditional on the claim, so a
+        dispatcher whose claim expired and was taken over cannot overwrite
+        what the new claimant recorded.
+        """
+        now = timezone.now()
+        claimed = CommunicationMessage.objects.filter(claim_token=claim_token)
+
+        # Before the outcome updates below release the claim
+        with_metadata = [message for message in messages if message.status == 'sent' and message.metadata]
+        if with_metadata:
+            claimed.bulk_update(with_metadata, ['metadata'], batch_size=500)
+
+        outcomes = {}
+        for message in messages:
+            message.updated_at = now
+            if message.status == 'sent':
+                message.sent_at = now
+            key = (message.status, message.error_message, message.claim_token, message.provider_id)
+            outcomes.setdefault(key, []).append(message.id)
+
+        written = 0
+        for (status, error_message, new_token, provider_id), ids in outcomes.items():
+            fields = {
+                'status': status,
+                'error_message': error_message,
+                'claim_token': new_token,
+                'provider_id': provider_id,
+                'updated_at': now,
+            }
+            if status == 'sent':
+                fields['sent_at'] = now
+            for start in range(0, len(ids), 500):
+                written += claimed.filter(id__in=ids[start:start + 500]).update(**fields)
+
+        if written < len(messages):
+            logger.warning(
+                f"{len(messages) - written} outbox results discarded: their claim expired and was taken over"
+            )
+
+    def run(self, max_batches=None):
+        """Send batches until nothing is claimable (or ``max_batches`` were sent)"""
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            if not self.dispatch_batch():
+                break
+            batches += 1
+        return self.stats
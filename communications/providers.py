@@ -0,0 +1,127 @@
+"""
+Process-local registry of communication providers.
+
+Every send used to look its provider up with ``get_or_create``.  The
+registry loads all providers once, keeps the active ones per type with
+their ``config`` parsed, and is invalidated by the provider signals when a
+provider is saved or deleted.
+
+Several active providers of one type share traffic in proportion to
+``config['weight']`` (default 1).  A provider that fails is taken out of
+rotation for ``COMMUNICATIONS_PROVIDER_COOLDOWN`` seconds so its traffic
+fails over to the others.
+"""
+import json
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .models import CommunicationProvider
+
+logger = logging.getLogger(__name__)
+
+
+def provider_config(provider):
+    """A provider's ``config`` as a dict, also when it was saved as a JSON string"""
+    config = provider.config or {}
+    if isinstance(config, str):
+        try:
+            config = json.loads(config)
+        except ValueError:
+            logger.error(f"Ignoring invalid config JSON on provider {provider}")
+            config = {}
+    return config if isinstance(config, dict) else {}
+
+
+def provider_weight(provider):
+    try:
+        return max(float(provider.parsed_config.get('weight', 1)), 0)
+    except (TypeError, ValueError):
+        return 1
+
+
+class ProviderRegistry:
+    """Cached active providers per type with weighted selection and failover"""
+
+    def __init__(self, cooldown=60):
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._by_type = None    # provider type -> [active provider, ...]
+        self._by_key = None     # (name, provider type) -> provider, active or not
+        self._down_until = {}   # provider id -> monotonic time it comes back
+        self._random = random.Random()
+
+    def _loaded(self):
+        with self._lock:
+            if self._by_type is None:
+                by_type, by_key = {}, {}
+                for provider in CommunicationProvider.objects.order_by('created_at', 'id'):
+                    provider.parsed_config = provider_config(provider)
+                    by_key[(provider.name, provider.provider_type)] = provider
+                    if provider.is_active:
+                        by_type.setdefault(provider.provider_type, []).append(provider)
+                self._by_type, self._by_key = by_type, by_key
+            return self._by_type, self._by_key
+
+    def invalidate(self):
+        with self._lock:
+            self._by_type = None
+            self._by_key = None
+
+    def providers(self, provider_type):
+        """Active providers of ``provider_type``, oldest first"""
+        by_type, _ = self._loaded()
+        return list(by_type.get(provider_type, ()))
+
+    def get(self, name, provider_type, defaults=None):
+        """
+        Provider by name, created with ``defaults`` if it does not exist yet -
+        the registry's equivalent of ``get_or_create``.
+        """
+        _, by_key = self._loaded()
+        provider = by_key.get((name, provider_type))
+        if provider is None:
+            provider, _ = CommunicationProvider.objects.get_or_create(
+                name=name,
+                provider_type=provider_type,
+                defaults=defaults or {}
+            )
+            provider.parsed_config = provider_config(provider)
+            # The post_save signal has invalidated the cache; it reloads on next use
+        return provider
+
+    def pick(self, provider_type, exclude=()):
+        """
+        An active provider of ``provider_type`` chosen by weight, skipping
+        ``exclude`` and preferring providers that have not failed recently.
+        Returns None when there is none left.
+        """
+        excluded = {provider.id for provider in exclude}
+        candidates = [p for p in self.providers(provider_type) if p.id not in excluded]
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        healthy = [p for p in candidates if self._down_until.get(p.id, 0) <= now]
+        # With everything down, still try the one that comes back first
+        if not healthy:
+            return min(candidates, key=lambda p: self._down_until[p.id])
+
+        weights = [provider_weight(p) for p in healthy]
+        if not any(weights):
+            return healthy[0]
+        return self._random.choices(healthy, weights=weights)[0]
+
+    def report_failure(self, provider):
+        """Take ``provider`` out of rotation for the cooldown period"""
+        self._down_until[provider.id] = time.monotonic() + self.cooldown
+        logger.warning(f"Provider {provider} failed; cooling down for {self.cooldown}s")
+
+    def report_success(self, provider):
+        self._down_until.pop(provider.id, None)
+
+
+provider_registry = ProviderRegistry(cooldown=settings.COMMUNICATIONS_PROVIDER_COOLDOWN)
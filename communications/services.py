@@ -1,147 +1,241 @@
 import requests
 import logging
+import smtplib
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.utils import timezone
-from .models import CommunicationProvider, CommunicationMessage
+from .models import CommunicationMessage
+from .outbox import OutboxDispatcher, enqueue_messages, mark_failed, mark_sent
+from .providers import provider_config, provider_registry
 
 logger = logging.getLogger(__name__)
 
 
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
 class BulkSMSService:
     """Service for sending SMS via BulkSMS"""
 
-    def __init__(self):
-        self.api_url = settings.BULKSMS_API_URL
-        self.api_key = settings.BULKSMS_API_KEY
-        self.api_secret = settings.BULKSMS_API_SECRET
-        self.sender_id = settings.BULKSMS_SENDER_ID
+    provider_name = 'BulkSMS'
+
+    def __init__(self, provider=None):
+        # Credentials come from the provider when sending on its behalf
+        self.api_url = (provider and provider.api_url) or settings.BULKSMS_API_URL
+        self.api_key = (provider and provider.api_key) or settings.BULKSMS_API_KEY
+        self.api_secret = (provider and provider.api_secret) or settings.BULKSMS_API_SECRET
+        self.sender_id = (provider and provider.sender_id) or settings.BULKSMS_SENDER_ID
+        self.session = requests.Session()
+
+    def get_provider(self):
+        """Active SMS provider chosen by weight, creating the default one if there is none"""
+        return provider_registry.pick('sms') or provider_registry.get(
+            self.provider_name,
+            'sms',
+            defaults={
+                'api_key': self.api_key,
+                'api_secret': self.api_secret,
+                'api_url': self.api_url,
+                'sender_id': self.sender_id,
+            }
+        )
+
+    def build_message(self, phone_number, message, user=None, message_type='notification', provider=None):
+        """Unsaved outbox message for one SMS"""
+        return CommunicationMessage(
+            user=user,
+            provider=provider or self.get_provider(),
+            message_type=message_type,
+            recipient=phone_number,
+            content=message,
+            status='pending'
+        )
 
     def send_sms(self, phone_number, message, user=None, message_type='notification'):
         """Send SMS via BulkSMS API"""
         try:
-            # Get or create SMS provider
-            provider, _ = CommunicationProvider.objects.get_or_create(
-                name='BulkSMS',
-                provider_type='sms',
-                defaults={
-                    'api_key': self.api_key,
-                    'api_secret': self.api_secret,
-                    'api_url': self.api_url,
-                    'sender_id': self.sender_id,
-                }
+            # Create communication record and send it straight away
+            comm_message, = enqueue_messages([self.build_message(phone_number, message, user, message_type)])
+            # Not retried later: the caller reports the outcome now, and an OTP must not arrive late
+            sent = OutboxDispatcher().dispatch_batch(
+                CommunicationMessage.objects.filter(id=comm_message.id), retry=False
             )
+            return bool(sent) and sent[0].status == 'sent'
 
-            # Create communication record
-            comm_message = CommunicationMessage.objects.create(
-                user=user,
-                provider=provider,
-                message_type=message_type,
-                recipient=phone_number,
-                content=message,
-                status='pending'
-            )
+        except Exception as e:
+            logger.exception(f"Error sending SMS to {phone_number}: {str(e)}")
+            return False
 
-            # Prepare API request
-            headers = {
-                'Content-Type': 'application/json',
-            }
+    def queue_sms(self, recipients, message, message_type='notification'):
+        """
+        Queue one SMS per ``(user, phone_number)`` in ``recipients`` for the
+        outbox dispatcher; use for fan-outs instead of calling send_sms in a loop.
+        """
+        provider = self.get_provider()
+        return enqueue_messages([
+            self.build_message(phone_number, message, user, message_type, provider=provider)
+            for user, phone_number in recipients
+        ])
 
-            payload = {
-                'to': phone_number,
-                'body': message,
-            }
+    def send_batch(self, provider, messages):
+        """Send outbox messages through the multi-recipient messages API"""
+        for chunk in chunked(messages, settings.BULKSMS_BATCH_SIZE):
+            self._post_batch(chunk)
+
+    def _post_batch(self, messages):
+        # Prepare API request
+        headers = {
+            'Content-Type': 'application/json',
+        }
+
+        payload = [{'to': message.recipient, 'body': message.content} for message in messages]
 
+        try:
             # Make API call
-            response = requests.post(
+            response = self.session.post(
                 self.api_url,
                 json=payload,
                 auth=(self.api_key, self.api_secret),
                 headers=headers,
                 timeout=30
             )
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Failed to send {len(messages)} SMS: {str(e)}")
+            for message in messages:
+                mark_failed(message, str(e), retryable=True)
+            return
+
+        # Update communication records
+        if response.status_code == 201:
+            # One result per message, in the order they were submitted
+            try:
+                results = response.json()
+            except ValueError:
+                results = None
+            if not isinstance(results, list):
+                results = []
+            for message, result in zip(messages, results):
+                mark_sent(message, result)
+            # The request was accepted, so a message without a result may
+            # still have gone out; failing it rules out sending it twice
+            unmatched = messages[len(results):]
+            for message in unmatched:
+                mark_failed(message, "No result for this message in the gateway response")
+            if unmatched:
+                logger.error(f"Gateway returned {len(results)} results for {len(messages)} SMS")
+            logger.info(f"{len(messages) - len(unmatched)} SMS sent successfully")
+        elif 400 <= response.status_code < 500 and response.status_code != 429 and len(messages) > 1:
+            # A single bad recipient rejects the whole request; split it to isolate the culprit
+            middle = len(messages) // 2
+            self._post_batch(messages[:middle])
+            self._post_batch(messages[middle:])
+        else:
+            error = f"Status: {response.status_code}, Response: {response.text}"
+            retryable = response.status_code >= 500 or response.status_code == 429
+            for message in messages:
+                mark_failed(message, error, retryable=retryable)
+            logger.error(f"Failed to send SMS to {', '.join(m.recipient for m in messages)}: {response.text}")
 
-            # Update communication record
-            if response.status_code == 201:
-                comm_message.status = 'sent'
-                comm_message.sent_at = timezone.now()
-                comm_message.metadata = response.json()
-                logger.info(f"SMS sent successfully to {phone_number}")
-            else:
-                comm_message.status = 'failed'
-                comm_message.error_message = f"Status: {response.status_code}, Response: {response.text}"
-                logger.error(f"Failed to send SMS to {phone_number}: {response.text}")
 
-            comm_message.save()
-            return comm_message.status == 'sent'
+class EmailService:
+    """Service for sending emails"""
 
-        except Exception as e:
-            logger.exception(f"Error sending SMS to {phone_number}: {str(e)}")
-            if 'comm_message' in locals():
-                comm_message.status = 'failed'
-                comm_message.error_message = str(e)
-                comm_message.save()
-            return False
+    provider_name = 'Django Email'
 
+    def __init__(self, provider=None):
+        self.from_email = (provider and provider.sender_id) or settings.DEFAULT_FROM_EMAIL
+        # Optional get_connection() arguments (backend, host, port, ...) from config['connection']
+        self.connection_options = provider_config(provider).get('connection', {}) if provider else {}
 
-class EmailService:
-    """Service for sending emails"""
+    def get_provider(self):
+        """Active Email provider chosen by weight, creating the default one if there is none"""
+        return provider_registry.pick('email') or provider_registry.get(
+            self.provider_name,
+            'email',
+            defaults={
+                'sender_id': self.from_email,
+            }
+        )
 
-    def __init__(self):
-        self.from_email = settings.DEFAULT_FROM_EMAIL
+    def build_message(self, recipient_email, subject, message, user=None, message_type='notification',
+                      html_message=None, provider=None):
+        """Unsaved outbox message for one email"""
+        return CommunicationMessage(
+            user=user,
+            provider=provider or self.get_provider(),
+            message_type=message_type,
+            recipient=recipient_email,
+            subject=subject,
+            content=message,
+            html_content=html_message or '',
+            status='pending'
+        )
 
     def send_email(self, recipient_email, subject, message, user=None, message_type='notification', html_message=None):
         """Send email"""
         try:
-            # Get or create Email provider
-            provider, _ = CommunicationProvider.objects.get_or_create(
-                name='Django Email',
-                provider_type='email',
-                defaults={
-                    'sender_id': self.from_email,
-                }
+            # Create communication record and send it straight away
+            comm_message, = enqueue_messages([
+                self.build_message(recipient_email, subject, message, user, message_type, html_message)
+            ])
+            # Not retried later: the caller reports the outcome now, and an OTP must not arrive late
+            sent = OutboxDispatcher().dispatch_batch(
+                CommunicationMessage.objects.filter(id=comm_message.id), retry=False
             )
-
-            # Create communication record
-            comm_message = CommunicationMessage.objects.create(
-                user=user,
-                provider=provider,
-                message_type=message_type,
-                recipient=recipient_email,
-                subject=subject,
-                content=message,
-                status='pending'
-            )
-
-            try:
-                # Send email
-                send_mail(
-                    subject=subject,
-                    message=message,
-                    from_email=self.from_email,
-                    recipient_list=[recipient_email],
-                    html_message=html_message,
-                    fail_silently=False,
-                )
-
-                comm_message.status = 'sent'
-                comm_message.sent_at = timezone.now()
-                logger.info(f"Email sent successfully to {recipient_email}")
-
-            except Exception as e:
-                comm_message.status = 'failed'
-                comm_message.error_message = str(e)
-                logger.error(f"Failed to send email to {recipient_email}: {str(e)}")
-
-            comm_message.save()
-            return comm_message.status == 'sent'
+            return bool(sent) and sent[0].status == 'sent'
 
         except Exception as e:
             logger.exception(f"Error sending email to {recipient_email}: {str(e)}")
             return False
 
+    def queue_email(self, recipients, subject, message, message_type='notification', html_message=None):
+        """Queue one email per ``(user, email)`` in ``recipients`` for the outbox dispatcher"""
+        provider = self.get_provider()
+        return enqueue_messages([
+            self.build_message(email, subject, message, user, message_type, html_message, provider=provider)
+            for user, email in recipients
+        ])
+
+    def send_batch(self, provider, messages):
+        """Send outbox messages over a single SMTP connection"""
+        connection = get_connection(fail_silently=False, **self.connection_options)
+        try:
+            connection.open()
+        except Exception as e:
+            logger.error(f"Failed to open email connection: {str(e)}")
+            for message in messages:
+                mark_failed(message, str(e), retryable=True)
+            return
+
+        try:
+            for message in messages:
+                email = EmailMultiAlternatives(
+                    subject=message.subject,
+                    body=message.content,
+                    from_email=self.from_email,
+                    to=[message.recipient],
+                    connection=connection
+                )
+                if message.html_content:
+                    email.attach_alternative(message.html_content, 'text/html')
+
+                try:
+                    email.send()
+                    mark_sent(message)
+                    logger.info(f"Email sent successfully to {message.recipient}")
+                except smtplib.SMTPRecipientsRefused as e:
+                    mark_failed(message, str(e))
+                    logger.error(f"Failed to send email to {message.recipient}: {str(e)}")
+                except Exception as e:
+                    mark_failed(message, str(e), retryable=True)
+                    logger.error(f"Failed to send email to {message.recipient}: {str(e)}")
+        finally:
+            connection.close()
+
     def send_welcome_email(self, user):
         """Send welcome email to new user"""
         subject = 'Welcome to Care Connect Mobility'
@@ -225,3 +319,16 @@ class OTPService:
         )
 
         return success
+
+
+SENDERS = {
+    'sms': BulkSMSService,
+    'email': EmailService,
+}
+
+
+def sender_for(provider):
+    """Service instance sending on behalf of ``provider``, or None for unsupported types"""
+    if provider is None or provider.provider_type not in SENDERS:
+        return None
+    return SENDERS[provider.provider_type](provider)
@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import CommunicationProvider
+from .providers import provider_registry
+
+
+@receiver(post_save, sender=CommunicationProvider)
+@receiver(post_delete, sender=CommunicationProvider)
+def provider_changed(sender, **kwargs):
+    """Reload the provider registry once the change is committed"""
+    transaction.on_commit(provider_registry.invalidate)
@@ -1,3 +1,105 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
+
+from .models import CommunicationMessage, CommunicationProvider
+from .outbox import OutboxDispatcher, mark_failed, mark_sent
+from .providers import provider_registry
+from .services import BulkSMSService
+
+User = get_user_model()
+
+
+def gateway_response(status_code, results=None):
+    response = mock.Mock(status_code=status_code, text='')
+    response.json.return_value = results
+    return response
+
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='passenger', phone_number='+27820000001')
+        self.provider = CommunicationProvider.objects.create(name='BulkSMS', provider_type='sms')
+        self.addCleanup(provider_registry.invalidate)
+        self.addCleanup(provider_registry.report_success, self.provider)
+        self.sms = BulkSMSService(self.provider)
+
+    def queue(self, count):
+        return self.sms.queue_sms([(self.user, f'+2782000{i:04d}') for i in range(count)], 'Your driver is here')
+
+    def expire_claims(self, dispatcher):
+        CommunicationMessage.objects.filter(status='sending').update(
+            claimed_at=timezone.now() - timedelta(seconds=dispatcher.claim_timeout + 1)
+        )
+
+    def statuses(self):
+        return sorted(CommunicationMessage.objects.values_list('status', flat=True))
+
+    def test_two_dispatchers_never_claim_the_same_message(self):
+        self.queue(5)
+        first, second = OutboxDispatcher(batch_size=3), OutboxDispatcher(batch_size=10)
+
+        first_claim = {message.id for message in first.claim()}
+        second_claim = {message.id for message in second.claim()}
+
+        self.assertEqual(len(first_claim), 3)
+        self.assertEqual(len(second_claim), 2)
+        self.assertFalse(first_claim & second_claim)
+        self.assertEqual(second.claim(), [])
+
+    def test_expired_claim_is_claimed_again(self):
+        self.queue(2)
+        first, second = OutboxDispatcher(), OutboxDispatcher()
+        first.claim()
+        self.assertEqual(second.claim(), [])
+
+        self.expire_claims(first)
+        reclaimed = second.claim()
+
+        self.assertEqual(len(reclaimed), 2)
+        self.assertEqual({message.attempts for message in reclaimed}, {2})
+
+    def test_results_are_written_back_only_under_the_batchs_own_claim(self):
+        self.queue(1)
+        first, second = OutboxDispatcher(), OutboxDispatcher()
+        stale = first.claim()
+        stale_token = stale[0].claim_token
+        self.expire_claims(first)
+        current = second.claim()
+        current_token = current[0].claim_token
+
+        # The first dispatcher finishes after its claim was taken over
+        mark_sent(stale[0])
+        OutboxDispatcher.save_results(stale, stale_token)
+        message = CommunicationMessage.objects.get()
+        self.assertEqual(message.status, 'sending')
+        self.assertEqual(message.claim_token, current_token)
+
+        mark_failed(current[0], 'Rejected')
+        OutboxDispatcher.save_results(current, current_token)
+        self.assertEqual(self.statuses(), ['failed'])
+
+    def test_queued_messages_are_retried_after_a_gateway_error(self):
+        self.queue(2)
+        dispatcher = OutboxDispatcher()
+
+        with mock.patch('communications.services.requests.Session.post', return_value=gateway_response(503)):
+            dispatcher.run()
+        self.assertEqual(self.statuses(), ['sending', 'sending'])
+
+        self.expire_claims(dispatcher)
+        with mock.patch('communications.services.requests.Session.post', return_value=gateway_response(201, [{}, {}])):
+            dispatcher.run()
+        self.assertEqual(self.statuses(), ['sent', 'sent'])
+
+    def test_direct_send_is_not_retried_later(self):
+        with mock.patch('communications.services.requests.Session.post', return_value=gateway_response(503)):
+            self.assertFalse(self.sms.send_sms('+27820000001', 'Your code is 123456', self.user, 'otp'))
 
-# Create your tests here.
+        self.assertEqual(self.statuses(), ['failed'])
+        self.expire_claims(OutboxDispatcher())
+        self.assertEqual(OutboxDispatcher().claim(), [])
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DriversConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "drivers"
+
+    def ready(self):
+        from . import signals  # noqa: F401
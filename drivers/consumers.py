@@ -1,15 +1,43 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.utils import timezone
 
+from care_connect_backend.websocket_auth import (
+    CLOSE_FORBIDDEN, CLOSE_UNAUTHENTICATED, auth_required, is_authenticated
+)
+from care_connect_backend.wire import WireProtocolMixin, decode_location, is_location_frame
+from bookings.events import ride_events
+from bookings.scheduler import booking_scheduler
+from bookings.tracking import ride_tracker
+from pricing.heatmap import heatmap
+from .location_buffer import location_buffer
+from .presence import presence
+from .spatial_index import driver_index
 
-class DriverConsumer(AsyncWebsocketConsumer):
+
+class DriverConsumer(WireProtocolMixin, AsyncWebsocketConsumer):
     """WebSocket consumer for drivers to receive ride requests"""
 
     async def connect(self):
         self.driver_id = self.scope['url_route']['kwargs']['driver_id']
         self.driver_group_name = f'driver_{self.driver_id}'
+        self.driver_pk = None
+
+        # The caller was resolved from their token by the auth middleware;
+        # nothing after connect needs to look the driver up
+        if is_authenticated(self.scope):
+            driver = self.scope['driver']
+            if driver is None or self.scope['user'].phone_number != self.driver_id:
+                print(f'❌ Driver WebSocket refused: {self.driver_id} is not the caller')
+                await self.close(code=CLOSE_FORBIDDEN)
+                return
+            self.driver_pk = driver.id
+        elif auth_required():
+            await self.close(code=CLOSE_UNAUTHENTICATED)
+            return
+        else:
+            self.driver_pk = await self.get_driver_pk()
 
         # Join driver group
         await self.channel_layer.group_add(
@@ -17,17 +45,30 @@ class DriverConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        location_buffer.ensure_started()
+        presence.ensure_started()
+        if settings.BOOKING_SCHEDULER_IN_PROCESS:
+            booking_scheduler.ensure_started()
+        if settings.SURGE_AUTO_ENABLED:
+            heatmap.ensure_started()
+        if self.driver_pk is not None:
+            presence.connect(self.driver_pk)
+
+        await self.accept_with_codec()
         print(f'✅ Driver WebSocket connected: {self.driver_id}')
 
         # Send initial connection message
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'connection_established',
             'message': f'Connected to driver service',
             'driver_id': self.driver_id
-        }))
+        })
 
     async def disconnect(self, close_code):
+        if self.driver_pk is not None:
+            ride_tracker.forget_driver(self.driver_pk)
+            presence.disconnect(self.driver_pk)
+
         # Leave driver group
         await self.channel_layer.group_discard(
             self.driver_group_name,
@@ -35,17 +76,25 @@ class DriverConsumer(AsyncWebsocketConsumer):
         )
         print(f'❌ Driver WebSocket disconnected: {self.driver_id}')
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming WebSocket messages from driver"""
-        data = json.loads(text_data)
+        if bytes_data is not None and is_location_frame(bytes_data):
+            # Packed location updates skip message decoding altogether
+            latitude, longitude, heading, speed, timestamp = decode_location(bytes_data)
+            await self.update_driver_location(latitude, longitude, heading=heading, speed=speed, timestamp=timestamp)
+            return
+
+        data = self.decode_message(text_data, bytes_data)
         message_type = data.get('type')
 
         if message_type == 'ping':
             # Respond to ping
-            await self.send(text_data=json.dumps({
+            if self.driver_pk is not None:
+                presence.heartbeat(self.driver_pk)
+            await self.send_message({
                 'type': 'pong',
                 'timestamp': timezone.now().isoformat()
-            }))
+            })
 
         elif message_type == 'accept_ride':
             # Driver accepted the ride
@@ -61,90 +110,78 @@ class DriverConsumer(AsyncWebsocketConsumer):
 
         elif message_type == 'location_update':
             # Driver location update
-            latitude = data.get('latitude')
-            longitude = data.get('longitude')
-            await self.update_driver_location(latitude, longitude)
+            await self.update_driver_location(
+                data.get('latitude'),
+                data.get('longitude'),
+                heading=data.get('heading'),
+                speed=data.get('speed'),
+                timestamp=data.get('timestamp')
+            )
 
     async def ride_request(self, event):
         """Send ride request notification to driver"""
         # Forward ride request to driver
-        await self.send(text_data=json.dumps(event['data']))
+        await self.send_message(event['data'])
 
-    @database_sync_to_async
-    def accept_ride(self, ride_id):
-        """Accept a ride request"""
-        from bookings.models import Booking
-        from drivers.models import Driver
+    async def ride_offer_update(self, event):
+        """Forward offer confirmations and withdrawals to the driver"""
+        await self.send_message(event['data'])
+
+    async def accept_ride(self, ride_id):
+        """
+        Accept a ride request.
+
+        The ride's dispatcher settles competing accepts and answers with a
+        ride_confirmed or ride_unavailable message.
+        """
+        return await self.respond_to_offer(ride_id, accepted=True)
+
+    async def decline_ride(self, ride_id):
+        """Decline a ride request so the dispatcher can offer it to the next driver"""
+        return await self.respond_to_offer(ride_id, accepted=False)
 
-        try:
-            booking = Booking.objects.get(id=ride_id)
-            driver = Driver.objects.get(user__phone_number=self.driver_id)
-
-            # Update booking with driver
-            booking.driver = driver
-            booking.status = 'accepted'
-            booking.accepted_at = timezone.now()
-            booking.save()
-
-            # Update driver status
-            driver.status = 'busy'
-            driver.save()
-
-            print(f'✅ Ride {ride_id} accepted by driver {driver.id}')
-
-            # Notify passenger via ride group
-            from channels.layers import get_channel_layer
-            import asyncio
-
-            channel_layer = get_channel_layer()
-            ride_group_name = f'ride_{ride_id}'
-
-            asyncio.create_task(channel_layer.group_send(
-                ride_group_name,
-                {
-                    'type': 'driver_assigned',
-                    'ride_id': str(ride_id),
-                    'driver_id': str(driver.id),
-                    'driver_name': driver.user.get_full_name(),
-                    'driver_phone': driver.user.phone_number,
-                    'driver_rating': float(driver.rating) if driver.rating else 0.0,
-                    'vehicle_type': driver.vehicle_type,
-                    'vehicle_registration': driver.vehicle_registration,
-                }
-            ))
-
-            return True
-        except Exception as e:
-            print(f'❌ Error accepting ride: {e}')
+    async def respond_to_offer(self, ride_id, accepted):
+        if self.driver_pk is None or not str(ride_id).isdigit():
             return False
 
-    @database_sync_to_async
-    def decline_ride(self, ride_id):
-        """Decline a ride request"""
-        # Just log for now, booking stays available for other drivers
-        print(f'Driver {self.driver_id} declined ride {ride_id}')
+        await self.channel_layer.group_send(
+            f'ride_{ride_id}',
+            {
+                'type': 'driver_response',
+                'ride_id': str(ride_id),
+                'driver_id': self.driver_pk,
+                'accepted': accepted,
+            }
+        )
         return True
 
     @database_sync_to_async
-    def update_driver_location(self, latitude, longitude):
-        """Update driver's current location"""
-        from drivers.models import Driver, DriverLocation
-        from decimal import Decimal
-
-        try:
-            driver = Driver.objects.get(user__phone_number=self.driver_id)
-
-            # Update or create driver location
-            DriverLocation.objects.update_or_create(
-                driver=driver,
-                defaults={
-                    'latitude': Decimal(str(latitude)),
-                    'longitude': Decimal(str(longitude)),
-                    'updated_at': timezone.now(),
-                }
-            )
+    def get_driver_pk(self):
+        """Look up the driver by the phone number in the URL, for unauthenticated connections"""
+        from drivers.models import Driver
+
+        return Driver.objects.filter(user__phone_number=self.driver_id).values_list('id', flat=True).first()
 
-            return True
-        except Exception as e:
-            print(f'❌ Error updating driver location: {e}')
+    async def update_driver_location(self, latitude, longitude, heading=None, speed=None, timestamp=None):
+        """
+        Update driver's current location.
+
+        The spatial index is updated immediately; the database write is left
+        to the location buffer's periodic flush.
+        """
+        if self.driver_pk is None:
+            print(f'❌ Error updating driver location: no driver for {self.driver_id}')
+            return False
+        presence.heartbeat(self.driver_pk)
+
+        # Clients may stamp frames with epoch milliseconds so late frames can be dropped
+        recorded_at = timestamp / 1000 if isinstance(timestamp, (int, float)) else None
+        if not location_buffer.push(self.driver_pk, latitude, longitude, heading, speed, recorded_at):
             return False
+
+        driver_index.update_position(self.driver_pk, latitude, longitude)
+        if driver_index.is_available(self.driver_pk):
+            heatmap.record_driver(self.driver_pk, latitude, longitude)
+        await ride_events.driver_location(self.driver_pk, latitude, longitude, heading, speed)
+        await ride_tracker.publish(self.driver_pk, latitude, longitude, heading, speed, recorded_at)
+        return True
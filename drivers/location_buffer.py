@@ -0,0 +1,161 @@
+"""
+Write-behind buffer for driver location updates.
+
+Location frames arrive far more often than anyone needs them persisted, so
+the driver WebSocket only records the latest position per driver here.  A
+background task flushes the buffer to ``DriverLocation`` every
+``DRIVER_LOCATION_FLUSH_INTERVAL`` seconds with one ``bulk_update`` (plus a
+``bulk_create`` for drivers that have never reported a location), however
+many updates were received in between.
+"""
+import asyncio
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class LocationBuffer:
+    """Latest-position-per-driver store with coalescing and periodic flush"""
+
+    def __init__(self, flush_interval=2.0, max_pending=5000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = {}      # driver id -> (lat, lon, heading, speed, recorded_at)
+        self._last_seen = {}    # driver id -> recorded_at of the newest accepted point
+        self._task = None
+        self._wakeup = None
+        self._loop = None
+        self.stats = {
+            'received': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'flushed': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+        }
+
+    def push(self, driver_id, latitude, longitude, heading=None, speed=None, recorded_at=None):
+        """
+        Record a position.  Returns False when the point was dropped because
+        it is invalid or older than one already accepted for the driver.
+        """
+        recorded_at = recorded_at or time.time()
+        with self._lock:
+            self.stats['received'] += 1
+            try:
+                latitude = float(latitude)
+                longitude = float(longitude)
+            except (TypeError, ValueError):
+                self.stats['dropped'] += 1
+                return False
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                self.stats['dropped'] += 1
+                return False
+            if recorded_at < self._last_seen.get(driver_id, 0):
+                self.stats['dropped'] += 1
+                return False
+
+            if driver_id in self._pending:
+                self.stats['coalesced'] += 1
+            self._pending[driver_id] = (latitude, longitude, heading, speed, recorded_at)
+            self._last_seen[driver_id] = recorded_at
+            overflowing = len(self._pending) >= self.max_pending
+
+        if overflowing and self._wakeup is not None:
+            # Flush early rather than let the buffer grow without bound
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    def forget(self, driver_id):
+        """Drop ordering state for a driver who has gone offline"""
+        with self._lock:
+            self._last_seen.pop(driver_id, None)
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def flush(self):
+        """Persist everything buffered so far; returns the number of drivers written"""
+        from .models import DriverLocation
+
+        pending = self.drain()
+        if not pending:
+            return 0
+
+        now = timezone.now()
+        try:
+            existing = DriverLocation.objects.in_bulk(pending.keys(), field_name='driver_id')
+            to_update = []
+            to_create = []
+            for driver_id, (lat, lon, heading, speed, _) in pending.items():
+                location = existing.get(driver_id)
+                if location is None:
+                    location = DriverLocation(driver_id=driver_id)
+                    to_create.append(location)
+                else:
+                    to_update.append(location)
+                location.latitude = Decimal(str(round(lat, 6)))
+                location.longitude = Decimal(str(round(lon, 6)))
+                if heading is not None:
+                    location.heading = Decimal(str(round(float(heading), 2)))
+                if speed is not None:
+                    location.speed = Decimal(str(round(float(speed), 2)))
+                location.updated_at = now
+
+            if to_update:
+                DriverLocation.objects.bulk_update(
+                    to_update, ['latitude', 'longitude', 'heading', 'speed', 'updated_at'], batch_size=500
+                )
+            if to_create:
+                DriverLocation.objects.bulk_create(to_create, batch_size=500, ignore_conflicts=True)
+        except Exception:
+            # Put the points back unless newer ones arrived in the meantime
+            with self._lock:
+                for driver_id, point in pending.items():
+                    self._pending.setdefault(driver_id, point)
+                self.stats['flush_errors'] += 1
+            logger.exception('Failed to flush %d driver locations', len(pending))
+            return 0
+
+        with self._lock:
+            self.stats['flushed'] += len(pending)
+            self.stats['flushes'] += 1
+        logger.debug('Flushed %d driver locations (%s)', len(pending), self.stats)
+        return len(pending)
+
+    def metrics(self):
+        with self._lock:
+            return {**self.stats, 'pending': len(self._pending)}
+
+    def ensure_started(self):
+        """Start the flush loop on the running event loop if it is not running yet"""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await database_sync_to_async(self.flush)()
+
+
+location_buffer = LocationBuffer(
+    flush_interval=settings.DRIVER_LOCATION_FLUSH_INTERVAL,
+    max_pending=settings.DRIVER_LOCATION_BUFFER_MAX_PENDING,
+)
@@ -0,0 +1,79 @@
+import json
+import time
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from care_connect_backend.wire import JSONCodec, MsgpackCodec, decode_location, encode_location
+
+LOCATION = {
+    'type': 'location_update',
+    'latitude': -26.2041028,
+    'longitude': 28.0473051,
+    'heading': 87.5,
+    'speed': 12.25,
+    'timestamp': 1760000000000,
+}
+
+RIDE_REQUEST = {
+    'type': 'ride_request',
+    'ride_id': '48213',
+    'passenger_name': 'Thandi Nkosi',
+    'passenger_phone': '+27821234567',
+    'pickup_address': '12 Jan Smuts Avenue, Braamfontein, Johannesburg',
+    'dropoff_address': 'Charlotte Maxeke Johannesburg Academic Hospital, Parktown',
+    'pickup_latitude': -26.1929,
+    'pickup_longitude': 28.0305,
+    'dropoff_latitude': -26.1745,
+    'dropoff_longitude': 28.0447,
+    'distance': 3.84,
+    'fare': 62.5,
+    'estimated_duration': 11,
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare frame size and encode/decode cost of the WebSocket wire protocols'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=100000, help='Iterations per measurement')
+
+    def handle(self, *args, **options):
+        number = options['number']
+
+        def per_call(func):
+            # Best of three runs, in microseconds
+            return min(timeit.repeat(func, number=number, repeat=3, timer=time.perf_counter)) / number * 1e6
+
+        json_location = JSONCodec.encode(LOCATION)['text_data']
+        msgpack_location = MsgpackCodec.encode(LOCATION)['bytes_data']
+        struct_location = encode_location(
+            LOCATION['latitude'], LOCATION['longitude'], LOCATION['heading'], LOCATION['speed'], LOCATION['timestamp']
+        )
+        json_request = JSONCodec.encode(RIDE_REQUEST)['text_data']
+        msgpack_request = MsgpackCodec.encode(RIDE_REQUEST)['bytes_data']
+        verbose_location = json.dumps(LOCATION)
+
+        rows = [
+            ('location_update', 'json (before)', len(verbose_location.encode()),
+             per_call(lambda: json.dumps(LOCATION)), per_call(lambda: json.loads(verbose_location))),
+            ('location_update', 'json', len(json_location.encode()),
+             per_call(lambda: JSONCodec.encode(LOCATION)), per_call(lambda: JSONCodec.decode(json_location))),
+            ('location_update', 'msgpack', len(msgpack_location),
+             per_call(lambda: MsgpackCodec.encode(LOCATION)),
+             per_call(lambda: MsgpackCodec.decode(bytes_data=msgpack_location))),
+            ('location_update', 'struct', len(struct_location),
+             per_call(lambda: encode_location(-26.2041028, 28.0473051, 87.5, 12.25, 1760000000000)),
+             per_call(lambda: decode_location(struct_location))),
+            ('ride_request', 'json', len(json_request.encode()),
+             per_call(lambda: JSONCodec.encode(RIDE_REQUEST)), per_call(lambda: JSONCodec.decode(json_request))),
+            ('ride_request', 'msgpack', len(msgpack_request),
+             per_call(lambda: MsgpackCodec.encode(RIDE_REQUEST)),
+             per_call(lambda: MsgpackCodec.decode(bytes_data=msgpack_request))),
+        ]
+
+        self.stdout.write(f'📦 {number:,} iterations per measurement')
+        self.stdout.write(f"  {'message':<16} {'codec':<14} {'bytes':>6} {'encode µs':>10} {'decode µs':>10}")
+        for message, codec, size, encode_us, decode_us in rows:
+            self.stdout.write(f'  {message:<16} {codec:<14} {size:>6} {encode_us:>10.2f} {decode_us:>10.2f}')
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark complete'))
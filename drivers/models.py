@@ -38,7 +38,8 @@ class DriverLocation(models.Model):
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
     heading = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     speed = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    # Indexed for the spatial index refresh of multi-worker deployments
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name_plural = "Driver Locations"
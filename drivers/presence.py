@@ -0,0 +1,242 @@
+"""
+Driver presence from WebSocket heartbeats.
+
+``Driver.status`` says whether a driver wants rides, not whether their app
+is still there; a phone that dies mid-shift leaves the driver ``available``
+forever.  The ``PresenceTracker`` records a heartbeat for every connect,
+ping and location frame on the driver WebSocket and expires drivers that go
+quiet for ``DRIVER_PRESENCE_TIMEOUT`` seconds.  A driver who disconnects
+cleanly gets ``DRIVER_PRESENCE_DISCONNECT_GRACE`` seconds to reconnect.
+A driver heard from again after expiring is put back in the spatial index
+if the database still has them ``available``.  One the tracker itself
+flipped ``offline`` is flipped back to ``available`` first, unless they
+changed their status themselves in the meantime.
+
+Deadlines live in a timing wheel: one slot per tick, each holding the
+drivers due to expire then.  A heartbeat moves the driver to a later slot
+in O(1), and every tick empties exactly one slot.  However many drivers are
+connected, nothing ever scans them all.  Each tick's expired drivers leave
+the spatial index and are flipped from ``available`` to ``offline`` with a
+single UPDATE.
+
+With a single worker (the in-memory channel layer) the tracker sees every
+driver socket.  It is then authoritative: only drivers with a live
+heartbeat are matched, and drivers left ``available`` by a previous run are
+flipped offline once a full timeout has passed without hearing from them.
+With several workers each one sees only its own sockets.  Matching then
+merely skips drivers this worker saw expire, and relies on the status flip
+for the rest.
+"""
+import asyncio
+import logging
+import math
+import threading
+from collections import Counter
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from .location_buffer import location_buffer
+from .spatial_index import driver_index
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    """Heartbeat liveness of driver sockets, expired with a timing wheel"""
+
+    def __init__(self, timeout=45, disconnect_grace=10, tick=1.0, authoritative=True):
+        self.tick = tick
+        self.timeout_ticks = max(1, math.ceil(timeout / tick))
+        self.grace_ticks = max(1, min(self.timeout_ticks, math.ceil(disconnect_grace / tick)))
+        self.authoritative = authoritative
+        self._lock = threading.Lock()
+        self._wheel = [set() for _ in range(self.timeout_ticks + 1)]
+        self._cursor = 0
+        self._slot_of = {}          # driver id -> wheel slot of their deadline
+        self._connections = Counter()
+        self._expired = set()       # drivers this worker saw expire and has not heard from since
+        self._flipped = set()       # drivers this worker flipped offline and has not heard from since
+        self._ticks_run = 0
+        self._reconciled = False
+        self._task = None
+        self._revivals = set()      # pending revive tasks, referenced until done
+        self.stats = {'heartbeats': 0, 'expired': 0, 'revived': 0, 'flipped_offline': 0, 'reconciled_offline': 0}
+
+    # Feeding
+
+    def _schedule(self, driver_id, ticks):
+        slot = (self._cursor + ticks) % len(self._wheel)
+        previous = self._slot_of.get(driver_id)
+        if previous != slot:
+            if previous is not None:
+                self._wheel[previous].discard(driver_id)
+            self._wheel[slot].add(driver_id)
+            self._slot_of[driver_id] = slot
+
+    def heartbeat(self, driver_id):
+        """The driver's app is alive"""
+        with self._lock:
+            self.stats['heartbeats'] += 1
+            returning = driver_id in self._expired or driver_id in self._flipped
+            self._expired.discard(driver_id)
+            self._schedule(driver_id, self.timeout_ticks)
+        if returning:
+            self._revive_soon(driver_id)
+
+    def connect(self, driver_id):
+        with self._lock:
+            self._connections[driver_id] += 1
+        self.heartbeat(driver_id)
+
+    def disconnect(self, driver_id):
+        """A socket closed; the driver expires after the grace period unless they reconnect"""
+        with self._lock:
+            self._connections[driver_id] -= 1
+            if self._connections[driver_id] <= 0:
+                del self._connections[driver_id]
+                if driver_id in self._slot_of:
+                    self._schedule(driver_id, self.grace_ticks)
+
+    # Queries
+
+    def is_present(self, driver_id):
+        return driver_id in self._slot_of
+
+    def is_matchable(self, driver_id):
+        """Whether matching may offer rides to the driver, as far as this worker knows"""
+        if self.authoritative:
+            return driver_id in self._slot_of
+        return driver_id not in self._expired
+
+    def present(self):
+        with self._lock:
+            return set(self._slot_of)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                **self.stats,
+                'present': len(self._slot_of),
+                'connected': len(self._connections),
+                'authoritative': self.authoritative,
+            }
+
+    # Expiry
+
+    def advance(self):
+        """Move the wheel on one tick; returns the drivers whose deadline passed"""
+        with self._lock:
+            self._cursor = (self._cursor + 1) % len(self._wheel)
+            due = self._wheel[self._cursor]
+            self._wheel[self._cursor] = set()
+            for driver_id in due:
+                del self._slot_of[driver_id]
+                self._connections.pop(driver_id, None)
+            self._expired |= due
+            self._ticks_run += 1
+            self.stats['expired'] += len(due)
+        for driver_id in due:
+            driver_index.set_available(driver_id, False)
+            location_buffer.forget(driver_id)
+        return due
+
+    def _revive_soon(self, driver_id):
+        """Run ``revive`` off the event loop when called from a consumer"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.revive(driver_id)
+            return
+        task = loop.create_task(database_sync_to_async(self.revive)(driver_id))
+        self._revivals.add(task)
+        task.add_done_callback(self._revivals.discard)
+
+    def revive(self, driver_id):
+        """Make a driver who came back after expiring matchable again, unless they went offline meanwhile"""
+        from .models import Driver
+
+        with self._lock:
+            flipped = driver_id in self._flipped
+            self._flipped.discard(driver_id)
+        if flipped:
+            # Conditional, so a driver who went busy or offline themselves keeps that
+            Driver.objects.filter(id=driver_id, status='offline').update(status='available')
+        if not Driver.objects.filter(id=driver_id, status='available', is_verified=True).exists():
+            return False
+        # They may have expired again while we were looking
+        if not self.is_present(driver_id):
+            return False
+        driver_index.set_available(driver_id, True)
+        self.stats['revived'] += 1
+        return True
+
+    def flip_offline(self, driver_ids):
+        """Mark expired drivers offline in one UPDATE; busy drivers keep their ride"""
+        from .models import Driver
+
+        # Anyone who came back since expiring keeps their status
+        driver_ids = [driver_id for driver_id in driver_ids if not self.is_present(driver_id)]
+        if not driver_ids:
+            return 0
+        flipped = self._flip(driver_ids)
+        self.stats['flipped_offline'] += flipped
+        if flipped:
+            logger.info(f'Marked {flipped} silent drivers offline')
+        return flipped
+
+    def _flip(self, driver_ids):
+        """Flip available drivers offline, remembering who so their return can undo it"""
+        from .models import Driver
+
+        flippable = Driver.objects.filter(id__in=driver_ids, status='available')
+        ids = list(flippable.values_list('id', flat=True))
+        flipped = Driver.objects.filter(id__in=ids, status='available').update(status='offline') if ids else 0
+        with self._lock:
+            self._flipped.update(ids)
+        return flipped
+
+    def status_changed(self, driver_id):
+        """The driver's status was saved by the driver or an admin; never undo it"""
+        with self._lock:
+            self._flipped.discard(driver_id)
+
+    def reconcile(self):
+        """Flip drivers offline whom the database calls available but who never checked in"""
+        from .models import Driver
+
+        present = self.present()
+        stale = list(Driver.objects.filter(status='available').exclude(id__in=present).values_list('id', flat=True))
+        flipped = self._flip(stale) if stale else 0
+        for driver_id in stale:
+            driver_index.set_available(driver_id, False)
+        self.stats['reconciled_offline'] += flipped
+        if flipped:
+            logger.info(f'Marked {flipped} drivers offline who have not connected since startup')
+        return flipped
+
+    def ensure_started(self):
+        """Start ticking on the running event loop if it is not ticking yet"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                expired = self.advance()
+                if expired:
+                    await database_sync_to_async(self.flip_offline)(expired)
+                if self.authoritative and not self._reconciled and self._ticks_run >= self.timeout_ticks:
+                    self._reconciled = True
+                    await database_sync_to_async(self.reconcile)()
+            except Exception:
+                logger.exception('Driver presence tick failed')
+
+
+presence = PresenceTracker(
+    timeout=settings.DRIVER_PRESENCE_TIMEOUT,
+    disconnect_grace=settings.DRIVER_PRESENCE_DISCONNECT_GRACE,
+    tick=settings.DRIVER_PRESENCE_TICK,
+    authoritative=settings.DRIVER_PRESENCE_AUTHORITATIVE,
+)
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Driver, DriverLocation
+from .presence import presence
+from .spatial_index import driver_index
+
+
+@receiver(post_save, sender=Driver)
+def sync_driver_availability(sender, instance, **kwargs):
+    """Keep the spatial index's availability flag in step with the driver row"""
+    driver_index.set_available(instance.id, instance.status == 'available' and instance.is_verified)
+    presence.status_changed(instance.id)
+
+
+@receiver(post_delete, sender=Driver)
+def drop_driver(sender, instance, **kwargs):
+    driver_index.remove(instance.id)
+
+
+@receiver(post_save, sender=DriverLocation)
+def sync_driver_position(sender, instance, **kwargs):
+    """Move the driver in the spatial index whenever their location is saved"""
+    driver_index.update_position(instance.driver_id, instance.latitude, instance.longitude)
@@ -0,0 +1,251 @@
+"""
+In-process spatial index over live driver positions.
+
+Drivers are bucketed into a fixed latitude/longitude grid so that a
+"k nearest available drivers within radius" query only has to look at the
+cells around the pickup point instead of the whole fleet.  The index is
+warmed from the database on first use and then kept current by the driver
+WebSocket and the model signals (see ``drivers.signals``).
+
+Those only see this process.  With a shared channel layer drivers connect
+to other workers too, and their positions reach the database through the
+location buffer's bulk writes, which send no signals.  Each worker then
+catches up every ``DRIVER_INDEX_REFRESH_SECONDS``: it re-reads the
+locations written since its last refresh and the set of matchable drivers.
+"""
+import math
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from geo.distance import haversine_one_to_many
+
+KM_PER_DEGREE = 111.32
+
+
+class DriverSpatialIndex:
+    """Grid index of driver positions with an availability flag per driver"""
+
+    def __init__(self, cell_size_deg=0.01):
+        self.cell_size_deg = cell_size_deg
+        self._lock = threading.Lock()
+        self._cells = {}        # (row, col) -> set of driver ids
+        self._positions = {}    # driver id -> (lat, lon, cell)
+        self._available = set()
+        self._updated_at = {}   # driver id -> epoch time of the last position from this process
+        self._loaded = False
+
+    def __len__(self):
+        return len(self._positions)
+
+    @property
+    def is_loaded(self):
+        return self._loaded
+
+    def _cell_for(self, lat, lon):
+        return (math.floor(lat / self.cell_size_deg), math.floor(lon / self.cell_size_deg))
+
+    def _move(self, driver_id, lat, lon):
+        cell = self._cell_for(lat, lon)
+        previous = self._positions.get(driver_id)
+        if previous and previous[2] != cell:
+            bucket = self._cells.get(previous[2])
+            if bucket is not None:
+                bucket.discard(driver_id)
+                if not bucket:
+                    del self._cells[previous[2]]
+        self._cells.setdefault(cell, set()).add(driver_id)
+        self._positions[driver_id] = (lat, lon, cell)
+
+    def update_position(self, driver_id, lat, lon):
+        """Record the latest position of a driver"""
+        with self._lock:
+            self._move(driver_id, float(lat), float(lon))
+            self._updated_at[driver_id] = time.time()
+
+    def set_available(self, driver_id, available):
+        """Mark a driver as matchable (available and verified) or not"""
+        with self._lock:
+            if available:
+                self._available.add(driver_id)
+            else:
+                self._available.discard(driver_id)
+
+    def is_available(self, driver_id):
+        """Whether a driver is currently marked matchable"""
+        return driver_id in self._available
+
+    def remove(self, driver_id):
+        """Forget a driver entirely"""
+        with self._lock:
+            self._available.discard(driver_id)
+            self._updated_at.pop(driver_id, None)
+            previous = self._positions.pop(driver_id, None)
+            if previous:
+                bucket = self._cells.get(previous[2])
+                if bucket is not None:
+                    bucket.discard(driver_id)
+                    if not bucket:
+                        del self._cells[previous[2]]
+
+    def load(self, rows):
+        """
+        Bulk-load ``(driver_id, lat, lon, available)`` rows.
+
+        Drivers already present were updated after the rows were read, so
+        they are left alone.
+        """
+        with self._lock:
+            for driver_id, lat, lon, available in rows:
+                if driver_id in self._positions:
+                    continue
+                self._move(driver_id, float(lat), float(lon))
+                if available:
+                    self._available.add(driver_id)
+            self._loaded = True
+
+    def refresh(self, rows, available_ids):
+        """
+        Catch up with other processes from ``(driver_id, lat, lon, updated_at)``
+        rows and the ids of every matchable driver.  Positions this process
+        recorded later than the row was written are kept.
+        """
+        with self._lock:
+            for driver_id, lat, lon, updated_at in rows:
+                if self._updated_at.get(driver_id, 0) < updated_at.timestamp():
+                    self._move(driver_id, float(lat), float(lon))
+            self._available = set(available_ids)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._positions.clear()
+            self._available.clear()
+            self._updated_at.clear()
+            self._loaded = False
+
+    def positions(self, driver_ids):
+        """(N, 2) array of the drivers' latitudes and longitudes; NaN for unknown drivers"""
+        with self._lock:
+            return np.array(
+                [self._positions.get(driver_id, (np.nan, np.nan))[:2] for driver_id in driver_ids],
+                dtype=np.float64
+            ).reshape(-1, 2)
+
+    def nearest(self, lat, lon, k=5, radius_km=10, where=None):
+        """
+        Return up to ``k`` ``(driver_id, distance_km)`` pairs for available
+        drivers within ``radius_km`` of the point, closest first.  ``where``
+        optionally narrows the candidates further with a driver id predicate.
+        """
+        lat = float(lat)
+        lon = float(lon)
+        row, col = self._cell_for(lat, lon)
+
+        # Smallest cell extent inside the search area, so a ring of cells is
+        # never assumed to be further away than it really is.
+        max_abs_lat = min(abs(lat) + radius_km / KM_PER_DEGREE, 89.9)
+        cell_km = self.cell_size_deg * KM_PER_DEGREE * math.cos(math.radians(max_abs_lat))
+        max_ring = int(math.ceil(radius_km / cell_km)) + 1
+
+        found = []
+        with self._lock:
+            for ring in range(max_ring + 1):
+                ids = []
+                coords = []
+                for cell in self._ring_cells(row, col, ring):
+                    for driver_id in self._cells.get(cell, ()):
+                        if driver_id in self._available and (where is None or where(driver_id)):
+                            ids.append(driver_id)
+                            coords.append(self._positions[driver_id][:2])
+
+                # Score the whole ring in one vectorised call
+                if ids:
+                    points = np.array(coords)
+                    distances = haversine_one_to_many(lat, lon, points[:, 0], points[:, 1])
+                    found.extend(
+                        (driver_id, float(distance))
+                        for driver_id, distance in zip(ids, distances)
+                        if distance <= radius_km
+                    )
+
+                # Everything outside the rings scanned so far is at least
+                # ``ring * cell_km`` away.
+                if len(found) >= k:
+                    found.sort(key=lambda item: item[1])
+                    if found[k - 1][1] <= ring * cell_km:
+                        break
+
+        found.sort(key=lambda item: item[1])
+        return found[:k]
+
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        if ring == 0:
+            yield (row, col)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (row - ring, c)
+            yield (row + ring, c)
+        for r in range(row - ring + 1, row + ring):
+            yield (r, col - ring)
+            yield (r, col + ring)
+
+
+driver_index = DriverSpatialIndex(cell_size_deg=settings.DRIVER_INDEX_CELL_DEGREES)
+
+
+# Location rows are stamped before their batch commits, so each refresh
+# re-reads a little of what the previous one may have seen
+REFRESH_OVERLAP_SECONDS = 30
+
+_refresh_lock = threading.Lock()
+_last_refresh = {'started': None, 'at': 0.0}     # database time, monotonic time
+
+
+def ensure_driver_index_loaded():
+    """
+    Warm the index from the database the first time it is queried and, with
+    several workers, refresh it once ``DRIVER_INDEX_REFRESH_SECONDS`` passed
+    """
+    if driver_index.is_loaded:
+        if settings.DRIVER_INDEX_REFRESH_SECONDS:
+            refresh_driver_index()
+        return
+    from .models import DriverLocation
+
+    started = timezone.now()
+    rows = DriverLocation.objects.values_list(
+        'driver_id', 'latitude', 'longitude', 'driver__status', 'driver__is_verified'
+    )
+    driver_index.load(
+        (driver_id, lat, lon, status == 'available' and is_verified)
+        for driver_id, lat, lon, status, is_verified in rows
+    )
+    with _refresh_lock:
+        _last_refresh.update(started=started, at=time.monotonic())
+
+
+def refresh_driver_index(force=False):
+    """Apply what other processes wrote since the last refresh; False if not due yet"""
+    from .models import Driver, DriverLocation
+
+    with _refresh_lock:
+        due = _last_refresh['at'] + settings.DRIVER_INDEX_REFRESH_SECONDS
+        if not force and time.monotonic() < due:
+            return False
+        since = _last_refresh['started']
+        _last_refresh.update(started=timezone.now(), at=time.monotonic())
+
+    locations = DriverLocation.objects.all()
+    if since is not None:
+        locations = locations.filter(updated_at__gte=since - timedelta(seconds=REFRESH_OVERLAP_SECONDS))
+    driver_index.refresh(
+        locations.values_list('driver_id', 'latitude', 'longitude', 'updated_at'),
+        Driver.objects.filter(status='available', is_verified=True).values_list('id', flat=True)
+    )
+    return True
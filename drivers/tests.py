@@ -1,3 +1,148 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from .models import Driver, DriverLocation
+from .presence import PresenceTracker
+from .spatial_index import driver_index, ensure_driver_index_loaded, refresh_driver_index
+
+User = get_user_model()
+
+
+class PresenceTrackerTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(username='driver', phone_number='+27830000001')
+        self.driver = Driver.objects.create(
+            user=user,
+            phone_number=user.phone_number,
+            license_number='L-1',
+            vehicle_registration='TEST',
+            status='available',
+            is_verified=True,
+        )
+        self.addCleanup(driver_index.remove, self.driver.id)
+        self.presence = PresenceTracker(timeout=2, disconnect_grace=1, tick=1)
+
+    def expire(self):
+        expired = set()
+        for _ in range(self.presence.timeout_ticks + 1):
+            expired |= self.presence.advance()
+        return expired
+
+    def assert_matchable(self, matchable):
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.status, 'available' if matchable else 'offline')
+        self.assertEqual(driver_index.is_available(self.driver.id), matchable)
+        self.assertEqual(self.presence.is_matchable(self.driver.id), matchable)
+
+    def test_silent_driver_expires_and_is_flipped_offline(self):
+        self.presence.connect(self.driver.id)
+
+        self.assertEqual(self.expire(), {self.driver.id})
+        self.assertEqual(self.presence.flip_offline([self.driver.id]), 1)
+
+        self.assert_matchable(False)
+
+    def test_returning_driver_is_matchable_again(self):
+        self.presence.connect(self.driver.id)
+        self.presence.flip_offline(self.expire())
+
+        self.presence.heartbeat(self.driver.id)
+
+        self.assert_matchable(True)
+        self.assertEqual(self.presence.metrics()['revived'], 1)
+
+    def test_returning_driver_keeps_a_status_they_chose(self):
+        self.presence.connect(self.driver.id)
+        self.presence.flip_offline(self.expire())
+        # The driver went busy through the app meanwhile
+        self.driver.status = 'busy'
+        self.driver.save()
+        self.presence.status_changed(self.driver.id)
+
+        self.presence.heartbeat(self.driver.id)
+
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.status, 'busy')
+        self.assertFalse(driver_index.is_available(self.driver.id))
+
+    def test_driver_who_reconnects_within_the_timeout_is_not_flipped(self):
+        self.presence.connect(self.driver.id)
+        self.presence.advance()
+        self.presence.heartbeat(self.driver.id)
+
+        self.assertEqual(self.presence.advance(), set())
+        self.assert_matchable(True)
+
+
+@override_settings(DRIVER_INDEX_REFRESH_SECONDS=5)
+class DriverIndexRefreshTests(TestCase):
+    """Drivers connected to another worker reach this worker's index"""
+
+    def setUp(self):
+        driver_index.clear()
+        self.addCleanup(driver_index.clear)
+        ensure_driver_index_loaded()
+
+    def create_driver(self, i, status='available'):
+        user = User.objects.create(username=f'driver{i}', phone_number=f'+2783000000{i}')
+        return Driver.objects.create(
+            user=user,
+            phone_number=user.phone_number,
+            license_number=f'L-{i}',
+            vehicle_registration='TEST',
+            status=status,
+            is_verified=True,
+        )
+
+    def write_elsewhere(self, driver, lat, lon):
+        """A position as another worker's location buffer writes it, without signals"""
+        location = DriverLocation.objects.filter(driver=driver).first()
+        if location is None:
+            DriverLocation.objects.bulk_create([
+                DriverLocation(driver=driver, latitude=Decimal(lat), longitude=Decimal(lon))
+            ])
+            return
+        location.latitude, location.longitude = Decimal(lat), Decimal(lon)
+        DriverLocation.objects.bulk_update([location], ['latitude', 'longitude', 'updated_at'])
+
+    def nearest(self):
+        return [driver_id for driver_id, _ in driver_index.nearest(-26.2041, 28.0473, k=5, radius_km=5)]
+
+    def test_driver_from_another_worker_is_found_after_a_refresh(self):
+        driver = self.create_driver(1, status='offline')
+        driver_index.clear()
+        ensure_driver_index_loaded()
+        self.write_elsewhere(driver, '-26.204100', '28.047300')
+        Driver.objects.filter(id=driver.id).update(status='available')
+        self.assertEqual(self.nearest(), [])
+
+        self.assertTrue(refresh_driver_index(force=True))
+
+        self.assertEqual(self.nearest(), [driver.id])
+
+    def test_refresh_is_not_due_before_the_interval(self):
+        self.assertFalse(refresh_driver_index())
+
+    def test_newer_position_from_this_worker_is_kept(self):
+        driver = self.create_driver(1)
+        self.write_elsewhere(driver, '-26.204100', '28.047300')
+        refresh_driver_index(force=True)
+        driver_index.update_position(driver.id, -25.0, 28.0)
+
+        refresh_driver_index(force=True)
+
+        self.assertEqual(self.nearest(), [])
+        self.assertEqual(driver_index.positions([driver.id]).tolist(), [[-25.0, 28.0]])
+
+    def test_driver_who_went_offline_elsewhere_is_no_longer_available(self):
+        driver = self.create_driver(1)
+        self.write_elsewhere(driver, '-26.204100', '28.047300')
+        refresh_driver_index(force=True)
+        Driver.objects.filter(id=driver.id).update(status='offline')
+
+        refresh_driver_index(force=True)
+
+        self.assertFalse(driver_index.is_available(driver.id))
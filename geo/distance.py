@@ -0,0 +1,86 @@
+"""
+Great-circle distance and bearing helpers shared by pricing and matching.
+
+The scalar functions take anything ``float()`` accepts (floats, Decimals,
+strings).  The batch functions take array-likes of float64 and evaluate the
+whole set in one vectorised NumPy pass:
+
+* ``*_one_to_many``  - one origin against N points, returns shape (N,)
+* ``*_many_to_many`` - N origins against M points, returns shape (N, M)
+* ``*_pairwise``     - origin[i] against point[i], returns shape (N,)
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Calculate distance between two points using Haversine formula"""
+    lat1_rad = math.radians(float(lat1))
+    lat2_rad = math.radians(float(lat2))
+    dlat = lat2_rad - lat1_rad
+    dlon = math.radians(float(lon2)) - math.radians(float(lon1))
+    a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bearing_deg(lat1, lon1, lat2, lon2):
+    """Initial bearing from the first point to the second, in degrees from north"""
+    lat1_rad = math.radians(float(lat1))
+    lat2_rad = math.radians(float(lat2))
+    dlon = math.radians(float(lon2)) - math.radians(float(lon1))
+    x = math.sin(dlon) * math.cos(lat2_rad)
+    y = math.cos(lat1_rad) * math.sin(lat2_rad) - math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(dlon)
+    return (math.degrees(math.atan2(x, y)) + 360) % 360
+
+
+def _as_radians(values):
+    return np.radians(np.asarray(values, dtype=np.float64))
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    """Broadcasting haversine kernel over arrays already in radians"""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _bearing(lat1, lon1, lat2, lon2):
+    """Broadcasting initial-bearing kernel over arrays already in radians"""
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return (np.degrees(np.arctan2(x, y)) + 360) % 360
+
+
+def haversine_one_to_many(lat, lon, lats, lons):
+    return _haversine(_as_radians(lat), _as_radians(lon), _as_radians(lats), _as_radians(lons))
+
+
+def haversine_many_to_many(lats1, lons1, lats2, lons2):
+    return _haversine(
+        _as_radians(lats1)[:, None], _as_radians(lons1)[:, None],
+        _as_radians(lats2)[None, :], _as_radians(lons2)[None, :]
+    )
+
+
+def haversine_pairwise(lats1, lons1, lats2, lons2):
+    return _haversine(_as_radians(lats1), _as_radians(lons1), _as_radians(lats2), _as_radians(lons2))
+
+
+def bearing_one_to_many(lat, lon, lats, lons):
+    return _bearing(_as_radians(lat), _as_radians(lon), _as_radians(lats), _as_radians(lons))
+
+
+def bearing_many_to_many(lats1, lons1, lats2, lons2):
+    return _bearing(
+        _as_radians(lats1)[:, None], _as_radians(lons1)[:, None],
+        _as_radians(lats2)[None, :], _as_radians(lons2)[None, :]
+    )
+
+
+def bearing_pairwise(lats1, lons1, lats2, lons2):
+    return _bearing(_as_radians(lats1), _as_radians(lons1), _as_radians(lats2), _as_radians(lons2))
@@ -0,0 +1,77 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from geo.distance import haversine_km, haversine_one_to_many, haversine_many_to_many, haversine_pairwise
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the vectorised haversine engine against the scalar per-pair function'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=10000, help='Candidate points for one-to-many/pairwise')
+        parser.add_argument('--matrix', type=int, default=500, help='Side length of the many-to-many matrix')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def _time(self, func, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    def _report(self, label, scalar_seconds, batch_seconds):
+        self.stdout.write(
+            f'  {label:<28} scalar {scalar_seconds * 1000:9.2f} ms   '
+            f'batch {batch_seconds * 1000:8.2f} ms   x{scalar_seconds / batch_seconds:6.1f}'
+        )
+
+    def handle(self, *args, **options):
+        points = options['points']
+        side = options['matrix']
+        repeat = options['repeat']
+
+        rng = random.Random(42)
+        lats = [-26.2 + rng.uniform(-0.5, 0.5) for _ in range(points)]
+        lons = [28.0 + rng.uniform(-0.5, 0.5) for _ in range(points)]
+        lats2 = [-26.2 + rng.uniform(-0.5, 0.5) for _ in range(points)]
+        lons2 = [28.0 + rng.uniform(-0.5, 0.5) for _ in range(points)]
+        lat_arr, lon_arr = np.array(lats), np.array(lons)
+        lat2_arr, lon2_arr = np.array(lats2), np.array(lons2)
+        origin = (-26.2041, 28.0473)
+
+        self.stdout.write(f'📏 Haversine benchmark ({points} points, {side}x{side} matrix, best of {repeat})')
+
+        # One-to-many: scoring candidate drivers around a pickup
+        scalar = self._time(lambda: [haversine_km(*origin, la, lo) for la, lo in zip(lats, lons)], repeat)
+        batch = self._time(lambda: haversine_one_to_many(*origin, lat_arr, lon_arr), repeat)
+        self._report('one-to-many', scalar, batch)
+
+        # Pairwise: one distance per trip in a bulk quote
+        scalar = self._time(
+            lambda: [haversine_km(a, b, c, d) for a, b, c, d in zip(lats, lons, lats2, lons2)], repeat
+        )
+        batch = self._time(lambda: haversine_pairwise(lat_arr, lon_arr, lat2_arr, lon2_arr), repeat)
+        self._report('pairwise', scalar, batch)
+
+        # Many-to-many: driver x rider distance matrix
+        m_lats, m_lons = lats[:side], lons[:side]
+        m_lats2, m_lons2 = lats2[:side], lons2[:side]
+        scalar = self._time(
+            lambda: [[haversine_km(a, b, c, d) for c, d in zip(m_lats2, m_lons2)] for a, b in zip(m_lats, m_lons)],
+            max(1, repeat // 2)
+        )
+        batch = self._time(
+            lambda: haversine_many_to_many(lat_arr[:side], lon_arr[:side], lat2_arr[:side], lon2_arr[:side]), repeat
+        )
+        self._report('many-to-many', scalar, batch)
+
+        # Agreement with the scalar implementation
+        expected = np.array([haversine_km(*origin, la, lo) for la, lo in zip(lats, lons)])
+        error = float(np.max(np.abs(expected - haversine_one_to_many(*origin, lat_arr, lon_arr))))
+        self.stdout.write(f'  max abs difference vs scalar: {error:.3e} km')
+
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark complete'))
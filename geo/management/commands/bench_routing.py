@@ -0,0 +1,134 @@
+import math
+import random
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from geo.distance import haversine_km, haversine_pairwise
+from geo.routing import GraphRouter, RoadGraph
+
+CITY = (-26.2041, 28.0473)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark A* routing on a metro-sized road graph (synthetic unless --graph is given)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--graph', help='Road graph file from build_road_graph instead of a synthetic one')
+        parser.add_argument('--side', type=int, default=600,
+                            help='Synthetic grid intersections per side (600 ~ 360k nodes, 72 km across)')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--dijkstra', type=int, default=20, help='Queries also run without the heuristic')
+        parser.add_argument('--min-km', type=float, default=2.0, help='Shortest straight-line trip queried')
+        parser.add_argument('--max-km', type=float, default=20.0, help='Longest straight-line trip queried')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        if options['graph']:
+            graph = RoadGraph.load(options['graph'], snap_cell_degrees=settings.ROUTING_SNAP_CELL_DEGREES)
+            label = options['graph']
+        else:
+            graph = self.synthetic_graph(options['side'], rng)
+            label = f"synthetic {options['side']}x{options['side']} grid"
+        self.stdout.write(
+            f'🛣️  {label}: {graph.node_count} nodes, {graph.edge_count} edges, '
+            f'{graph.nbytes / 1e6:.1f} MB, built in {time.perf_counter() - started:.1f}s'
+        )
+
+        # Trips between random nodes, min to max km apart as the crow flies
+        nodes = np.arange(graph.node_count)
+        trips = []
+        while len(trips) < options['queries']:
+            source, target = rng.choice(nodes), rng.choice(nodes)
+            km = haversine_km(graph.lats[source], graph.lons[source], graph.lats[target], graph.lons[target])
+            if options['min_km'] <= km <= options['max_km']:
+                trips.append((int(source), int(target), km))
+
+        points = [(graph.lats[s] + rng.uniform(-0.001, 0.001), graph.lons[s] + rng.uniform(-0.001, 0.001))
+                  for s, _, _ in trips]
+        started = time.perf_counter()
+        for lat, lon in points:
+            graph.snap(lat, lon, settings.ROUTING_MAX_SNAP_KM)
+        snap_us = (time.perf_counter() - started) / len(points) * 1e6
+
+        astar_ms = []
+        results = []
+        for source, target, _ in trips:
+            started = time.perf_counter()
+            results.append(graph.shortest_path(source, target))
+            astar_ms.append((time.perf_counter() - started) * 1000)
+
+        dijkstra_ms = []
+        for (source, target, _), expected in zip(trips[:options['dijkstra']], results):
+            started = time.perf_counter()
+            found = graph.shortest_path(source, target, heuristic=False)
+            dijkstra_ms.append((time.perf_counter() - started) * 1000)
+            if (found is None) != (expected is None) or (found and abs(found[1] - expected[1]) > 1e-3):
+                self.stdout.write(self.style.ERROR(f'  A* and Dijkstra disagree on {source} -> {target}'))
+
+        router = GraphRouter(graph, max_snap_km=settings.ROUTING_MAX_SNAP_KM)
+        lat1, lon1 = graph.lats[trips[0][0]], graph.lons[trips[0][0]]
+        lat2, lon2 = graph.lats[trips[0][1]], graph.lons[trips[0][1]]
+        router.route(lat1, lon1, lat2, lon2)
+        started = time.perf_counter()
+        for _ in range(1000):
+            router.route(lat1, lon1, lat2, lon2)
+        cached_us = (time.perf_counter() - started) / 1000 * 1e6
+
+        reached = [(result, km) for result, (_, _, km) in zip(results, trips) if result]
+        detour = np.mean([result[0] / km for result, km in reached]) if reached else math.nan
+        speed = np.mean([result[0] / result[1] * 60 for result, _ in reached]) if reached else math.nan
+
+        self.stdout.write(f"  {len(trips)} trips {options['min_km']:g}-{options['max_km']:g} km apart, "
+                          f'{len(reached)} reachable')
+        self.stdout.write(f'  snap to graph          {snap_us:9.1f} µs')
+        self.stdout.write(f'  A*                     {np.mean(astar_ms):9.2f} ms mean, '
+                          f'{np.percentile(astar_ms, 95):.2f} ms p95')
+        if dijkstra_ms:
+            self.stdout.write(f'  Dijkstra               {np.mean(dijkstra_ms):9.2f} ms mean '
+                              f'(x{np.mean(dijkstra_ms) / np.mean(astar_ms[:len(dijkstra_ms)]):.1f} A*)')
+        self.stdout.write(f'  memoised route         {cached_us:9.1f} µs')
+        self.stdout.write(f'  road / straight line   {detour:9.2f}x, free-flow {speed:.0f} km/h')
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark complete'))
+
+    def synthetic_graph(self, side, rng):
+        """
+        A jittered street grid around the city: arterials at 60 km/h every
+        tenth street, a fifth of the local blocks missing, some one-way.
+        """
+        spacing = 0.0011     # ~120 m
+        rows, cols = np.divmod(np.arange(side * side), side)
+        lats = CITY[0] + (rows - side / 2) * spacing + np.array([rng.uniform(-0.0002, 0.0002) for _ in rows])
+        lons = CITY[1] + (cols - side / 2) * spacing + np.array([rng.uniform(-0.0002, 0.0002) for _ in cols])
+
+        sources, targets, speeds = [], [], []
+        for row in range(side):
+            for col in range(side):
+                node = row * side + col
+                for neighbour, line in ((node + 1, row), (node + side, col)):
+                    if (neighbour == node + 1 and col == side - 1) or neighbour >= side * side:
+                        continue
+                    arterial = line % 10 == 0
+                    if not arterial and rng.random() < 0.2:
+                        continue
+                    speed = 60 if arterial else 30
+                    direction = 0 if arterial or rng.random() > 0.1 else rng.choice((1, -1))
+                    if direction >= 0:
+                        sources.append(node)
+                        targets.append(neighbour)
+                        speeds.append(speed)
+                    if direction <= 0:
+                        sources.append(neighbour)
+                        targets.append(node)
+                        speeds.append(speed)
+
+        sources = np.array(sources)
+        targets = np.array(targets)
+        lengths_km = haversine_pairwise(lats[sources], lons[sources], lats[targets], lons[targets])
+        return RoadGraph.from_edges(
+            lats, lons, sources, targets, lengths_km, speeds, snap_cell_degrees=settings.ROUTING_SNAP_CELL_DEGREES
+        )
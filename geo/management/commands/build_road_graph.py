@@ -0,0 +1,124 @@
+import re
+import time
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from geo.distance import haversine_pairwise
+from geo.routing import RoadGraph
+
+# Free-flow speed of each drivable highway type when a way has no usable maxspeed
+HIGHWAY_SPEEDS_KMH = {
+    'motorway': 100,
+    'motorway_link': 60,
+    'trunk': 80,
+    'trunk_link': 50,
+    'primary': 60,
+    'primary_link': 40,
+    'secondary': 50,
+    'secondary_link': 40,
+    'tertiary': 40,
+    'tertiary_link': 30,
+    'unclassified': 30,
+    'residential': 30,
+    'road': 30,
+    'service': 15,
+    'living_street': 10,
+}
+
+MAXSPEED = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(mph)?')
+
+
+class Command(BaseCommand):
+    help = 'Build the road graph used by ROUTING_BACKEND=graph from an OpenStreetMap XML extract'
+
+    def add_arguments(self, parser):
+        parser.add_argument('osm', help='OpenStreetMap XML file (.osm); convert .pbf extracts with osmium first')
+        parser.add_argument('--out', default=settings.ROUTING_GRAPH_PATH, help='Graph file to write')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.stdout.write(f"🗺️  Reading drivable ways from {options['osm']}")
+        try:
+            ways = self.read_ways(options['osm'])
+            needed = {ref for refs, _, _ in ways for ref in refs}
+            coordinates = self.read_nodes(options['osm'], needed)
+        except (OSError, ElementTree.ParseError) as e:
+            raise CommandError(f'Could not read {options["osm"]}: {e}')
+        if not ways:
+            raise CommandError('No drivable ways found')
+
+        node_ids = {osm_id: index for index, osm_id in enumerate(coordinates)}
+        lats = np.array([lat for lat, _ in coordinates.values()])
+        lons = np.array([lon for _, lon in coordinates.values()])
+
+        sources, targets, speeds = [], [], []
+        for refs, speed, oneway in ways:
+            nodes = [node_ids[ref] for ref in refs if ref in node_ids]
+            for a, b in zip(nodes, nodes[1:]):
+                if oneway >= 0:
+                    sources.append(a)
+                    targets.append(b)
+                    speeds.append(speed)
+                if oneway <= 0:
+                    sources.append(b)
+                    targets.append(a)
+                    speeds.append(speed)
+
+        sources = np.array(sources, dtype=np.int64)
+        targets = np.array(targets, dtype=np.int64)
+        lengths_km = haversine_pairwise(lats[sources], lons[sources], lats[targets], lons[targets])
+        graph = RoadGraph.from_edges(lats, lons, sources, targets, lengths_km, speeds)
+        graph.save(options['out'])
+
+        self.stdout.write(
+            f'  {len(ways)} ways, {graph.node_count} nodes, {graph.edge_count} directed edges, '
+            f'{graph.nbytes / 1e6:.1f} MB in memory, {time.perf_counter() - started:.1f}s'
+        )
+        self.stdout.write(self.style.SUCCESS(f"✅ Road graph written to {options['out']}"))
+
+    def read_ways(self, path):
+        """``(node refs, speed km/h, oneway)`` per drivable way; oneway is 1, -1 (against the refs) or 0"""
+        ways = []
+        for _, element in ElementTree.iterparse(path):
+            if element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+                highway = tags.get('highway')
+                if highway in HIGHWAY_SPEEDS_KMH and tags.get('access') not in ('no', 'private'):
+                    refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+                    ways.append((refs, self.speed(tags, highway), self.oneway(tags, highway)))
+                element.clear()
+            elif element.tag in ('node', 'relation'):
+                element.clear()
+        return ways
+
+    def read_nodes(self, path, needed):
+        coordinates = {}
+        for _, element in ElementTree.iterparse(path):
+            if element.tag == 'node':
+                osm_id = int(element.get('id'))
+                if osm_id in needed:
+                    coordinates[osm_id] = (float(element.get('lat')), float(element.get('lon')))
+            if element.tag in ('node', 'way', 'relation'):
+                element.clear()
+        return coordinates
+
+    def speed(self, tags, highway):
+        match = MAXSPEED.match(tags.get('maxspeed', ''))
+        if match:
+            speed = float(match.group(1)) * (1.609 if match.group(2) else 1)
+            if speed > 0:
+                return speed
+        return HIGHWAY_SPEEDS_KMH[highway]
+
+    def oneway(self, tags, highway):
+        value = tags.get('oneway')
+        if value == '-1':
+            return -1
+        if value in ('yes', 'true', '1'):
+            return 1
+        if value is None and (highway == 'motorway' or tags.get('junction') == 'roundabout'):
+            return 1
+        return 0
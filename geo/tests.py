@@ -0,0 +1,94 @@
+from itertools import permutations
+
+from django.test import SimpleTestCase
+
+from .distance import haversine_km
+from .routing import GraphRouter, RoadGraph
+
+# Two parallel streets joined at both ends, a one-way link between them and
+# a node no road reaches:
+#
+#   0 --- 1 --- 2      top street, 30 km/h
+#   |     v     |      ends 60 km/h, 1 -> 4 one-way
+#   3 --- 4 --- 5      bottom street, 90 km/h
+#                  6
+NODES = [
+    (-26.20, 28.04), (-26.20, 28.05), (-26.20, 28.06),
+    (-26.21, 28.04), (-26.21, 28.05), (-26.21, 28.06),
+    (-26.25, 28.10),
+]
+TWO_WAY = [(0, 1, 30), (1, 2, 30), (3, 4, 90), (4, 5, 90), (0, 3, 60), (2, 5, 60)]
+ONE_WAY = [(1, 4, 60)]
+
+
+def road_graph():
+    edges = TWO_WAY + [(b, a, speed) for a, b, speed in TWO_WAY] + ONE_WAY
+    lats, lons = zip(*NODES)
+    return RoadGraph.from_edges(
+        lats, lons,
+        sources=[a for a, _, _ in edges],
+        targets=[b for _, b, _ in edges],
+        lengths_km=[haversine_km(*NODES[a], *NODES[b]) for a, b, _ in edges],
+        speeds_kmh=[speed for _, _, speed in edges],
+    )
+
+
+class RoadGraphTests(SimpleTestCase):
+
+    def setUp(self):
+        self.graph = road_graph()
+
+    def test_a_star_agrees_with_dijkstra(self):
+        for source, target in permutations(range(6), 2):
+            with self.subTest(source=source, target=target):
+                a_star = self.graph.shortest_path(source, target)
+                dijkstra = self.graph.shortest_path(source, target, heuristic=False)
+                self.assertAlmostEqual(a_star[0], dijkstra[0], places=4)
+                self.assertAlmostEqual(a_star[1], dijkstra[1], places=4)
+
+    def test_fastest_path_takes_the_longer_faster_street(self):
+        top_km = haversine_km(*NODES[0], *NODES[2])
+
+        km, minutes = self.graph.shortest_path(0, 2)
+
+        self.assertGreater(km, top_km)
+        self.assertLess(minutes, top_km / 30 * 60)
+
+    def test_one_way_edge_is_only_driven_one_way(self):
+        km, _ = self.graph.shortest_path(1, 4)
+        self.assertAlmostEqual(km, haversine_km(*NODES[1], *NODES[4]), places=4)
+
+        back_km, _ = self.graph.shortest_path(4, 1)
+        self.assertGreater(back_km, 2 * km)
+
+    def test_unreachable_target_has_no_path(self):
+        self.assertIsNone(self.graph.shortest_path(0, 6))
+        self.assertIsNone(self.graph.shortest_path(0, 6, heuristic=False))
+
+
+class GraphRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = GraphRouter(road_graph(), max_snap_km=0.5)
+
+    def test_route_follows_the_roads(self):
+        route = self.router.route(*NODES[0], *NODES[2])
+
+        self.assertAlmostEqual(route.distance_km, self.router.graph.shortest_path(0, 2)[0], places=4)
+        self.assertIsNotNone(route.minutes)
+
+    def test_point_too_far_to_snap_falls_back_to_a_straight_line(self):
+        far = (-26.30, 28.20)
+
+        route = self.router.route(*NODES[0], *far)
+
+        self.assertAlmostEqual(route.distance_km, haversine_km(*NODES[0], *far))
+        self.assertIsNone(route.minutes)
+        self.assertEqual(self.router.stats['off_graph'], 1)
+
+    def test_unreachable_point_falls_back_to_a_straight_line(self):
+        route = self.router.route(*NODES[0], *NODES[6])
+
+        self.assertAlmostEqual(route.distance_km, haversine_km(*NODES[0], *NODES[6]))
+        self.assertIsNone(route.minutes)
+        self.assertEqual(self.router.stats['unreachable'], 1)
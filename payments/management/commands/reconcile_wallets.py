@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.services import WalletService
+
+
+class Command(BaseCommand):
+    help = 'Check every wallet balance against the sum of its ledger entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep reconciling, reporting problems as they appear')
+        parser.add_argument('--interval', type=float, default=3600.0, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                clean = self.reconcile()
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            return
+
+        if not clean:
+            # Non-zero exit so cron and monitoring notice
+            raise CommandError('Wallet ledger does not reconcile')
+        self.stdout.write(self.style.SUCCESS('✅ All wallets reconcile with the ledger'))
+
+    def reconcile(self):
+        started = time.perf_counter()
+        report = WalletService.reconcile()
+        self.stdout.write(f'🧾 Reconciled wallets in {time.perf_counter() - started:.2f}s')
+
+        for wallet_id, (balance, total) in sorted(report['drifted'].items()):
+            self.stdout.write(self.style.ERROR(
+                f'  wallet {wallet_id}: balance R{balance}, ledger R{total} (off by R{balance - total})'
+            ))
+        if report['unbalanced']:
+            self.stdout.write(self.style.ERROR(
+                f"  transactions whose entries do not sum to zero: {report['unbalanced']}"
+            ))
+        if report['unposted']:
+            self.stdout.write(self.style.ERROR(
+                f"  completed transactions without ledger entries: {report['unposted']}"
+            ))
+        return not any(report.values())
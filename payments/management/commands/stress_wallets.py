@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from payments.models import Wallet, WalletTransaction
+from payments.services import WalletService
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Fire concurrent top-up verifications and payments at wallets and check the ledger still reconciles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wallets', type=int, default=20)
+        parser.add_argument('--topups', type=int, default=10, help='Pending top-ups per wallet')
+        parser.add_argument('--repeats', type=int, default=5, help='Simultaneous verifications of each top-up')
+        parser.add_argument('--operations', type=int, default=2000, help='Credits and debits in the mixed scenario')
+        parser.add_argument('--threads', type=int, default=32)
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        run = random.randint(100000, 999999)
+        rng = random.Random(run)
+
+        self.stdout.write(f'🏁 Wallet stress run {run}')
+        users = User.objects.bulk_create([
+            User(username=f'stress_{run}_wallet{i}', phone_number=f'7{run}{i:04d}') for i in range(options['wallets'])
+        ])
+        try:
+            wallets = Wallet.objects.bulk_create([Wallet(user=user) for user in users])
+            expected = {wallet.id: Decimal('0.00') for wallet in wallets}
+
+            # Scenario 1: every top-up is verified several times at once
+            topups = []
+            for wallet in wallets:
+                for i in range(options['topups']):
+                    amount = Decimal(rng.randint(100, 50000)) / 100
+                    topups.append(WalletTransaction(
+                        wallet=wallet,
+                        transaction_type='topup',
+                        amount=amount,
+                        reference=f'stress_{run}_topup_{wallet.id}_{i}',
+                    ))
+            WalletTransaction.objects.bulk_create(topups)
+            calls = [(WalletService.complete, (topup.reference,)) for topup in topups] * options['repeats']
+            rng.shuffle(calls)
+            results = self.fire(threads, calls)
+            completed = Counter(args[0] for args, result in results if result == WalletService.COMPLETED)
+            if any(count != 1 for count in completed.values()) or len(completed) != len(topups):
+                raise CommandError('A top-up was credited more or less than once')
+            for topup in topups:
+                expected[topup.wallet_id] += topup.amount
+            self.check_wallets(expected, 'duplicate verification')
+
+            # Scenario 2: payments and refunds race on the same wallets, some
+            # payments bigger than the balance
+            calls = []
+            for i in range(options['operations']):
+                wallet = rng.choice(wallets)
+                transaction_type = rng.choice(('payment', 'payment', 'refund'))
+                amount = Decimal(rng.randint(100, 200000)) / 100
+                calls.append((WalletService.post, (wallet, transaction_type, amount, f'stress_{run}_op_{i}')))
+            results = self.fire(threads, calls)
+            for (wallet, transaction_type, amount, _), result in results:
+                if result == WalletService.COMPLETED:
+                    expected[wallet.id] += amount * WalletTransaction.SIGNS[transaction_type]
+            self.check_wallets(expected, 'payments and refunds')
+
+            report = WalletService.reconcile()
+            ids = set(expected)
+            if any(wallet_id in ids for wallet_id in report['drifted']) or report['unbalanced']:
+                raise CommandError(f'Ledger does not reconcile: {report}')
+            self.stdout.write('  ledger reconciles with every balance')
+        finally:
+            # Wallets, transactions and ledger entries cascade with their users
+            User.objects.filter(username__startswith=f'stress_{run}_').delete()
+
+        self.stdout.write(self.style.SUCCESS('✅ All wallet invariants held'))
+
+    def fire(self, threads, calls):
+        """Run every call in parallel, all released at the same moment"""
+        go = threading.Event()
+
+        def call(entry):
+            func, args = entry
+            try:
+                go.wait()
+                return args, func(*args)
+            except Exception as e:
+                return args, f'error: {e}'
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = [pool.submit(call, entry) for entry in calls]
+            start = time.perf_counter()
+            go.set()
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+
+        outcomes = Counter(result for _, result in results)
+        self.stdout.write(f'  {len(calls)} calls in {elapsed:.2f}s ({len(calls) / elapsed:.0f}/s): {dict(outcomes)}')
+        return results
+
+    def check_wallets(self, expected, scenario):
+        balances = dict(Wallet.objects.filter(id__in=expected).values_list('id', 'balance'))
+        if any(balance < 0 for balance in balances.values()):
+            raise CommandError(f'{scenario}: a wallet went negative')
+        wrong = {wallet_id: (balance, expected[wallet_id])
+                 for wallet_id, balance in balances.items() if balance != expected[wallet_id]}
+        if wrong:
+            raise CommandError(f'{scenario}: {len(wrong)} balances lost updates, e.g. {next(iter(wrong.items()))}')
+        self.stdout.write(f'  {scenario}: {len(balances)} balances exact')
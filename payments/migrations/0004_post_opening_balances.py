@@ -0,0 +1,74 @@
+from decimal import Decimal
+
+from django.db import migrations
+
+SIGNS = {'topup': 1, 'refund': 1, 'adjustment': 1, 'payment': -1, 'withdrawal': -1}
+COUNTERPARTS = {
+    'topup': 'paystack',
+    'payment': 'fares',
+    'refund': 'fares',
+    'withdrawal': 'payouts',
+    'adjustment': 'adjustments',
+}
+
+
+def post_opening_balances(apps, schema_editor):
+    """
+    Post ledger entries for the transactions completed before the ledger
+    existed, and an opening adjustment for whatever part of each balance
+    they do not explain, so the first reconciliation starts clean.
+    """
+    Wallet = apps.get_model('payments', 'Wallet')
+    WalletTransaction = apps.get_model('payments', 'WalletTransaction')
+    LedgerEntry = apps.get_model('payments', 'LedgerEntry')
+
+    for wallet in Wallet.objects.all().iterator():
+        entries = []
+        posted = Decimal('0.00')
+        for wallet_transaction in WalletTransaction.objects.filter(wallet=wallet, status='completed'):
+            delta = wallet_transaction.amount * SIGNS[wallet_transaction.transaction_type]
+            posted += delta
+            entries += [
+                LedgerEntry(transaction=wallet_transaction, wallet=wallet, account='wallet', amount=delta),
+                LedgerEntry(
+                    transaction=wallet_transaction,
+                    account=COUNTERPARTS[wallet_transaction.transaction_type],
+                    amount=-delta
+                ),
+            ]
+
+        # Adjustments are credits, so a wallet holding less than its history
+        # explains is left for the reconciler to report
+        residual = wallet.balance - posted
+        if residual > 0:
+            opening = WalletTransaction.objects.create(
+                wallet=wallet,
+                transaction_type='adjustment',
+                amount=residual,
+                status='completed',
+                reference=f'opening_balance_{wallet.pk}',
+                description='Balance held before the wallet ledger',
+            )
+            entries += [
+                LedgerEntry(transaction=opening, wallet=wallet, account='wallet', amount=residual),
+                LedgerEntry(transaction=opening, account='adjustments', amount=-residual),
+            ]
+        LedgerEntry.objects.bulk_create(entries)
+
+
+def remove_opening_balances(apps, schema_editor):
+    WalletTransaction = apps.get_model('payments', 'WalletTransaction')
+    LedgerEntry = apps.get_model('payments', 'LedgerEntry')
+
+    LedgerEntry.objects.all().delete()
+    WalletTransaction.objects.filter(reference__startswith='opening_balance_').delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payments", "0003_ledger_entries"),
+    ]
+
+    operations = [
+        migrations.RunPython(post_opening_balances, remove_opening_balances),
+    ]
@@ -46,21 +46,44 @@ class Wallet(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.CheckConstraint(condition=models.Q(balance__gte=0), name='wallet_balance_non_negative'),
+        ]
+
     def __str__(self):
         return f"{self.user.phone_number}'s Wallet - R{self.balance}"
 
-    def credit(self, amount):
-        """Add money to wallet"""
-        self.balance += Decimal(str(amount))
-        self.save()
-
-    def debit(self, amount):
-        """Deduct money from wallet"""
-        if self.balance >= Decimal(str(amount)):
-            self.balance -= Decimal(str(amount))
-            self.save()
-            return True
-        return False
+    def credit(self, amount, reference, transaction_type='refund', description=''):
+        """
+        Add money to wallet through the ledger. Repeating a call with the
+        same reference credits once. Returns a WalletService result.
+
+        Raises:
+            ValueError: ``transaction_type`` takes money out of the wallet
+        """
+        from .services import WalletService
+        if WalletTransaction.SIGNS.get(transaction_type) != 1:
+            raise ValueError(f'{transaction_type} is not a credit')
+        result = WalletService.post(self, transaction_type, amount, reference, description)
+        self.refresh_from_db(fields=['balance', 'updated_at'])
+        return result
+
+    def debit(self, amount, reference, transaction_type='payment', description=''):
+        """
+        Deduct money from wallet through the ledger, never below zero.
+        Repeating a call with the same reference debits once. Returns a
+        WalletService result.
+
+        Raises:
+            ValueError: ``transaction_type`` adds money to the wallet
+        """
+        from .services import WalletService
+        if WalletTransaction.SIGNS.get(transaction_type) != -1:
+            raise ValueError(f'{transaction_type} is not a debit')
+        result = WalletService.post(self, transaction_type, amount, reference, description)
+        self.refresh_from_db(fields=['balance', 'updated_at'])
+        return result
 
 
 class WalletTransaction(models.Model):
@@ -70,8 +93,20 @@ class WalletTransaction(models.Model):
         ('payment', 'Payment'),
         ('refund', 'Refund'),
         ('withdrawal', 'Withdrawal'),
+        ('adjustment', 'Adjustment'),
     )
 
+    # Direction of each type on the wallet, and the ledger account on the
+    # other side of the entry
+    SIGNS = {'topup': 1, 'refund': 1, 'adjustment': 1, 'payment': -1, 'withdrawal': -1}
+    COUNTERPARTS = {
+        'topup': 'paystack',
+        'payment': 'fares',
+        'refund': 'fares',
+        'withdrawal': 'payouts',
+        'adjustment': 'adjustments',
+    }
+
     STATUS_CHOICES = (
         ('pending', 'Pending'),
         ('completed', 'Completed'),
@@ -98,3 +133,48 @@ class WalletTransaction(models.Model):
 
     def __str__(self):
         return f"{self.transaction_type} - R{self.amount} ({self.status})"
+
+    @property
+    def signed_amount(self):
+        """Change to the wallet balance once the transaction completes"""
+        return self.amount * self.SIGNS[self.transaction_type]
+
+
+class LedgerEntry(models.Model):
+    """
+    One side of a completed wallet transaction. Every transaction posts a
+    wallet entry and a counterpart entry that sum to zero, and a wallet's
+    balance is the sum of its wallet entries.
+    """
+    ACCOUNTS = (
+        ('wallet', 'Wallet'),
+        ('paystack', 'Paystack'),
+        ('fares', 'Fares'),
+        ('payouts', 'Payouts'),
+        ('adjustments', 'Adjustments'),
+    )
+
+    transaction = models.ForeignKey(
+        WalletTransaction,
+        on_delete=models.CASCADE,
+        related_name='entries'
+    )
+    wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.CASCADE,
+        related_name='ledger_entries',
+        null=True,
+        blank=True
+    )
+    account = models.CharField(max_length=20, choices=ACCOUNTS)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)  # Signed, credit positive
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['wallet', 'account']),
+        ]
+
+    def __str__(self):
+        return f"{self.account} {self.amount:+} ({self.transaction.reference})"
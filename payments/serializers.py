@@ -38,7 +38,7 @@ class WalletSerializer(serializers.ModelSerializer):
             'created_at',
             'updated_at'
         ]
-        read_only_fields = ['id', 'user', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'user', 'balance', 'created_at', 'updated_at']
 
 
 class WalletTransactionSerializer(serializers.ModelSerializer):
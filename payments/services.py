@@ -0,0 +1,169 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import LedgerEntry, Wallet, WalletTransaction
+
+CENT = Decimal('0.01')
+
+
+class WalletService:
+    """Race-free wallet balance changes, recorded in a double-entry ledger"""
+
+    COMPLETED = 'completed'
+    ALREADY_COMPLETED = 'already_completed'
+    FAILED = 'failed'
+    INSUFFICIENT_FUNDS = 'insufficient_funds'
+    UNAVAILABLE = 'unavailable'
+
+    @staticmethod
+    def complete(reference, metadata=None):
+        """
+        Complete a pending wallet transaction.
+
+        The transaction is claimed with a conditional UPDATE on its status,
+        so of any number of concurrent calls for the same reference exactly
+        one moves the money.  The balance changes with a single ``UPDATE ...
+        SET balance = balance + amount``, guarded by ``balance >= amount``
+        for money leaving the wallet, and the two ledger entries are written
+        in the same database transaction.  A debit the wallet cannot cover
+        leaves the transaction failed and the balance untouched.  A failed
+        transaction is final: completing it again changes nothing, so a
+        retried debit cannot go through later under the same reference.
+
+        Args:
+            reference: WalletTransaction reference
+            metadata: Merged into the transaction's metadata on completion
+
+        Returns:
+            str: COMPLETED, ALREADY_COMPLETED, FAILED, INSUFFICIENT_FUNDS or
+            UNAVAILABLE
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            claimed = WalletTransaction.objects.filter(
+                reference=reference,
+                status='pending'
+            ).update(status='completed', updated_at=now)
+            if not claimed:
+                current = WalletTransaction.objects.filter(reference=reference).values_list(
+                    'status', flat=True
+                ).first()
+                if current == 'completed':
+                    return WalletService.ALREADY_COMPLETED
+                if current == 'failed':
+                    return WalletService.FAILED
+                return WalletService.UNAVAILABLE
+
+            # Our update holds the row lock, so this read cannot race
+            wallet_transaction = WalletTransaction.objects.get(reference=reference)
+            delta = wallet_transaction.signed_amount
+
+            wallets = Wallet.objects.filter(pk=wallet_transaction.wallet_id)
+            if delta < 0:
+                wallets = wallets.filter(balance__gte=-delta)
+            if not wallets.update(balance=F('balance') + delta, updated_at=now):
+                transaction.set_rollback(True)
+                insufficient = True
+            else:
+                insufficient = False
+                LedgerEntry.objects.bulk_create([
+                    LedgerEntry(
+                        transaction=wallet_transaction,
+                        wallet_id=wallet_transaction.wallet_id,
+                        account='wallet',
+                        amount=delta
+                    ),
+                    LedgerEntry(
+                        transaction=wallet_transaction,
+                        account=WalletTransaction.COUNTERPARTS[wallet_transaction.transaction_type],
+                        amount=-delta
+                    ),
+                ])
+                if metadata:
+                    wallet_transaction.metadata = {**(wallet_transaction.metadata or {}), **metadata}
+                    wallet_transaction.save(update_fields=['metadata'])
+
+        if insufficient:
+            WalletService.fail(reference)
+            return WalletService.INSUFFICIENT_FUNDS
+        return WalletService.COMPLETED
+
+    @staticmethod
+    def fail(reference):
+        """Mark a pending transaction failed; never touches a completed one"""
+        return bool(WalletTransaction.objects.filter(reference=reference, status='pending').update(
+            status='failed',
+            updated_at=timezone.now()
+        ))
+
+    @staticmethod
+    def post(wallet, transaction_type, amount, reference, description='', metadata=None):
+        """
+        Record and complete a wallet transaction in one step, idempotently:
+        the reference identifies the transaction, so a retried call completes
+        it at most once, and a retry after INSUFFICIENT_FUNDS returns FAILED.
+
+        Raises:
+            ValueError: the amount is not positive, or the reference belongs
+                to a different transaction
+        """
+        amount = Decimal(str(amount))
+        if amount <= 0:
+            raise ValueError('Amount must be positive')
+
+        wallet_transaction, created = WalletTransaction.objects.get_or_create(
+            reference=reference,
+            defaults={
+                'wallet': wallet,
+                'transaction_type': transaction_type,
+                'amount': amount,
+                'status': 'pending',
+                'description': description,
+                'metadata': metadata,
+            }
+        )
+        if not created and (
+            wallet_transaction.wallet_id != wallet.pk
+            or wallet_transaction.transaction_type != transaction_type
+            or wallet_transaction.amount != amount
+        ):
+            raise ValueError(f'Reference {reference} is already used by a different transaction')
+        return WalletService.complete(reference)
+
+    @staticmethod
+    def reconcile():
+        """
+        Check the ledger against the balances.
+
+        Returns:
+            dict: ``drifted`` maps wallet ids to (balance, ledger total) where
+            they differ, ``unbalanced`` lists transactions whose entries do
+            not sum to zero and ``unposted`` completed transactions without
+            entries
+        """
+        totals = dict(
+            LedgerEntry.objects.filter(account='wallet')
+            .values('wallet_id')
+            .annotate(total=Sum('amount'))
+            .values_list('wallet_id', 'total')
+        )
+        drifted = {}
+        # Compared in Python, to the cent: sqlite sums decimals as floats
+        for wallet_id, balance in Wallet.objects.values_list('id', 'balance').iterator():
+            total = Decimal(totals.get(wallet_id) or 0).quantize(CENT)
+            if balance != total:
+                drifted[wallet_id] = (balance, total)
+
+        unbalanced = [
+            transaction_id for transaction_id, total in
+            LedgerEntry.objects.values('transaction_id').annotate(total=Sum('amount'))
+            .values_list('transaction_id', 'total')
+            if Decimal(total).quantize(CENT) != 0
+        ]
+        unposted = list(
+            WalletTransaction.objects.filter(status='completed', entries__isnull=True).values_list('id', flat=True)
+        )
+        return {'drifted': drifted, 'unbalanced': unbalanced, 'unposted': unposted}
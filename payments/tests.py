@@ -1,3 +1,225 @@
-from django.test import TestCase
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+
+from .models import LedgerEntry, Wallet, WalletTransaction
+from .services import WalletService
+
+User = get_user_model()
+
+
+def ledger_balance(wallet):
+    """Sum of the wallet's ledger entries, to the cent"""
+    total = LedgerEntry.objects.filter(wallet=wallet, account='wallet').aggregate(total=Sum('amount'))['total']
+    return Decimal(total or 0).quantize(Decimal('0.01'))
+
+
+class WalletServiceTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(username='passenger', phone_number='+27820000001')
+        self.wallet = Wallet.objects.create(user=user)
+
+    def post(self, transaction_type, amount, reference):
+        return WalletService.post(self.wallet, transaction_type, Decimal(amount), reference)
+
+    def test_repeated_reference_posts_once(self):
+        self.assertEqual(self.post('topup', '100.00', 'topup-1'), WalletService.COMPLETED)
+        self.assertEqual(self.post('topup', '100.00', 'topup-1'), WalletService.ALREADY_COMPLETED)
+        self.assertEqual(WalletService.complete('topup-1'), WalletService.ALREADY_COMPLETED)
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('100.00'))
+        self.assertEqual(WalletTransaction.objects.filter(reference='topup-1').count(), 1)
+        self.assertEqual(LedgerEntry.objects.filter(transaction__reference='topup-1').count(), 2)
+
+    def test_reference_of_a_different_transaction_is_refused(self):
+        self.post('topup', '100.00', 'topup-1')
+
+        with self.assertRaises(ValueError):
+            self.post('topup', '50.00', 'topup-1')
+        with self.assertRaises(ValueError):
+            self.post('payment', '100.00', 'topup-1')
+
+    def test_debit_beyond_the_balance_fails_and_stays_failed(self):
+        self.post('topup', '20.00', 'topup-1')
+
+        self.assertEqual(self.post('payment', '50.00', 'ride-1'), WalletService.INSUFFICIENT_FUNDS)
+        self.assertEqual(WalletTransaction.objects.get(reference='ride-1').status, 'failed')
+
+        # Enough money now, but the failed payment does not go through after all
+        self.post('topup', '100.00', 'topup-2')
+        self.assertEqual(self.post('payment', '50.00', 'ride-1'), WalletService.FAILED)
+        self.assertEqual(WalletService.complete('ride-1'), WalletService.FAILED)
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('120.00'))
+        self.assertEqual(WalletTransaction.objects.get(reference='ride-1').status, 'failed')
+        self.assertFalse(LedgerEntry.objects.filter(transaction__reference='ride-1').exists())
+
+    def test_credit_and_debit_refuse_the_wrong_direction(self):
+        self.assertEqual(self.wallet.credit(Decimal('30.00'), 'refund-1'), WalletService.COMPLETED)
+        self.assertEqual(self.wallet.debit(Decimal('10.00'), 'ride-1'), WalletService.COMPLETED)
+
+        with self.assertRaises(ValueError):
+            self.wallet.debit(Decimal('10.00'), 'refund-2', transaction_type='refund')
+        with self.assertRaises(ValueError):
+            self.wallet.credit(Decimal('10.00'), 'ride-2', transaction_type='payment')
+        self.assertEqual(self.wallet.balance, Decimal('20.00'))
+        self.assertFalse(WalletTransaction.objects.filter(reference__in=['refund-2', 'ride-2']).exists())
+
+    def test_unknown_reference_is_unavailable(self):
+        self.assertEqual(WalletService.complete('missing'), WalletService.UNAVAILABLE)
+
+    def test_reconcile_is_clean_after_posting(self):
+        self.post('topup', '100.00', 'topup-1')
+        self.post('payment', '35.50', 'ride-1')
+
+        self.assertEqual(WalletService.reconcile(), {'drifted': {}, 'unbalanced': [], 'unposted': []})
+
+    def test_reconcile_detects_drift(self):
+        self.post('topup', '100.00', 'topup-1')
+        # A balance changed behind the ledger's back
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=Decimal('150.00'))
+
+        report = WalletService.reconcile()
+
+        self.assertEqual(report['drifted'], {self.wallet.pk: (Decimal('150.00'), Decimal('100.00'))})
+
+    def test_reconcile_detects_unbalanced_and_unposted_transactions(self):
+        self.post('topup', '100.00', 'topup-1')
+        topup = WalletTransaction.objects.get(reference='topup-1')
+        LedgerEntry.objects.filter(transaction=topup, account='paystack').delete()
+        unposted = WalletTransaction.objects.create(
+            wallet=self.wallet, transaction_type='refund', amount=Decimal('10.00'),
+            reference='refund-1', status='completed'
+        )
+
+        report = WalletService.reconcile()
+
+        self.assertEqual(report['unbalanced'], [topup.pk])
+        self.assertEqual(report['unposted'], [unposted.pk])
+
+
+def paystack_response(status_code=200, transaction_status=None):
+    response = mock.Mock(status_code=status_code)
+    if transaction_status is None:
+        response.json.return_value = {'status': False, 'message': 'Service unavailable'}
+    else:
+        response.json.return_value = {'status': True, 'data': {'status': transaction_status}}
+    return response
+
+
+class VerifyTopupTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='passenger', phone_number='+27820000001')
+        self.wallet = Wallet.objects.create(user=self.user)
+        WalletTransaction.objects.create(
+            wallet=self.wallet, transaction_type='topup', amount=Decimal('80.00'), reference='topup-1'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def verify(self, *paystack_responses):
+        with mock.patch('payments.views.requests.get', side_effect=paystack_responses):
+            return self.client.post('/api/payments/wallet/verify_topup/', {'reference': 'topup-1'}, format='json')
+
+    def assert_credited(self, amount):
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal(amount))
+
+    def test_payment_in_progress_is_credited_once_it_succeeds(self):
+        response = self.verify(paystack_response(transaction_status='ongoing'))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(WalletTransaction.objects.get(reference='topup-1').status, 'pending')
+
+        response = self.verify(paystack_response(transaction_status='success'))
+        self.assertEqual(response.status_code, 200)
+        self.assert_credited('80.00')
+
+    def test_paystack_errors_leave_the_top_up_pending(self):
+        self.assertEqual(self.verify(paystack_response(status_code=503)).status_code, 502)
+        self.assertEqual(self.verify(requests.exceptions.ConnectionError('down')).status_code, 503)
+        self.assertEqual(WalletTransaction.objects.get(reference='topup-1').status, 'pending')
+
+        self.verify(paystack_response(transaction_status='success'))
+        self.assert_credited('80.00')
+
+    def test_failed_payment_fails_the_top_up(self):
+        response = self.verify(paystack_response(transaction_status='failed'))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(WalletTransaction.objects.get(reference='topup-1').status, 'failed')
+        self.assert_credited('0.00')
+
+
+class ConcurrentWalletTests(TransactionTestCase):
+    """Many credits, debits and retried references hitting one wallet at once"""
+
+    OPERATIONS = 100
+
+    def setUp(self):
+        user = User.objects.create(username='passenger', phone_number='+27820000001')
+        self.wallet = Wallet.objects.create(user=user)
+        WalletService.post(self.wallet, 'topup', Decimal('100.00'), 'opening')
+
+    def post_all(self, calls):
+        go = threading.Event()
+
+        def post(transaction_type, amount, reference):
+            go.wait()
+            try:
+                while True:
+                    try:
+                        return reference, WalletService.post(self.wallet, transaction_type, amount, reference)
+                    except OperationalError:
+                        # The in-memory test database refuses concurrent writers
+                        # instead of queueing them; the reference makes the retry safe
+                        time.sleep(0.001)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            futures = [pool.submit(post, *call) for call in calls]
+            go.set()
+            return [future.result() for future in futures]
+
+    def test_balance_matches_the_ledger(self):
+        rng = random.Random(1)
+        operations = [
+            (rng.choice(['topup', 'payment']), Decimal(rng.randint(100, 5000)) / 100, f'op-{i}')
+            for i in range(self.OPERATIONS)
+        ]
+        # Every operation is sent twice, like a client retrying a timed out request
+        calls = operations * 2
+        rng.shuffle(calls)
+
+        results = self.post_all(calls)
+
+        outcomes = Counter(result for _, result in results)
+        self.assertEqual(outcomes[WalletService.UNAVAILABLE], 0)
+        completed = Counter(reference for reference, result in results if result == WalletService.COMPLETED)
+        self.assertTrue(all(count == 1 for count in completed.values()))
+
+        expected = Decimal('100.00') + sum(
+            amount if transaction_type == 'topup' else -amount
+            for transaction_type, amount, reference in operations
+            if reference in completed
+        )
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, expected)
+        self.assertEqual(ledger_balance(self.wallet), self.wallet.balance)
+        self.assertGreaterEqual(self.wallet.balance, 0)
+        self.assertEqual(WalletService.reconcile(), {'drifted': {}, 'unbalanced': [], 'unposted': []})
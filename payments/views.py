@@ -2,13 +2,16 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.conf import settings
-from django.db import transaction
 import requests
 import json
 import uuid
 
 from .models import PaymentMethod, Wallet, WalletTransaction
 from .serializers import PaymentMethodSerializer, WalletSerializer, WalletTransactionSerializer
+from .services import WalletService
+
+# Paystack transaction statuses after which the payment can no longer succeed
+PAYSTACK_FAILED_STATUSES = ('failed', 'reversed')
 
 
 class PaymentMethodViewSet(viewsets.ModelViewSet):
@@ -234,8 +237,7 @@ class WalletViewSet(viewsets.ModelViewSet):
                 })
             else:
                 # Mark transaction as failed
-                wallet_transaction.status = 'failed'
-                wallet_transaction.save()
+                WalletService.fail(reference)
                 return Response({
                     'error': 'Failed to initialize payment',
                     'details': response_data
@@ -277,47 +279,59 @@ class WalletViewSet(viewsets.ModelViewSet):
                 'Authorization': f'Bearer {settings.PAYSTACK_SECRET_KEY}',
             }
 
-            response = requests.get(url, headers=headers)
-            response_data = response.json()
+            # Only a final answer from Paystack fails the transaction; anything
+            # else leaves it pending so verifying again can still credit it
+            try:
+                response = requests.get(url, headers=headers, timeout=30)
+                response_data = response.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                return Response({
+                    'error': 'Could not reach Paystack, try verifying again',
+                    'details': str(e)
+                }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
             if response.status_code == 200 and response_data.get('status'):
                 data = response_data['data']
 
                 if data.get('status') == 'success':
-                    # Use atomic transaction to ensure consistency
-                    with transaction.atomic():
-                        # Credit wallet
-                        wallet = wallet_transaction.wallet
-                        wallet.credit(wallet_transaction.amount)
-
-                        # Update transaction status
-                        wallet_transaction.status = 'completed'
-                        wallet_transaction.metadata = {
-                            **wallet_transaction.metadata,
-                            'paystack_response': data
-                        }
-                        wallet_transaction.save()
+                    # Paystack may be asked twice at once; the wallet is credited exactly once
+                    result = WalletService.complete(reference, metadata={'paystack_response': data})
+                    wallet_transaction.refresh_from_db()
+
+                    if result == WalletService.ALREADY_COMPLETED:
+                        return Response({
+                            'message': 'Transaction already completed',
+                            'transaction': WalletTransactionSerializer(wallet_transaction).data
+                        })
+                    if result != WalletService.COMPLETED:
+                        return Response({
+                            'error': 'Transaction can no longer be completed',
+                            'status': wallet_transaction.status
+                        }, status=status.HTTP_400_BAD_REQUEST)
 
                     return Response({
                         'message': 'Wallet topped up successfully',
                         'transaction': WalletTransactionSerializer(wallet_transaction).data,
-                        'wallet': WalletSerializer(wallet).data
+                        'wallet': WalletSerializer(wallet_transaction.wallet).data
                     })
-                else:
+                elif data.get('status') in PAYSTACK_FAILED_STATUSES:
                     # Mark as failed
-                    wallet_transaction.status = 'failed'
-                    wallet_transaction.save()
+                    WalletService.fail(reference)
                     return Response({
                         'error': 'Transaction was not successful',
                         'status': data.get('status')
                     }, status=status.HTTP_400_BAD_REQUEST)
+                else:
+                    # ongoing, pending, abandoned...: the customer may still pay
+                    return Response({
+                        'message': 'Payment is not complete yet',
+                        'status': data.get('status')
+                    }, status=status.HTTP_202_ACCEPTED)
             else:
-                wallet_transaction.status = 'failed'
-                wallet_transaction.save()
                 return Response({
                     'error': 'Failed to verify payment',
                     'details': response_data
-                }, status=status.HTTP_400_BAD_REQUEST)
+                }, status=status.HTTP_502_BAD_GATEWAY if response.status_code >= 500 else status.HTTP_400_BAD_REQUEST)
 
         except Exception as e:
             return Response({
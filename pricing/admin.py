@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import VehicleType, PeakHour, SurgeMultiplier, DistanceTier, PromoCode
+from .models import VehicleType, PeakHour, SurgeMultiplier, DistanceTier, PromoCode, PromoRedemption
 
 
 @admin.register(VehicleType)
@@ -96,10 +96,11 @@ class SurgeMultiplierAdmin(admin.ModelAdmin):
         'multiplier',
         'start_time',
         'end_time',
-        'is_active'
+        'is_active',
+        'is_automatic'
     ]
 
-    list_filter = ['is_active', 'multiplier']
+    list_filter = ['is_active', 'is_automatic', 'multiplier']
     search_fields = ['name', 'area_name']
 
     ordering = ['-created_at']
@@ -117,7 +118,7 @@ class SurgeMultiplierAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Status', {
-            'fields': ('is_active',)
+            'fields': ('is_active', 'is_automatic')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -125,7 +126,7 @@ class SurgeMultiplierAdmin(admin.ModelAdmin):
         }),
     )
 
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['is_automatic', 'created_at', 'updated_at']
 
 
 @admin.register(DistanceTier)
@@ -180,7 +181,7 @@ class PromoCodeAdmin(admin.ModelAdmin):
             'fields': ('discount_type', 'discount_value', 'max_discount', 'min_fare')
         }),
         ('Usage Limits', {
-            'fields': ('max_uses', 'uses_count')
+            'fields': ('max_uses', 'max_uses_per_user', 'uses_count')
         }),
         ('Validity Period', {
             'fields': ('valid_from', 'valid_until')
@@ -198,8 +199,29 @@ class PromoCodeAdmin(admin.ModelAdmin):
 
     def save_model(self, request, obj, form, change):
         """Prevent manual modification of uses_count"""
-        if change and 'uses_count' in form.changed_data:
-            # Revert uses_count to original value
-            original = PromoCode.objects.get(pk=obj.pk)
-            obj.uses_count = original.uses_count
-        super().save_model(request, obj, form, change)
+        if change:
+            # Leave uses_count out of the UPDATE, so redemptions made while
+            # the form was open are not overwritten
+            obj.save(update_fields=[
+                field.name for field in obj._meta.concrete_fields
+                if not field.primary_key and field.name != 'uses_count'
+            ])
+        else:
+            super().save_model(request, obj, form, change)
+
+
+@admin.register(PromoRedemption)
+class PromoRedemptionAdmin(admin.ModelAdmin):
+    """Read-only ledger of promo code uses"""
+
+    list_display = ['promo_code', 'user', 'booking', 'redeemed_at', 'released_at']
+    list_filter = ['redeemed_at', 'released_at']
+    search_fields = ['promo_code__code', 'user__username', 'user__phone_number']
+    list_select_related = ['promo_code', 'user']
+    raw_id_fields = ['promo_code', 'user', 'booking']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
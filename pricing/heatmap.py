@@ -0,0 +1,285 @@
+"""
+Live demand/supply heatmap and automatic surge zones.
+
+Ride requests and available drivers' location updates are counted per grid
+cell (``SURGE_HEATMAP_CELL_DEGREES``).  Each cell has a ring buffer of
+``SURGE_HEATMAP_SLOTS`` slots, each ``SURGE_HEATMAP_SLOT_SECONDS`` long.
+Recording an event touches one slot of one cell.  A slot is reset lazily,
+the first time it is written in a new period, so nothing ever sweeps the
+buffers and each event costs O(1) however busy the city.  Supply counts
+every driver once per slot, however often they report.
+
+Every ``SURGE_EVALUATE_INTERVAL`` seconds each cell's pressure is turned
+into a surge level.  Pressure is requests in the window over the average
+number of available drivers.  Hysteresis keeps zones from flapping:
+
+* a cell starts surging at ``SURGE_PRESSURE_ON`` and stops only below
+  ``SURGE_PRESSURE_OFF``;
+* a multiplier steps down only once pressure is half a step clear of it.
+
+Surging cells are materialised as ``SurgeMultiplier`` rows flagged
+``is_automatic``, bounded to the cell.  Each row ends ``SURGE_ZONE_TTL``
+seconds ahead, and the end is pushed forward while the surge lasts, so zones
+left behind by a stopped process lapse on their own.
+
+The counters only see this process's sockets.  Automatic surge is therefore
+on by default only with the single-worker in-memory channel layer.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+class _CellCounts:
+    __slots__ = ('periods', 'requests', 'drivers')
+
+    def __init__(self, slots):
+        self.periods = [-1] * slots     # period each slot was last written in
+        self.requests = [0] * slots
+        self.drivers = [0] * slots
+
+
+class DemandHeatmap:
+    """Sliding-window request and driver counts per grid cell"""
+
+    def __init__(self, cell_size_deg=0.01, slot_seconds=30, slots=10):
+        self.cell_size_deg = cell_size_deg
+        self.slot_seconds = slot_seconds
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._cells = {}            # (row, col) -> _CellCounts
+        self._driver_slot = {}      # driver id -> (cell, period) they were last counted in
+        self._levels = {}           # (row, col) -> surge level, 0 when not surging
+        self._task = None
+        self.stats = {'requests': 0, 'driver_updates': 0, 'evaluations': 0, 'zones_written': 0}
+
+    # Recording
+
+    def cell_for(self, lat, lon):
+        return (math.floor(float(lat) / self.cell_size_deg), math.floor(float(lon) / self.cell_size_deg))
+
+    def _slot(self, cell, period):
+        counts = self._cells.get(cell)
+        if counts is None:
+            counts = self._cells[cell] = _CellCounts(self.slots)
+        slot = period % self.slots
+        if counts.periods[slot] != period:
+            counts.periods[slot] = period
+            counts.requests[slot] = 0
+            counts.drivers[slot] = 0
+        return counts, slot
+
+    def record_request(self, lat, lon, now=None):
+        """A passenger asked for a ride from here"""
+        period = int((time.time() if now is None else now) // self.slot_seconds)
+        cell = self.cell_for(lat, lon)
+        with self._lock:
+            counts, slot = self._slot(cell, period)
+            counts.requests[slot] += 1
+            self.stats['requests'] += 1
+
+    def record_driver(self, driver_id, lat, lon, now=None):
+        """An available driver reported a position"""
+        period = int((time.time() if now is None else now) // self.slot_seconds)
+        cell = self.cell_for(lat, lon)
+        with self._lock:
+            self.stats['driver_updates'] += 1
+            if self._driver_slot.get(driver_id) == (cell, period):
+                return
+            self._driver_slot[driver_id] = (cell, period)
+            counts, slot = self._slot(cell, period)
+            counts.drivers[slot] += 1
+
+    # Reading
+
+    def cells(self, now=None):
+        """
+        ``{cell: (requests, drivers, pressure)}`` over the window for every
+        cell with activity in it.  ``drivers`` is the average number of
+        available drivers per slot.
+        """
+        oldest = int((time.time() if now is None else now) // self.slot_seconds) - self.slots + 1
+        result = {}
+        with self._lock:
+            for cell, counts in list(self._cells.items()):
+                requests = drivers = 0
+                for slot, period in enumerate(counts.periods):
+                    if period >= oldest:
+                        requests += counts.requests[slot]
+                        drivers += counts.drivers[slot]
+                if not requests and not drivers:
+                    # Nothing left in the window; the cell is recreated on its next event
+                    del self._cells[cell]
+                    continue
+                drivers /= self.slots
+                result[cell] = (requests, drivers, requests / max(drivers, 1.0))
+
+            for driver_id, (_, period) in list(self._driver_slot.items()):
+                if period < oldest:
+                    del self._driver_slot[driver_id]
+        return result
+
+    def bounds(self, cell):
+        """(min_lat, max_lat, min_lon, max_lon) of a cell"""
+        row, col = cell
+        size = self.cell_size_deg
+        return (row * size, (row + 1) * size, col * size, (col + 1) * size)
+
+    def snapshot(self, now=None):
+        """The heatmap as served by the API"""
+        levels = dict(self._levels)
+        cells = []
+        for cell, (requests, drivers, pressure) in sorted(self.cells(now).items()):
+            min_lat, max_lat, min_lon, max_lon = self.bounds(cell)
+            level = levels.get(cell, 0)
+            cells.append({
+                'min_latitude': round(min_lat, 6),
+                'max_latitude': round(max_lat, 6),
+                'min_longitude': round(min_lon, 6),
+                'max_longitude': round(max_lon, 6),
+                'requests': requests,
+                'drivers': round(drivers, 2),
+                'pressure': round(pressure, 2),
+                'surge_multiplier': str(surge_multiplier(level)) if level else None,
+            })
+        return {
+            'cell_degrees': self.cell_size_deg,
+            'window_seconds': self.slot_seconds * self.slots,
+            'cells': cells,
+        }
+
+    # Automatic surge
+
+    def evaluate(self, now=None):
+        """Surge level per cell after this evaluation; cells not surging are left out"""
+        levels = {}
+        for cell, (requests, _, pressure) in self.cells(now).items():
+            level = surge_level(pressure, self._levels.get(cell, 0))
+            if level and (requests >= settings.SURGE_MIN_REQUESTS or self._levels.get(cell)):
+                levels[cell] = level
+        self._levels = levels
+        self.stats['evaluations'] += 1
+        return levels
+
+    def materialize(self, levels, now=None):
+        """Bring the automatic ``SurgeMultiplier`` rows in line with the surging cells"""
+        from .models import SurgeMultiplier
+        from .quote_cache import quote_cache
+        from .rules import invalidate_rule_set
+
+        now = datetime.fromtimestamp(time.time() if now is None else now, tz=dt_timezone.utc)
+        ends_at = now + timedelta(seconds=settings.SURGE_ZONE_TTL)
+        extend_before = now + timedelta(seconds=settings.SURGE_ZONE_TTL / 2)
+
+        with transaction.atomic():
+            zones = {}
+            for zone in SurgeMultiplier.objects.filter(is_automatic=True, is_active=True, end_time__gt=now):
+                cell = self.cell_for(
+                    (zone.min_latitude + zone.max_latitude) / 2, (zone.min_longitude + zone.max_longitude) / 2
+                )
+                zones[cell] = zone
+
+            created = []
+            updated = []
+            for cell, level in levels.items():
+                multiplier = surge_multiplier(level)
+                zone = zones.pop(cell, None)
+                if zone is None:
+                    min_lat, max_lat, min_lon, max_lon = self.bounds(cell)
+                    created.append(SurgeMultiplier(
+                        name=f'Auto surge {min_lat:.3f},{min_lon:.3f}',
+                        area_name='Demand heatmap cell',
+                        min_latitude=Decimal(f'{min_lat:.6f}'),
+                        max_latitude=Decimal(f'{max_lat:.6f}'),
+                        min_longitude=Decimal(f'{min_lon:.6f}'),
+                        max_longitude=Decimal(f'{max_lon:.6f}'),
+                        multiplier=multiplier,
+                        start_time=now,
+                        end_time=ends_at,
+                        is_automatic=True,
+                    ))
+                elif zone.multiplier != multiplier or zone.end_time < extend_before:
+                    zone.multiplier = multiplier
+                    zone.end_time = ends_at
+                    zone.updated_at = now
+                    updated.append(zone)
+
+            # Cells that stopped surging end now
+            for zone in zones.values():
+                zone.end_time = now
+                zone.is_active = False
+                zone.updated_at = now
+                updated.append(zone)
+
+            # Bulk writes skip the pricing signals; invalidate once for the lot
+            SurgeMultiplier.objects.bulk_create(created)
+            SurgeMultiplier.objects.bulk_update(updated, ['multiplier', 'end_time', 'is_active', 'updated_at'])
+            if created or updated:
+                transaction.on_commit(invalidate_rule_set)
+                transaction.on_commit(quote_cache.clear)
+
+        written = len(created) + len(updated)
+        self.stats['zones_written'] += written
+        if written:
+            logger.info(f'Automatic surge: {len(created)} zones created, {len(updated)} updated or ended')
+        return written
+
+    def ensure_started(self):
+        """Start evaluating on the running event loop if it is not running yet"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.SURGE_EVALUATE_INTERVAL)
+            try:
+                levels = self.evaluate()
+                await database_sync_to_async(self.materialize)(levels)
+            except Exception:
+                logger.exception('Automatic surge evaluation failed')
+
+
+def surge_level(pressure, current=0):
+    """
+    Surge steps for a cell's pressure, given its current steps (0 = none).
+    Surging starts at SURGE_PRESSURE_ON, each SURGE_PRESSURE_PER_STEP above
+    adds a step, and it stops below SURGE_PRESSURE_OFF.
+    """
+    per_step = settings.SURGE_PRESSURE_PER_STEP
+    max_level = round((settings.SURGE_MAX_MULTIPLIER - 1) / settings.SURGE_MULTIPLIER_STEP)
+
+    def steps(value):
+        if value < settings.SURGE_PRESSURE_ON:
+            return 0
+        return min(max_level, math.floor((value - settings.SURGE_PRESSURE_ON) / per_step) + 1)
+
+    if not current:
+        return steps(pressure)
+    if pressure < settings.SURGE_PRESSURE_OFF:
+        return 0
+    target = max(steps(pressure), 1)
+    if target >= current:
+        return target
+    # Step down only as far as pressure is half a step clear of
+    return min(current, max(steps(pressure + per_step / 2), 1))
+
+
+def surge_multiplier(level):
+    return Decimal('1.00') + Decimal(str(settings.SURGE_MULTIPLIER_STEP)) * level
+
+
+heatmap = DemandHeatmap(
+    cell_size_deg=settings.SURGE_HEATMAP_CELL_DEGREES,
+    slot_seconds=settings.SURGE_HEATMAP_SLOT_SECONDS,
+    slots=settings.SURGE_HEATMAP_SLOTS,
+)
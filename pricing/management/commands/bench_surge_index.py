@@ -0,0 +1,113 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pricing.models import SurgeMultiplier
+from pricing.surge_index import SurgeZoneIndex
+
+
+def linear_surge_multiplier(surges, pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, request_time):
+    """The original per-row scan, kept as the reference the index must agree with"""
+    best_surge = None
+    best_multiplier = Decimal('1.0')
+    for surge in surges:
+        if not surge.is_active:
+            continue
+        if surge.start_time is not None and surge.start_time > request_time:
+            continue
+        if surge.end_time is not None and surge.end_time < request_time:
+            continue
+        if surge.min_latitude and surge.max_latitude and surge.min_longitude and surge.max_longitude:
+            pickup_in_area = (
+                surge.min_latitude <= Decimal(str(pickup_lat)) <= surge.max_latitude and
+                surge.min_longitude <= Decimal(str(pickup_lon)) <= surge.max_longitude
+            )
+            dropoff_in_area = (
+                surge.min_latitude <= Decimal(str(dropoff_lat)) <= surge.max_latitude and
+                surge.min_longitude <= Decimal(str(dropoff_lon)) <= surge.max_longitude
+            )
+            if pickup_in_area or dropoff_in_area:
+                if surge.multiplier > best_multiplier:
+                    best_multiplier = surge.multiplier
+                    best_surge = surge.name
+        elif surge.multiplier > best_multiplier:
+            best_multiplier = surge.multiplier
+            best_surge = surge.name
+    return best_multiplier, best_surge
+
+
+class Command(BaseCommand):
+    help = 'Benchmark surge lookups through the zone index against a linear scan of every zone'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zones', type=int, nargs='+', default=[10, 100, 1000, 10000])
+        parser.add_argument('--quotes', type=int, default=2000, help='Lookups timed per zone count')
+
+    def _zones(self, rng, count, now):
+        """Overlapping zones over a ~1 degree square around Johannesburg"""
+        zones = []
+        for i in range(count):
+            lat = Decimal('-26.7') + Decimal(rng.randint(0, 100000)) / 100000
+            lon = Decimal('27.5') + Decimal(rng.randint(0, 100000)) / 100000
+            half = Decimal(rng.randint(500, 5000)) / 100000
+            global_zone = rng.random() < 0.001
+            windowed = rng.random() < 0.5
+            zones.append(SurgeMultiplier(
+                id=i + 1,
+                name=f'Zone {i}',
+                min_latitude=None if global_zone else lat - half,
+                max_latitude=None if global_zone else lat + half,
+                min_longitude=None if global_zone else lon - half,
+                max_longitude=None if global_zone else lon + half,
+                multiplier=Decimal(rng.randint(100, 300)) / 100,
+                start_time=now - timedelta(hours=rng.randint(0, 6)) if windowed else None,
+                end_time=now + timedelta(hours=rng.randint(-3, 6)) if windowed else None,
+                is_active=rng.random() < 0.95,
+            ))
+        return zones
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        now = timezone.now()
+        quotes = [
+            (
+                Decimal('-26.7') + Decimal(rng.randint(0, 1000000)) / 1000000,
+                Decimal('27.5') + Decimal(rng.randint(0, 1000000)) / 1000000,
+                Decimal('-26.7') + Decimal(rng.randint(0, 1000000)) / 1000000,
+                Decimal('27.5') + Decimal(rng.randint(0, 1000000)) / 1000000,
+                now + timedelta(minutes=rng.randint(-120, 120)),
+            )
+            for _ in range(options['quotes'])
+        ]
+
+        self.stdout.write(f'🗺️  Surge lookup benchmark ({len(quotes)} quotes per run)')
+        for count in options['zones']:
+            zones = self._zones(rng, count, now)
+
+            start = time.perf_counter()
+            index = SurgeZoneIndex(zones)
+            build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            indexed = [index.best(*quote) for quote in quotes]
+            indexed_seconds = time.perf_counter() - start
+
+            # The linear scan gets slow quickly; a sample is enough to time it
+            sample = quotes[:max(1, len(quotes) * 100 // max(count, 100))]
+            start = time.perf_counter()
+            linear = [linear_surge_multiplier(zones, *quote) for quote in sample]
+            linear_seconds = time.perf_counter() - start
+
+            mismatches = sum(1 for a, b in zip(indexed, linear) if a != b)
+            self.stdout.write(
+                f'  {count:>6} zones   build {build * 1000:8.1f} ms   '
+                f'index {indexed_seconds / len(quotes) * 1e6:8.1f} µs/quote   '
+                f'linear {linear_seconds / len(sample) * 1e6:10.1f} µs/quote   '
+                f'mismatches {mismatches}/{len(sample)}'
+            )
+
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark complete'))
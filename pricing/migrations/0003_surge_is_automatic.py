@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricing', '0002_add_sample_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surgemultiplier',
+            name='is_automatic',
+            field=models.BooleanField(default=False, help_text='Created and maintained by the demand heatmap'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
@@ -116,6 +117,9 @@ class SurgeMultiplier(models.Model):
     end_time = models.DateTimeField(null=True, blank=True)
 
     is_active = models.BooleanField(default=True)
+    is_automatic = models.BooleanField(
+        default=False, help_text='Created and maintained by the demand heatmap'
+    )
 
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -201,6 +205,8 @@ class PromoCode(models.Model):
     )
 
     max_uses = models.IntegerField(null=True, blank=True, help_text='Leave blank for unlimited')
+    max_uses_per_user = models.PositiveIntegerField(null=True, blank=True, help_text='Leave blank for unlimited')
+    # Only ever changed by conditional F() updates (see pricing.promos)
     uses_count = models.IntegerField(default=0)
 
     valid_from = models.DateTimeField()
@@ -233,7 +239,30 @@ class PromoCode(models.Model):
         if now > self.valid_until:
             return False, "Promo code has expired"
 
+        # Blank or 0 means unlimited
         if self.max_uses and self.uses_count >= self.max_uses:
             return False, "Promo code has reached maximum uses"
 
         return True, "Valid"
+
+
+class PromoRedemption(models.Model):
+    """One use of a promo code, claimed when a booking is made with it"""
+
+    promo_code = models.ForeignKey(PromoCode, on_delete=models.PROTECT, related_name='redemptions')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='promo_redemptions')
+    booking = models.OneToOneField('bookings.Booking', on_delete=models.CASCADE, related_name='promo_redemption')
+
+    redeemed_at = models.DateTimeField(auto_now_add=True)
+    # Set when the booking is cancelled and the use given back
+    released_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-redeemed_at']
+        indexes = [
+            # Per-user limit checks
+            models.Index(fields=['promo_code', 'user']),
+        ]
+
+    def __str__(self):
+        return f"{self.promo_code.code} on booking #{self.booking_id}"
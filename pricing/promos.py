@@ -0,0 +1,193 @@
+"""
+Promo code lookups and redemption.
+
+Quotes and the validation endpoint look codes up through ``promo_codes``, a
+per-code cache with a ``PROMO_CACHE_TTL``.  Unknown codes are remembered
+too, for ``PROMO_CACHE_NEGATIVE_TTL``, in a table of their own.  A run of
+guesses therefore reaches the database once per distinct code at most and
+cannot push real codes out of the cache.  Codes longer than the model allows
+are turned away without a lookup.  Promo code edits in this process clear
+the cache through the pricing signals; other processes see them once their
+entries expire.
+
+A cached ``uses_count`` is only a hint.  ``redeem_promo_code`` claims a use
+with a single conditional ``UPDATE ... SET uses_count = uses_count + 1 WHERE
+uses_count < max_uses``, so concurrent bookings can never overshoot
+``max_uses`` (blank or 0 for unlimited).  The update also locks the code's
+row until the booking commits, which serialises the per-user limit check
+that follows it.  Every use is recorded in ``PromoRedemption``, one per
+booking, and cancelling the booking gives the use back.  Those updates send
+no signals, so the claim that takes the last use, and the release that
+gives one back to a used-up code, drop the code and the quotes priced with
+it from this process's caches.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import PromoCode, PromoRedemption
+from .quote_cache import discard_promo_quotes
+
+CODE_MAX_LENGTH = PromoCode._meta.get_field('code').max_length
+
+
+class PromoCodeError(Exception):
+    """A promo code that cannot be redeemed; the message can be shown to the user"""
+
+
+class PromoCodeCache:
+    """Thread-safe per-code cache of promo codes, remembering unknown codes as well"""
+
+    def __init__(self, ttl=60, negative_ttl=300, max_entries=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._known = OrderedDict()     # code -> (expires_at, PromoCode)
+        self._unknown = OrderedDict()   # code -> expires_at
+        self.stats = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'rejected': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def get(self, code):
+        """The promo code, active or not, or None if there is no such code"""
+        if not code or len(code) > CODE_MAX_LENGTH:
+            self.stats['rejected'] += 1
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._known.get(code)
+            if entry is not None and entry[0] > now:
+                self._known.move_to_end(code)
+                self.stats['hits'] += 1
+                return entry[1]
+            expires_at = self._unknown.get(code)
+            if expires_at is not None and expires_at > now:
+                self.stats['negative_hits'] += 1
+                return None
+            self.stats['misses'] += 1
+
+        promo = PromoCode.objects.filter(code=code).first()
+
+        with self._lock:
+            if promo is None:
+                self._known.pop(code, None)
+                self._store(self._unknown, code, now + self.negative_ttl)
+            else:
+                self._unknown.pop(code, None)
+                self._store(self._known, code, (now + self.ttl, promo))
+        return promo
+
+    def _store(self, table, code, value):
+        table[code] = value
+        table.move_to_end(code)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def discard(self, code):
+        with self._lock:
+            self._known.pop(code, None)
+            self._unknown.pop(code, None)
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._known.clear()
+            self._unknown.clear()
+            self.stats['invalidations'] += 1
+
+    def metrics(self):
+        with self._lock:
+            return {**self.stats, 'known': len(self._known), 'unknown': len(self._unknown)}
+
+
+def forget_promo_code(code):
+    """Drop ``code`` and the quotes priced with it from this process's caches"""
+    promo_codes.discard(code)
+    discard_promo_quotes(code)
+
+
+def redemptions_left(promo, user):
+    """Uses of ``promo`` the user has left, None when unlimited"""
+    if promo.max_uses_per_user is None:
+        return None
+    used = PromoRedemption.objects.filter(promo_code=promo, user=user, released_at__isnull=True).count()
+    return max(promo.max_uses_per_user - used, 0)
+
+
+def redeem_promo_code(code, user, booking):
+    """
+    Claim one use of ``code`` for ``booking``, made by ``user``.  Call it in
+    the transaction that creates the booking, so a booking that fails to
+    save gives the use back.  Raises ``PromoCodeError`` when the code cannot
+    be used; the claim is undone.
+    """
+    promo = promo_codes.get(code)
+    if promo is None:
+        raise PromoCodeError('Invalid promo code')
+
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = PromoCode.objects.filter(
+            Q(max_uses__isnull=True) | Q(max_uses=0) | Q(uses_count__lt=F('max_uses')),
+            pk=promo.pk,
+            is_active=True,
+            valid_from__lte=now,
+            valid_until__gte=now,
+        ).update(uses_count=F('uses_count') + 1)
+        if not claimed:
+            # Explain the refusal from the row as it is now, not the cached copy
+            current = PromoCode.objects.filter(pk=promo.pk).first()
+            if current is None:
+                raise PromoCodeError('Invalid promo code')
+            is_valid, message = current.is_valid()
+            raise PromoCodeError(message if not is_valid else 'Promo code has reached maximum uses')
+
+        if redemptions_left(promo, user) == 0:
+            raise PromoCodeError('You have already used this promo code')
+
+        if PromoCode.objects.filter(pk=promo.pk, max_uses__gt=0, uses_count__gte=F('max_uses')).exists():
+            # That was the last use; cached copies would keep offering the code
+            transaction.on_commit(lambda: forget_promo_code(promo.code))
+
+        return PromoRedemption.objects.create(promo_code_id=promo.pk, user=user, booking=booking)
+
+
+def release_promo_redemption(booking_id):
+    """Give back the use claimed by a cancelled booking; False if it had none"""
+    with transaction.atomic():
+        redemption = PromoRedemption.objects.filter(booking_id=booking_id, released_at__isnull=True).first()
+        if redemption is None:
+            return False
+        # Conditional, so a booking cancelled twice at once is only released once
+        if not PromoRedemption.objects.filter(pk=redemption.pk, released_at__isnull=True).update(
+            released_at=timezone.now()
+        ):
+            return False
+        PromoCode.objects.filter(pk=redemption.promo_code_id).update(uses_count=F('uses_count') - 1)
+        code = PromoCode.objects.filter(
+            pk=redemption.promo_code_id, max_uses__gt=0, uses_count=F('max_uses') - 1
+        ).values_list('code', flat=True).first()
+        if code is not None:
+            # The code was used up until now; cached copies would keep refusing it
+            transaction.on_commit(lambda: forget_promo_code(code))
+    return True
+
+
+promo_codes = PromoCodeCache(
+    ttl=settings.PROMO_CACHE_TTL,
+    negative_ttl=settings.PROMO_CACHE_NEGATIVE_TTL,
+    max_entries=settings.PROMO_CACHE_MAX_ENTRIES,
+)
@@ -0,0 +1,136 @@
+"""
+LRU cache of serialized fare quotes.
+
+Clients re-quote every time the user drags a map pin, usually by a few
+metres.  Quotes are cached under the pickup and dropoff snapped to a grid of
+``PRICING_QUOTE_CACHE_CELL_DEGREES``, together with everything else that
+decides the price: the vehicle type, the promo code, the peak hour and surge
+that apply, the hour of the week, and the pricing rules and ETA model
+versions.  Trips within the same pair of cells therefore share one quote for
+up to ``PRICING_QUOTE_CACHE_TTL`` seconds.
+
+The cache is cleared when the pricing rules change in this process; entries
+from other processes' rule versions can never match because the version is
+part of the key.  When a promo code runs out, or comes back, only the
+quotes priced with it are dropped.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from bookings.eta import hour_of_week
+
+
+class QuoteCache:
+    """Thread-safe LRU cache with a per-entry time to live"""
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def get(self, key):
+        """Cached value for ``key``, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.stats['invalidations'] += 1
+
+    def discard_matching(self, predicate):
+        """Drop every entry whose key satisfies ``predicate``; returns how many"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            self.stats['invalidations'] += 1
+            return len(keys)
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else None,
+            }
+
+
+# Position of the promo code in a quote_key
+PROMO_CODE_FIELD = 8
+
+
+def quote_key(trip, request_time, promo_code, rules, eta):
+    """
+    Cache key for quoting ``trip`` at ``request_time``.
+
+    Peak hour and surge are resolved here rather than bucketing the time, so
+    a quote is never served across a peak or surge boundary.  Durations
+    change with the hour of the week and the ETA model.
+    """
+    cell = settings.PRICING_QUOTE_CACHE_CELL_DEGREES
+    return (
+        rules.version,
+        eta.version,
+        hour_of_week(request_time),
+        math.floor(float(trip['pickup_latitude']) / cell),
+        math.floor(float(trip['pickup_longitude']) / cell),
+        math.floor(float(trip['dropoff_latitude']) / cell),
+        math.floor(float(trip['dropoff_longitude']) / cell),
+        trip.get('vehicle_type_id') or None,
+        promo_code or None,
+        rules.peak_hour_multiplier(request_time),
+        rules.surge_multiplier(
+            trip['pickup_latitude'],
+            trip['pickup_longitude'],
+            trip['dropoff_latitude'],
+            trip['dropoff_longitude'],
+            request_time
+        ),
+    )
+
+
+def discard_promo_quotes(promo_code):
+    """Drop the cached quotes priced with ``promo_code``"""
+    return quote_cache.discard_matching(lambda key: key[PROMO_CODE_FIELD] == promo_code)
+
+
+quote_cache = QuoteCache(
+    max_entries=settings.PRICING_QUOTE_CACHE_MAX_ENTRIES,
+    ttl=settings.PRICING_QUOTE_CACHE_TTL,
+)
@@ -0,0 +1,140 @@
+"""
+In-memory snapshot of the pricing rules.
+
+Quoting a fare used to query distance tiers, peak hours, surges and promo
+codes once per vehicle type.  ``PricingRuleSet`` loads every rule in four
+queries and precompiles them - tiers as sorted arrays per vehicle type, peak
+hours grouped by weekday, surges in a grid index over their areas - so a full quote
+runs without touching the database.  Promo codes are looked up one code at a
+time through ``pricing.promos.promo_codes``, which caches them separately.
+
+The snapshot is shared by the whole process and rebuilt on demand after the
+pricing signals invalidate it.  Other processes do not see those signals, so
+a snapshot is also rebuilt once it is ``PRICING_RULES_TTL`` seconds old.
+"""
+import hashlib
+import threading
+import time
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.conf import settings
+
+from .models import VehicleType, PeakHour, SurgeMultiplier, DistanceTier
+from .surge_index import SurgeZoneIndex
+
+
+class PricingRuleSet:
+    """Immutable, precompiled view of all pricing rules"""
+
+    def __init__(self, vehicle_types, tiers, peak_hours, surges):
+        self.loaded_at = time.monotonic()
+
+        # Active vehicle types, in display order
+        self.vehicle_types = [vt for vt in vehicle_types if vt.is_active]
+        self.vehicle_types_by_id = {vt.id: vt for vt in self.vehicle_types}
+
+        # vehicle type id -> ([min_distance_km, ...], [(max_distance_km, per_km_rate), ...]),
+        # both sorted by min_distance_km
+        self.tiers = {}
+        for tier in sorted(tiers, key=lambda t: t.min_distance_km):
+            mins, bounds = self.tiers.setdefault(tier.vehicle_type_id, ([], []))
+            mins.append(tier.min_distance_km)
+            bounds.append((tier.max_distance_km, tier.per_km_rate))
+
+        # weekday -> [(start, end, multiplier, name), ...], highest multiplier first;
+        # peak hours without a day are listed under every weekday
+        active_peaks = sorted(
+            (peak for peak in peak_hours if peak.is_active),
+            key=lambda p: (-p.multiplier, p.id)
+        )
+        self.peak_hours = {
+            day: [
+                (peak.start_time, peak.end_time, peak.multiplier, peak.name)
+                for peak in active_peaks
+                if peak.day_of_week is None or peak.day_of_week == day
+            ]
+            for day in range(7)
+        }
+
+        # Surges are indexed by area; the model orders them newest first
+        self.surges = SurgeZoneIndex(
+            surges,
+            cell_size_deg=settings.PRICING_SURGE_CELL_DEGREES,
+            max_cells=settings.PRICING_SURGE_MAX_CELLS_PER_ZONE,
+        )
+
+        self.version = self._fingerprint(vehicle_types, tiers, peak_hours, surges)
+
+    @classmethod
+    def load(cls):
+        """Build a snapshot from the database"""
+        return cls(
+            vehicle_types=list(VehicleType.objects.order_by('-priority', 'name')),
+            tiers=list(DistanceTier.objects.all()),
+            peak_hours=list(PeakHour.objects.all()),
+            surges=list(SurgeMultiplier.objects.order_by('-created_at')),
+        )
+
+    @staticmethod
+    def _fingerprint(*groups):
+        """Short hash of every rule row, so clients can tell which rules priced a quote"""
+        digest = hashlib.sha256()
+        for rows in groups:
+            for row in sorted(rows, key=lambda r: r.pk):
+                values = [getattr(row, field.attname) for field in row._meta.concrete_fields]
+                digest.update(repr(values).encode())
+            digest.update(b'|')
+        return digest.hexdigest()[:16]
+
+    def vehicle_type(self, vehicle_type_id):
+        """Active vehicle type with the given id, or None"""
+        return self.vehicle_types_by_id.get(vehicle_type_id)
+
+    def distance_tier_rate(self, vehicle_type, distance_km):
+        """Per km rate of the highest tier covering ``distance_km`` (a Decimal)"""
+        mins, bounds = self.tiers.get(vehicle_type.id, ((), ()))
+        for i in range(bisect_right(mins, distance_km) - 1, -1, -1):
+            max_distance_km, per_km_rate = bounds[i]
+            if max_distance_km is None or max_distance_km >= distance_km:
+                return per_km_rate
+        return vehicle_type.per_km_rate
+
+    def peak_hour_multiplier(self, request_time):
+        """Highest active peak hour multiplier covering ``request_time``"""
+        current_time = request_time.time()
+        for start, end, multiplier, name in self.peak_hours[request_time.weekday()]:
+            if start <= current_time <= end:
+                return multiplier, name
+        return Decimal('1.0'), None
+
+    def surge_multiplier(self, pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, request_time):
+        """Highest surge active at ``request_time`` covering the pickup or dropoff"""
+        return self.surges.best(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, request_time)
+
+
+_lock = threading.Lock()
+_rule_set = None
+_generation = 0
+
+
+def get_rule_set():
+    """The current snapshot, loading it if it was invalidated or is too old"""
+    global _rule_set
+    rule_set = _rule_set
+    if rule_set is None or time.monotonic() - rule_set.loaded_at > settings.PRICING_RULES_TTL:
+        with _lock:
+            rule_set = _rule_set
+            if rule_set is None or time.monotonic() - rule_set.loaded_at > settings.PRICING_RULES_TTL:
+                generation = _generation
+                rule_set = PricingRuleSet.load()
+                # Don't keep a snapshot that was invalidated while it loaded
+                if generation == _generation:
+                    _rule_set = rule_set
+    return rule_set
+
+
+def invalidate_rule_set():
+    global _rule_set, _generation
+    _generation += 1
+    _rule_set = None
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import VehicleType, PeakHour, SurgeMultiplier, DistanceTier, PromoCode
 
@@ -130,6 +131,27 @@ class FareCalculationSerializer(serializers.Serializer):
     request_time = serializers.DateTimeField(required=False)
 
 
+class FareBatchTripSerializer(FareCalculationSerializer):
+    """One trip of a batch fare request"""
+
+    reference = serializers.CharField(max_length=100, required=False, allow_blank=True)
+
+
+class FareBatchSerializer(serializers.Serializer):
+    """Serializer for batch fare calculation request"""
+
+    trips = FareBatchTripSerializer(many=True, allow_empty=False)
+    promo_code = serializers.CharField(max_length=50, required=False, allow_blank=True)
+    request_time = serializers.DateTimeField(required=False)
+
+    def validate_trips(self, value):
+        if len(value) > settings.PRICING_BATCH_MAX_TRIPS:
+            raise serializers.ValidationError(
+                f'At most {settings.PRICING_BATCH_MAX_TRIPS} trips can be priced per request'
+            )
+        return value
+
+
 class FareBreakdownSerializer(serializers.Serializer):
     """Serializer for fare calculation response"""
 
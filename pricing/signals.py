@@ -0,0 +1,30 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import VehicleType, PeakHour, SurgeMultiplier, DistanceTier, PromoCode
+from .promos import promo_codes
+from .quote_cache import quote_cache
+from .rules import invalidate_rule_set
+
+
+@receiver(post_save, sender=VehicleType)
+@receiver(post_save, sender=PeakHour)
+@receiver(post_save, sender=SurgeMultiplier)
+@receiver(post_save, sender=DistanceTier)
+@receiver(post_delete, sender=VehicleType)
+@receiver(post_delete, sender=PeakHour)
+@receiver(post_delete, sender=SurgeMultiplier)
+@receiver(post_delete, sender=DistanceTier)
+def pricing_rules_changed(sender, **kwargs):
+    """Drop the pricing rule snapshot and cached quotes once the change is committed"""
+    transaction.on_commit(invalidate_rule_set)
+    transaction.on_commit(quote_cache.clear)
+
+
+@receiver(post_save, sender=PromoCode)
+@receiver(post_delete, sender=PromoCode)
+def promo_code_changed(sender, **kwargs):
+    """Drop cached promo codes and the quotes priced with them once the change is committed"""
+    transaction.on_commit(promo_codes.clear)
+    transaction.on_commit(quote_cache.clear)
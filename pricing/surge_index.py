@@ -0,0 +1,99 @@
+"""
+Grid index over surge zones.
+
+Each surge zone's bounding box is registered in every grid cell it overlaps,
+and every cell keeps its zones ordered from the highest multiplier down.  A
+lookup only reads the cells holding the pickup and dropoff and stops at the
+first zone that is active at the requested time, so its cost depends on how
+many zones overlap those two cells rather than on how many zones exist.
+
+Zones without a complete bounding box apply everywhere, and zones spanning
+more than ``max_cells`` cells are kept in a separate "wide" list instead of
+being copied into every cell; both lists are merged into each lookup.
+"""
+import heapq
+import math
+from decimal import Decimal
+
+
+class SurgeZoneIndex:
+    """Answers "highest surge covering either point at this time" without scanning every zone"""
+
+    def __init__(self, surges, cell_size_deg=0.05, max_cells=400):
+        """
+        Args:
+            surges: SurgeMultiplier rows in precedence order (newest first);
+                on equal multipliers the earlier one wins
+            cell_size_deg: Grid cell size in degrees
+            max_cells: Zones covering more cells than this go on the wide list
+        """
+        self.cell_size_deg = cell_size_deg
+        self._cells = {}    # (row, col) -> [zone, ...]
+        self._wide = []
+        self.size = 0
+
+        for position, surge in enumerate(surges):
+            if not surge.is_active or surge.multiplier <= Decimal('1.0'):
+                # A zone has to beat the default multiplier to ever win
+                continue
+            self.size += 1
+
+            if surge.min_latitude and surge.max_latitude and surge.min_longitude and surge.max_longitude:
+                box = (surge.min_latitude, surge.max_latitude, surge.min_longitude, surge.max_longitude)
+            else:
+                box = None
+            # Sorting on (-multiplier, position) reproduces the linear scan's choice
+            zone = (-surge.multiplier, position, box, surge.start_time, surge.end_time, surge.multiplier, surge.name)
+
+            if box is None:
+                self._wide.append(zone)
+                continue
+            rows = range(self._cell(box[0]), self._cell(box[1]) + 1)
+            cols = range(self._cell(box[2]), self._cell(box[3]) + 1)
+            if len(rows) * len(cols) > max_cells:
+                self._wide.append(zone)
+                continue
+            for row in rows:
+                for col in cols:
+                    self._cells.setdefault((row, col), []).append(zone)
+
+        self._wide.sort()
+        for zones in self._cells.values():
+            zones.sort()
+
+    def _cell(self, coordinate):
+        # floor() is monotonic, so a point inside a box always lands in one of its cells
+        return math.floor(float(coordinate) / self.cell_size_deg)
+
+    def best(self, pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, request_time):
+        """
+        Highest active surge covering the pickup or dropoff.
+
+        Returns:
+            tuple: (multiplier, name), or (Decimal('1.0'), None) without a surge
+        """
+        pickup_lat = Decimal(str(pickup_lat))
+        pickup_lon = Decimal(str(pickup_lon))
+        dropoff_lat = Decimal(str(dropoff_lat))
+        dropoff_lon = Decimal(str(dropoff_lon))
+
+        pickup_cell = (self._cell(pickup_lat), self._cell(pickup_lon))
+        dropoff_cell = (self._cell(dropoff_lat), self._cell(dropoff_lon))
+        candidates = [self._wide, self._cells.get(pickup_cell, ())]
+        if dropoff_cell != pickup_cell:
+            candidates.append(self._cells.get(dropoff_cell, ()))
+
+        for _, _, box, start, end, multiplier, name in heapq.merge(*candidates):
+            if start is not None and start > request_time:
+                continue
+            if end is not None and end < request_time:
+                continue
+            if box is not None:
+                min_lat, max_lat, min_lon, max_lon = box
+                pickup_in_area = min_lat <= pickup_lat <= max_lat and min_lon <= pickup_lon <= max_lon
+                dropoff_in_area = min_lat <= dropoff_lat <= max_lat and min_lon <= dropoff_lon <= max_lon
+                if not (pickup_in_area or dropoff_in_area):
+                    continue
+            return multiplier, name
+
+        return Decimal('1.0'), None
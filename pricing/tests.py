@@ -1,3 +1,204 @@
-from django.test import TestCase
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from bookings.models import Booking
+from bookings.services import AssignmentService
+from .heatmap import DemandHeatmap, surge_level
+from .models import PromoCode, PromoRedemption, SurgeMultiplier
+from .promos import PromoCodeError, promo_codes, redeem_promo_code
+
+User = get_user_model()
+
+
+class ConcurrentPromoRedemptionTests(TransactionTestCase):
+    """Bookings made with the same promo code at the same time"""
+
+    def setUp(self):
+        promo_codes.clear()
+        self.addCleanup(promo_codes.clear)
+
+    def create_promo(self, max_uses=None, max_uses_per_user=None):
+        now = timezone.now()
+        return PromoCode.objects.create(
+            code='LAUNCH',
+            description='Launch discount',
+            discount_type='fixed',
+            discount_value=Decimal('20.00'),
+            max_uses=max_uses,
+            max_uses_per_user=max_uses_per_user,
+            valid_from=now - timedelta(days=1),
+            valid_until=now + timedelta(days=1),
+        )
+
+    def create_bookings(self, count, passengers=None):
+        passengers = passengers or [
+            User.objects.create(username=f'passenger{i}', phone_number=f'+2782000{i:04d}') for i in range(count)
+        ]
+        return [
+            Booking.objects.create(
+                passenger=passenger,
+                passenger_phone=passenger.phone_number,
+                pickup_latitude=Decimal('-26.204100'),
+                pickup_longitude=Decimal('28.047300'),
+                pickup_address='Pickup',
+                dropoff_latitude=Decimal('-26.185000'),
+                dropoff_longitude=Decimal('28.055000'),
+                dropoff_address='Dropoff',
+                fare_amount=Decimal('120.00'),
+                status='pending',
+            )
+            for passenger in passengers
+        ]
+
+    def redeem(self, booking):
+        try:
+            with transaction.atomic():
+                redeem_promo_code('LAUNCH', booking.passenger, booking)
+            return True
+        except PromoCodeError:
+            return False
+
+    def redeem_all(self, bookings):
+        go = threading.Event()
+
+        def redeem(booking):
+            go.wait()
+            try:
+                while True:
+                    try:
+                        return self.redeem(booking)
+                    except OperationalError:
+                        # The in-memory test database refuses concurrent writers
+                        # instead of queueing them; the claim was rolled back
+                        time.sleep(0.001)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(bookings)) as pool:
+            futures = [pool.submit(redeem, booking) for booking in bookings]
+            go.set()
+            return [future.result() for future in futures]
+
+    def assert_uses(self, promo, count):
+        promo.refresh_from_db()
+        self.assertEqual(promo.uses_count, count)
+        self.assertEqual(PromoRedemption.objects.filter(promo_code=promo, released_at__isnull=True).count(), count)
+
+    def test_concurrent_redemptions_stop_at_max_uses(self):
+        promo = self.create_promo(max_uses=5)
+
+        results = self.redeem_all(self.create_bookings(20))
+
+        self.assertEqual(results.count(True), 5)
+        self.assert_uses(promo, 5)
+
+    def test_concurrent_redemptions_by_one_passenger_stop_at_their_limit(self):
+        promo = self.create_promo(max_uses=100, max_uses_per_user=2)
+        passenger = User.objects.create(username='passenger', phone_number='+27820000001')
+
+        results = self.redeem_all(self.create_bookings(8, passengers=[passenger] * 8))
+
+        self.assertEqual(results.count(True), 2)
+        self.assert_uses(promo, 2)
+
+    def test_zero_max_uses_is_unlimited(self):
+        promo = self.create_promo(max_uses=0)
+
+        results = self.redeem_all(self.create_bookings(20))
+
+        self.assertTrue(all(results))
+        self.assert_uses(promo, 20)
+
+    def test_cancelled_booking_gives_its_use_back(self):
+        promo = self.create_promo(max_uses=1)
+        first, second = self.create_bookings(2)
+        self.assertTrue(self.redeem(first))
+        self.assertFalse(self.redeem(second))
+
+        with mock.patch('bookings.services.ride_events.status_changed'):
+            self.assertTrue(AssignmentService.cancel(first.id, reason='Changed plans'))
+        self.assertIsNotNone(PromoRedemption.objects.get(booking=first).released_at)
+        self.assert_uses(promo, 0)
+
+        self.assertTrue(self.redeem(second))
+        self.assert_uses(promo, 1)
+
+
+@override_settings(
+    SURGE_PRESSURE_ON=2.0, SURGE_PRESSURE_OFF=1.2, SURGE_PRESSURE_PER_STEP=1.0,
+    SURGE_MULTIPLIER_STEP=0.25, SURGE_MAX_MULTIPLIER=3.0,
+)
+class SurgeLevelTests(SimpleTestCase):
+
+    def test_surge_starts_at_the_on_pressure_and_steps_up(self):
+        self.assertEqual(surge_level(1.9), 0)
+        self.assertEqual(surge_level(2.0), 1)
+        self.assertEqual(surge_level(3.5), 2)
+        self.assertEqual(surge_level(100), 8)
+
+    def test_surge_stops_only_below_the_off_pressure(self):
+        self.assertEqual(surge_level(1.5, current=1), 1)
+        self.assertEqual(surge_level(1.2, current=1), 1)
+        self.assertEqual(surge_level(1.1, current=1), 0)
+
+    def test_surge_steps_down_only_half_a_step_clear(self):
+        # Level 3 starts at 4.0; pressure just under it keeps it
+        self.assertEqual(surge_level(3.6, current=3), 3)
+        self.assertEqual(surge_level(3.4, current=3), 2)
+        self.assertEqual(surge_level(1.5, current=3), 1)
+
+    def test_rising_pressure_steps_up_at_once(self):
+        self.assertEqual(surge_level(5.0, current=1), 4)
+
+
+@override_settings(SURGE_ZONE_TTL=300, SURGE_MULTIPLIER_STEP=0.25)
+class SurgeZoneMaterializeTests(TestCase):
+
+    def setUp(self):
+        self.heatmap = DemandHeatmap(cell_size_deg=0.01)
+        self.cell = self.heatmap.cell_for(-26.2041, 28.0473)
+        self.now = float(int(time.time()))
+
+    def zones(self):
+        return list(SurgeMultiplier.objects.filter(is_automatic=True))
+
+    def at(self, seconds):
+        return datetime.fromtimestamp(self.now + seconds, tz=dt_timezone.utc)
+
+    def test_surging_cell_keeps_one_zone_that_is_extended(self):
+        self.heatmap.materialize({self.cell: 1}, now=self.now)
+        zone, = self.zones()
+        self.assertEqual(zone.multiplier, Decimal('1.25'))
+        self.assertEqual(zone.end_time, self.at(300))
+
+        # Not yet halfway through its time: left alone
+        self.assertEqual(self.heatmap.materialize({self.cell: 1}, now=self.now + 100), 0)
+        self.heatmap.materialize({self.cell: 1}, now=self.now + 200)
+        self.heatmap.materialize({self.cell: 2}, now=self.now + 210)
+
+        zone, = self.zones()
+        self.assertEqual(zone.multiplier, Decimal('1.50'))
+        self.assertEqual(zone.end_time, self.at(510))
+        self.assertTrue(zone.is_active)
+
+    def test_zone_of_a_cell_that_stopped_surging_ends(self):
+        self.heatmap.materialize({self.cell: 1}, now=self.now)
+
+        self.heatmap.materialize({}, now=self.now + 60)
+
+        zone, = self.zones()
+        self.assertFalse(zone.is_active)
+        self.assertEqual(zone.end_time, self.at(60))
+
+        # Surging again opens a new zone
+        self.heatmap.materialize({self.cell: 1}, now=self.now + 120)
+        self.assertEqual([zone.is_active for zone in self.zones()].count(True), 1)
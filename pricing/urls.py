@@ -4,6 +4,9 @@ from . import views
 urlpatterns = [
     path('vehicle-types/', views.vehicle_types, name='vehicle-types'),
     path('calculate-fares/', views.calculate_fares, name='calculate-fares'),
+    path('calculate-fares/batch/', views.calculate_fares_batch, name='calculate-fares-batch'),
+    path('quote-cache/stats/', views.quote_cache_stats, name='quote-cache-stats'),
+    path('heatmap/', views.demand_heatmap, name='demand-heatmap'),
     path('peak-hours/', views.peak_hours, name='peak-hours'),
     path('validate-promo/', views.validate_promo_code, name='validate-promo'),
 ]
@@ -1,129 +1,93 @@
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from rest_framework import status
+from rest_framework.throttling import UserRateThrottle
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from decimal import Decimal
-import math
 from datetime import datetime
+import logging
 
-from .models import VehicleType, PeakHour, SurgeMultiplier, DistanceTier, PromoCode
+import numpy as np
+
+from bookings.eta import get_eta_model, hour_of_week
+from geo.distance import haversine_pairwise
+from geo.routing import get_router
+
+from .models import VehicleType, PeakHour
+from .promos import promo_codes, redemptions_left
+from .heatmap import heatmap
+from .quote_cache import quote_cache, quote_key
+from .rules import get_rule_set
 from .serializers import (
     VehicleTypeSerializer,
     PeakHourSerializer,
     FareCalculationSerializer,
+    FareBatchSerializer,
     FareBreakdownSerializer
 )
 
+logger = logging.getLogger(__name__)
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points using Haversine formula"""
-    # Convert to radians
-    lat1_rad = math.radians(float(lat1))
-    lat2_rad = math.radians(float(lat2))
-    lon1_rad = math.radians(float(lon1))
-    lon2_rad = math.radians(float(lon2))
-
-    # Haversine formula
-    dlon = lon2_rad - lon1_rad
-    dlat = lat2_rad - lat1_rad
-    a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
-    c = 2 * math.asin(math.sqrt(a))
 
-    # Radius of earth in kilometers
-    r = 6371
-    return c * r
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Distance between two points by road, or in a straight line, per ROUTING_BACKEND"""
+    return get_router().route(lat1, lon1, lat2, lon2).distance_km
+
+
+def measure_trips(trips, request_time, eta):
+    """
+    Priced distance and estimated whole minutes of every trip.  Single and
+    batch quotes both measure trips here so they price the same trip
+    identically.
+
+    Distances come from the routing backend.  Durations come from the ETA
+    model, which learns from straight-line distances, with the road route's
+    free-flow time as a floor.
+    """
+    lats1 = [float(trip['pickup_latitude']) for trip in trips]
+    lons1 = [float(trip['pickup_longitude']) for trip in trips]
+    lats2 = [float(trip['dropoff_latitude']) for trip in trips]
+    lons2 = [float(trip['dropoff_longitude']) for trip in trips]
+    distances, road_minutes = get_router().route_many(lats1, lons1, lats2, lons2)
+    minutes = eta.minutes_many(
+        haversine_pairwise(lats1, lons1, lats2, lons2),
+        lats1,
+        lons1,
+        [hour_of_week(trip.get('request_time', request_time)) for trip in trips],
+    )
+    minutes = np.fmax(minutes, road_minutes)  # NaN where there is no route
+    return distances.tolist(), np.rint(minutes).astype(int).tolist()
 
 
 def get_peak_hour_multiplier(request_time):
     """Get peak hour multiplier for given time"""
-    from django.db.models import Q
-
-    day_of_week = request_time.weekday()  # Monday = 0, Sunday = 6
-    current_time = request_time.time()
-
-    # Check for peak hours (specific day or all days)
-    peak_hours = PeakHour.objects.filter(
-        is_active=True,
-        start_time__lte=current_time,
-        end_time__gte=current_time
-    ).filter(
-        Q(day_of_week=day_of_week) | Q(day_of_week__isnull=True)
-    ).order_by('-multiplier').first()
-
-    if peak_hours:
-        return peak_hours.multiplier, peak_hours.name
-    return Decimal('1.0'), None
+    return get_rule_set().peak_hour_multiplier(request_time)
 
 
 def get_surge_multiplier(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, request_time):
     """Get surge multiplier for given location and time"""
-    from django.db.models import Q
-
-    # Check for active surge pricing
-    surge_multipliers = SurgeMultiplier.objects.filter(
-        is_active=True
-    )
-
-    # Filter by time if specified
-    surge_multipliers = surge_multipliers.filter(
-        Q(start_time__isnull=True) | Q(start_time__lte=request_time),
-        Q(end_time__isnull=True) | Q(end_time__gte=request_time)
-    )
-
-    best_surge = None
-    best_multiplier = Decimal('1.0')
-
-    for surge in surge_multipliers:
-        # Check if location is within surge area
-        if surge.min_latitude and surge.max_latitude and surge.min_longitude and surge.max_longitude:
-            pickup_in_area = (
-                surge.min_latitude <= Decimal(str(pickup_lat)) <= surge.max_latitude and
-                surge.min_longitude <= Decimal(str(pickup_lon)) <= surge.max_longitude
-            )
-            dropoff_in_area = (
-                surge.min_latitude <= Decimal(str(dropoff_lat)) <= surge.max_latitude and
-                surge.min_longitude <= Decimal(str(dropoff_lon)) <= surge.max_longitude
-            )
-
-            if pickup_in_area or dropoff_in_area:
-                if surge.multiplier > best_multiplier:
-                    best_multiplier = surge.multiplier
-                    best_surge = surge.name
-        else:
-            # No geographic restriction, apply globally
-            if surge.multiplier > best_multiplier:
-                best_multiplier = surge.multiplier
-                best_surge = surge.name
-
-    return best_multiplier, best_surge
+    return get_rule_set().surge_multiplier(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, request_time)
 
 
 def get_distance_tier_rate(vehicle_type, distance_km):
     """Get per km rate based on distance tier"""
-    from django.db.models import Q
-
-    tier = DistanceTier.objects.filter(
-        vehicle_type=vehicle_type,
-        min_distance_km__lte=distance_km
-    ).filter(
-        Q(max_distance_km__gte=distance_km) | Q(max_distance_km__isnull=True)
-    ).order_by('-min_distance_km').first()
-
-    if tier:
-        return tier.per_km_rate
-    return vehicle_type.per_km_rate
+    return get_rule_set().distance_tier_rate(vehicle_type, distance_km)
 
 
 def calculate_fare(vehicle_type, distance_km, duration_minutes, pickup_lat, pickup_lon,
-                   dropoff_lat, dropoff_lon, request_time, promo_code=None):
+                   dropoff_lat, dropoff_lon, request_time, promo_code=None, rules=None):
     """Calculate fare with all multipliers and discounts"""
+    rules = rules or get_rule_set()
 
     # Base calculations
     base_fare = vehicle_type.base_fare
 
     # Get appropriate per km rate (from tiers or default)
-    per_km_rate = get_distance_tier_rate(vehicle_type, Decimal(str(distance_km)))
+    per_km_rate = rules.distance_tier_rate(vehicle_type, Decimal(str(distance_km)))
     distance_fare = per_km_rate * Decimal(str(distance_km))
 
     # Time-based fare
@@ -133,10 +97,10 @@ def calculate_fare(vehicle_type, distance_km, duration_minutes, pickup_lat, pick
     subtotal = base_fare + distance_fare + time_fare
 
     # Apply peak hour multiplier
-    peak_multiplier, peak_name = get_peak_hour_multiplier(request_time)
+    peak_multiplier, peak_name = rules.peak_hour_multiplier(request_time)
 
     # Apply surge multiplier
-    surge_multiplier, surge_name = get_surge_multiplier(
+    surge_multiplier, surge_name = rules.surge_multiplier(
         pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, request_time
     )
 
@@ -150,23 +114,20 @@ def calculate_fare(vehicle_type, distance_km, duration_minutes, pickup_lat, pick
     discount_amount = Decimal('0.00')
     promo_code_applied = None
 
-    if promo_code:
-        try:
-            promo = PromoCode.objects.get(code=promo_code, is_active=True)
-            is_valid, message = promo.is_valid()
+    promo = promo_codes.get(promo_code) if promo_code else None
+    if promo:
+        is_valid, message = promo.is_valid()
 
-            if is_valid and total_before_discount >= promo.min_fare:
-                if promo.discount_type == 'percentage':
-                    discount = (promo.discount_value / Decimal('100.0')) * total_before_discount
-                    if promo.max_discount:
-                        discount = min(discount, promo.max_discount)
-                    discount_amount = discount
-                else:  # fixed
-                    discount_amount = min(promo.discount_value, total_before_discount)
+        if is_valid and total_before_discount >= promo.min_fare:
+            if promo.discount_type == 'percentage':
+                discount = (promo.discount_value / Decimal('100.0')) * total_before_discount
+                if promo.max_discount:
+                    discount = min(discount, promo.max_discount)
+                discount_amount = discount
+            else:  # fixed
+                discount_amount = min(promo.discount_value, total_before_discount)
 
-                promo_code_applied = promo_code
-        except PromoCode.DoesNotExist:
-            pass
+            promo_code_applied = promo_code
 
     # Final fare
     final_fare = max(total_before_discount - discount_amount, vehicle_type.minimum_fare)
@@ -190,6 +151,48 @@ def calculate_fare(vehicle_type, distance_km, duration_minutes, pickup_lat, pick
     }
 
 
+
+def quote_trip(trip, distance_km, duration_minutes, request_time, promo_code, rules):
+    """Fares for one trip: every active vehicle type, or only the requested one"""
+    # Get vehicle types to calculate for
+    if trip.get('vehicle_type_id'):
+        vehicle_type = rules.vehicle_type(trip['vehicle_type_id'])
+        vehicle_types_list = [vehicle_type] if vehicle_type else []
+    else:
+        vehicle_types_list = rules.vehicle_types
+
+    # Calculate fare for each vehicle type
+    return [
+        calculate_fare(
+            vehicle_type=vehicle_type,
+            distance_km=distance_km,
+            duration_minutes=duration_minutes,
+            pickup_lat=trip['pickup_latitude'],
+            pickup_lon=trip['pickup_longitude'],
+            dropoff_lat=trip['dropoff_latitude'],
+            dropoff_lon=trip['dropoff_longitude'],
+            request_time=request_time,
+            promo_code=promo_code,
+            rules=rules
+        )
+        for vehicle_type in vehicle_types_list
+    ]
+
+
+def serialized_quote(trip, request_time, promo_code, rules, eta, distance_km=None, duration_minutes=None):
+    """Serialized fares for one trip, served from the quote cache when possible"""
+    key = quote_key(trip, request_time, promo_code, rules, eta)
+    fares = quote_cache.get(key)
+    if fares is None:
+        if distance_km is None:
+            (distance_km,), (duration_minutes,) = measure_trips([trip], request_time, eta)
+        fares = FareBreakdownSerializer(
+            quote_trip(trip, distance_km, duration_minutes, request_time, promo_code, rules),
+            many=True
+        ).data
+        quote_cache.set(key, fares)
+    return fares
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def vehicle_types(request):
@@ -210,48 +213,91 @@ def calculate_fares(request):
 
     data = serializer.validated_data
 
-    # Calculate distance
-    distance_km = calculate_distance(
-        data['pickup_latitude'],
-        data['pickup_longitude'],
-        data['dropoff_latitude'],
-        data['dropoff_longitude']
-    )
+    # Use current time if not specified
+    request_time = data.get('request_time', timezone.now())
 
-    # Estimate duration (rough estimate: 2 minutes per km in city traffic)
-    duration_minutes = int(distance_km * 2)
+    # Every fare in this response is priced from the same rule snapshot
+    rules = get_rule_set()
 
-    # Use current time if not specified
+    fares = serialized_quote(data, request_time, data.get('promo_code'), rules, get_eta_model())
+    return Response(fares, headers={'X-Pricing-Rules-Version': rules.version})
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])  # Allow unauthenticated access for testing
+def calculate_fares_batch(request):
+    """Calculate fares for many trips in one request, streaming the results"""
+    serializer = FareBatchSerializer(data=request.data)
+
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    data = serializer.validated_data
+    trips = data['trips']
+
+    # Batch-level defaults; a trip may override them
     request_time = data.get('request_time', timezone.now())
+    promo_code = data.get('promo_code')
+
+    # One rule snapshot and one distance and duration pass for the whole batch
+    rules = get_rule_set()
+    eta = get_eta_model()
+    distances, durations = measure_trips(trips, request_time, eta)
+
+    def results():
+        renderer = JSONRenderer()
+        yield f'{{"rules_version": "{rules.version}", "count": {len(trips)}, "results": ['.encode()
+        for index, (trip, distance_km, duration_minutes) in enumerate(zip(trips, distances, durations)):
+            # The status line has gone out with the first chunk, so a trip
+            # that fails is reported in its own item and the JSON stays whole
+            try:
+                result = {
+                    'index': index,
+                    'reference': trip.get('reference'),
+                    'fares': serialized_quote(
+                        trip,
+                        trip.get('request_time', request_time),
+                        trip.get('promo_code', promo_code),
+                        rules,
+                        eta,
+                        distance_km=distance_km,
+                        duration_minutes=duration_minutes
+                    ),
+                }
+            except Exception:
+                logger.exception(f'Pricing trip {index} of a fare batch failed')
+                result = {
+                    'index': index,
+                    'reference': trip.get('reference'),
+                    'error': 'Could not calculate fares for this trip',
+                }
+            yield (b',' if index else b'') + renderer.render(result)
+        yield b']}'
+
+    response = StreamingHttpResponse(results(), content_type='application/json')
+    response['X-Pricing-Rules-Version'] = rules.version
+    return response
 
-    # Get vehicle types to calculate for
-    if 'vehicle_type_id' in data and data['vehicle_type_id']:
-        vehicle_types_list = VehicleType.objects.filter(
-            id=data['vehicle_type_id'],
-            is_active=True
-        )
-    else:
-        vehicle_types_list = VehicleType.objects.filter(is_active=True).order_by('-priority', 'name')
 
-    # Calculate fare for each vehicle type
-    fares = []
-    for vehicle_type in vehicle_types_list:
-        fare_data = calculate_fare(
-            vehicle_type=vehicle_type,
-            distance_km=distance_km,
-            duration_minutes=duration_minutes,
-            pickup_lat=data['pickup_latitude'],
-            pickup_lon=data['pickup_longitude'],
-            dropoff_lat=data['dropoff_latitude'],
-            dropoff_lon=data['dropoff_longitude'],
-            request_time=request_time,
-            promo_code=data.get('promo_code')
-        )
-        fares.append(fare_data)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def quote_cache_stats(request):
+    """Hit/miss counters of the fare quote cache and the promo code cache"""
+    return Response({
+        **quote_cache.metrics(),
+        'rules_version': get_rule_set().version,
+        'promo_codes': promo_codes.metrics(),
+    })
 
-    # Serialize response
-    fare_serializer = FareBreakdownSerializer(fares, many=True)
-    return Response(fare_serializer.data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def demand_heatmap(request):
+    """Live requests, available drivers and automatic surge per heatmap cell"""
+    return Response({
+        **heatmap.snapshot(),
+        'auto_surge_enabled': settings.SURGE_AUTO_ENABLED,
+    })
 
 
 @api_view(['GET'])
@@ -263,8 +309,14 @@ def peak_hours(request):
     return Response(serializer.data)
 
 
+class PromoCodeRateThrottle(UserRateThrottle):
+    """Caps promo code checks per user, so codes cannot be found by guessing"""
+    scope = 'promo_codes'
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([PromoCodeRateThrottle])
 def validate_promo_code(request):
     """Validate a promo code"""
     code = request.data.get('code')
@@ -276,35 +328,37 @@ def validate_promo_code(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    try:
-        promo = PromoCode.objects.get(code=code)
-        is_valid, message = promo.is_valid()
+    promo = promo_codes.get(code)
+    if promo is None:
+        return Response({'valid': False, 'message': 'Invalid promo code'})
 
-        if not is_valid:
-            return Response({'valid': False, 'message': message})
+    is_valid, message = promo.is_valid()
 
-        if Decimal(str(fare_amount)) < promo.min_fare:
-            return Response({
-                'valid': False,
-                'message': f'Minimum fare of R{promo.min_fare} required'
-            })
+    if not is_valid:
+        return Response({'valid': False, 'message': message})
 
-        # Calculate discount
-        if promo.discount_type == 'percentage':
-            discount = (promo.discount_value / Decimal('100.0')) * Decimal(str(fare_amount))
-            if promo.max_discount:
-                discount = min(discount, promo.max_discount)
-        else:
-            discount = promo.discount_value
+    if redemptions_left(promo, request.user) == 0:
+        return Response({'valid': False, 'message': 'You have already used this promo code'})
 
+    if Decimal(str(fare_amount)) < promo.min_fare:
         return Response({
-            'valid': True,
-            'message': 'Promo code is valid',
-            'discount_type': promo.discount_type,
-            'discount_value': promo.discount_value,
-            'discount_amount': discount.quantize(Decimal('0.01')),
-            'description': promo.description
+            'valid': False,
+            'message': f'Minimum fare of R{promo.min_fare} required'
         })
 
-    except PromoCode.DoesNotExist:
-        return Response({'valid': False, 'message': 'Invalid promo code'})
+    # Calculate discount
+    if promo.discount_type == 'percentage':
+        discount = (promo.discount_value / Decimal('100.0')) * Decimal(str(fare_amount))
+        if promo.max_discount:
+            discount = min(discount, promo.max_discount)
+    else:
+        discount = promo.discount_value
+
+    return Response({
+        'valid': True,
+        'message': 'Promo code is valid',
+        'discount_type': promo.discount_type,
+        'discount_value': promo.discount_value,
+        'discount_amount': discount.quantize(Decimal('0.01')),
+        'description': promo.description
+    })